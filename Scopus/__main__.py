@@ -0,0 +1,6 @@
+# Run the loader with `python -m Scopus`.
+# Unlike running Scopus/db_loader.py as a script, this does not make
+# processes started by spawn or forkserver re-import the loader (and Django).
+from Scopus.db_loader import main
+
+main()
@@ -1,6 +1,12 @@
 from django.contrib import admin
+from django.db import connections
+from django.db.models import Q
 
 from . import models
+from . import fulltext
+from . import citations
+from . import compression
+from .admin_paging import LargeTableAdmin, LimitedInline, RequestDatabaseMixin
 
 # Hide default auth display in admin
 
@@ -10,7 +16,6 @@ from django.contrib.auth.models import Group
 admin.site.unregister(User)
 admin.site.unregister(Group)
 
-# TODO: display Citations on Document
 # TODO: display non-ForeignKey IDs as if they were
 
 
@@ -18,21 +23,81 @@ def _field_names(model):
     return [field.name for field in model._meta.get_fields() if not field.related_model]
 
 
-class AbstractInline(admin.TabularInline):
+class FullTextSearchMixin(object):
+    """Search with a full-text index (see fulltext.py), best matches first
+
+    Falls back to search_fields where the index is unavailable, or
+    SCOPUS_FULLTEXT is not set.
+    """
+    fulltext_index = 'document'
+    fulltext_columns = None
+    # the field holding the primary key of the indexed record
+    fulltext_field = 'pk'
+
+    def get_fulltext_queryset(self, queryset, search_term):
+        # The best matches are selected and ranked by subqueries of the
+        # index, so that no list of them is passed to the database. Where
+        # sharded, each shard's records are found in its own index.
+        connection = connections[queryset.db]
+        opts = queryset.model._meta
+        field = opts.pk if self.fulltext_field == 'pk' else opts.get_field(self.fulltext_field)
+        key = '%s.%s' % (connection.ops.quote_name(opts.db_table),
+                         connection.ops.quote_name(field.column))
+        match = fulltext.match_sql(search_term, self.fulltext_index,
+                                   columns=self.fulltext_columns, using=queryset.db)
+        where, params = [], []
+        if match is not None:
+            keys_sql, keys_params, rank_sql, rank_params = match
+            where.append('%s IN (%s)' % (key, keys_sql))
+            params.extend(keys_params)
+        if search_term.strip().isdigit():
+            # also find a record by its ID, listed first
+            where.append('%s = %%s' % key)
+            params.append(int(search_term))
+            queryset = queryset.extra(
+                select={'search_id': 'CASE WHEN %s = %%s THEN 0 ELSE 1 END' % key},
+                select_params=[int(search_term)])
+        if not where:
+            return queryset.none()
+        queryset = queryset.extra(where=['(%s)' % ' OR '.join(where)], params=params)
+        ordering = ['search_id'] if search_term.strip().isdigit() else []
+        if match is not None:
+            queryset = queryset.extra(select={'search_rank': rank_sql.format(key=key)},
+                                      select_params=rank_params)
+            ordering.append('search_rank')
+        return queryset.order_by(*ordering)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not (search_term.strip() and fulltext.is_enabled()
+                and fulltext.is_available(self.fulltext_index)):
+            return super(FullTextSearchMixin, self).get_search_results(request, queryset,
+                                                                       search_term)
+        return self.get_fulltext_queryset(queryset, search_term), False
+
+
+class AbstractInline(RequestDatabaseMixin, admin.TabularInline):
     extra = 0
     can_delete = False
     show_change_link = False
     model = models.Abstract
 
 
-class AuthorshipInline(admin.TabularInline):
+class CompressedAbstractInline(RequestDatabaseMixin, admin.TabularInline):
+    extra = 0
+    can_delete = False
+    show_change_link = False
+    model = models.CompressedAbstract
+    readonly_fields = ('abstract',)
+
+
+class AuthorshipInline(LimitedInline):
     extra = 0
     can_delete = False
     show_change_link = True
     model = models.Authorship
 
 
-class ItemIDInline(admin.TabularInline):
+class ItemIDInline(LimitedInline):
     extra = 0
     can_delete = False
     show_change_link = True
@@ -40,32 +105,115 @@ class ItemIDInline(admin.TabularInline):
 
 
 @admin.register(models.Document)
-class DocumentAdmin(admin.ModelAdmin):
+class DocumentAdmin(FullTextSearchMixin, LargeTableAdmin):
     readonly_fields = _field_names(models.Document)
+    raw_id_fields = ('source',)
     inlines = [
-        AbstractInline,
+        CompressedAbstractInline if compression.is_enabled() else AbstractInline,
         AuthorshipInline,
         ItemIDInline,
     ]
     search_fields = ('eid', 'title', 'authorship__surname')
 
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        # Citations are shown in panels (see citations.py), paged by GET
+        # parameters <direction>_after
+        extra_context = dict(extra_context or {})
+        # found in its shard, if sharded
+        document = self.get_object(request, object_id)
+        if document is not None:
+            panels = []
+            for direction, title in [('cited_by', 'Cited by'), ('references', 'References')]:
+                after = request.GET.get(direction + '_after')
+                page = citations.citation_page(
+                    document, direction,
+                    after=int(after) if after and after.isdigit() else None)
+                page.update(direction=direction, title=title, first=after is not None)
+                panels.append(page)
+            extra_context['citation_panels'] = panels
+        return super(DocumentAdmin, self).change_view(request, object_id, form_url,
+                                                      extra_context)
+
 
 @admin.register(models.Source)
-class SourceAdmin(admin.ModelAdmin):
+class SourceAdmin(FullTextSearchMixin, LargeTableAdmin):
     readonly_fields = _field_names(models.Source)
+    fulltext_index = 'source'
     search_fields = ('source_id', 'source_title', 'source_abbrev', 'issn_print', 'issn_electronic')
 
 
 @admin.register(models.Authorship)
-class AuthorshipAdmin(admin.ModelAdmin):
-    search_fields = ('surname', 'affiliation', 'author_id', 'affiliation_id')
+class AuthorshipAdmin(FullTextSearchMixin, LargeTableAdmin):
+    search_fields = ('surname', 'affiliation', 'affiliation_ref__affiliation',
+                     'author_id', 'affiliation_id')
+    raw_id_fields = ('document', 'affiliation_ref')
+    fulltext_columns = ('authors',)
+    fulltext_field = 'document_id'
     readonly_fields = _field_names(models.Authorship)
     fields = (('author_id', 'document', 'order'),
               ('initials', 'surname'),
-              ('affiliation_id', 'affiliation', 'department'),
+              ('affiliation_id', 'affiliation_ref'),
+              'affiliation',
               ('country', 'city'))
 
+    def get_fulltext_queryset(self, queryset, search_term):
+        term = search_term.strip()
+        if term.isdigit():
+            return queryset.filter(Q(author_id=int(term)) | Q(affiliation_id=int(term)))
+        # authorships, by the named authors, of the documents found
+        surname = Q()
+        for word in fulltext._WORD_RE.findall(term):
+            if word.endswith('*'):
+                surname |= Q(surname__istartswith=word.rstrip('*'))
+            else:
+                surname |= Q(surname__iexact=word)
+        return (super(AuthorshipAdmin, self).get_fulltext_queryset(queryset, term)
+                .filter(surname))
+
+
+@admin.register(models.Affiliation)
+class AffiliationAdmin(LargeTableAdmin):
+    readonly_fields = _field_names(models.Affiliation)
+    list_display = ('id', 'affiliation_id', 'affiliation', 'country', 'city')
+    search_fields = ('=affiliation_id', 'affiliation')
+
 
 @admin.register(models.Citation)
-class CitationAdmin(admin.ModelAdmin):
+class CitationAdmin(LargeTableAdmin):
     readonly_fields = _field_names(models.Citation)
+
+
+@admin.register(models.CompactCitation)
+class CompactCitationAdmin(admin.ModelAdmin):
+    # cite_to is not unique, so records cannot be opened individually
+    list_display = ('cite_to', 'cite_from')
+    list_display_links = None
+    search_fields = ('=cite_to', '=cite_from')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(models.AuthorMetrics)
+class AuthorMetricsAdmin(admin.ModelAdmin):
+    readonly_fields = _field_names(models.AuthorMetrics)
+    list_display = ('author_id', 'n_documents', 'first_year', 'last_year', 'n_citations', 'h_index')
+    search_fields = ('=author_id',)
+
+
+@admin.register(models.AffiliationMetrics)
+class AffiliationMetricsAdmin(admin.ModelAdmin):
+    readonly_fields = _field_names(models.AffiliationMetrics)
+    list_display = ('affiliation_id', 'n_documents', 'first_year', 'last_year', 'n_citations', 'h_index')
+    search_fields = ('=affiliation_id',)
+
+
+@admin.register(models.DocumentSummary)
+class DocumentSummaryAdmin(admin.ModelAdmin):
+    readonly_fields = _field_names(models.DocumentSummary)
+    list_display = ('pub_year', 'citation_type', 'title_language', 'source_type',
+                    'n_documents', 'n_citations')
+    list_filter = ('pub_year', 'citation_type', 'source_type')
@@ -0,0 +1,247 @@
+"""Admin change lists that stay fast on very large tables
+
+The default change list counts the rows of the table (and of the filtered
+result) with `COUNT(*)`, and pages with `OFFSET`. Both take time in
+proportion to the table size. `LargeTableAdmin` instead:
+
+* takes the row count of an unfiltered table from the database's
+  statistics (see `dbstats.estimated_row_count`), and counts filtered
+  results only up to COUNT_LIMIT;
+* pages through results in primary key order by seeking
+  (`?after=<pk>`: `WHERE pk < <pk> ORDER BY pk DESC LIMIT n`), which uses
+  the primary key index, however deep the page. OFFSET paging is only used
+  where results are sorted by another column, or ranked by search.
+
+With SCOPUS_SHARDS (see sharding.py), change lists of sharded tables merge
+a page of results from each shard, and counts are summed. Records are
+opened from the shard named by the `shard` parameter of their change
+list link, or else from the first shard holding their primary key, and
+inlines are read from the same shard. Ids other than EIDs are assigned
+by each shard, so are not unique across shards.
+"""
+
+from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.forms.models import BaseInlineFormSet
+from django.utils.functional import cached_property
+
+from Scopus.dbstats import estimated_row_count
+from Scopus import sharding
+
+
+# Filtered results are counted up to this many
+COUNT_LIMIT = 10000
+
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+SHARD_VAR = 'shard'
+
+# Request attribute holding the database of the record being changed
+_DATABASE_ATTR = 'scopus_database'
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator which avoids counting large tables exactly
+
+    `is_estimate` is True where `count` is not exact.
+    """
+
+    is_estimate = False
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if not query.where:
+            estimate = estimated_row_count(self.object_list.model._meta.db_table,
+                                           using=self.object_list.db)
+            if estimate is not None:
+                self.is_estimate = True
+                return estimate
+        count = self.object_list[:COUNT_LIMIT].count()
+        self.is_estimate = count == COUNT_LIMIT
+        return count
+
+
+class ShardedPaginator(Paginator):
+    """Paginator counting results in several shards, each with a paginator"""
+
+    def __init__(self, paginators, per_page):
+        super(ShardedPaginator, self).__init__([], per_page)
+        self.paginators = paginators
+
+    @cached_property
+    def count(self):
+        return sum(paginator.count for paginator in self.paginators)
+
+    @property
+    def is_estimate(self):
+        return any(getattr(paginator, 'is_estimate', False) for paginator in self.paginators)
+
+
+class KeysetChangeList(ChangeList):
+    """Change list paging by primary key where sorted by primary key
+
+    `keyset_next` and `keyset_previous` hold the pks to page from, if any.
+    """
+
+    def get_filters_params(self, params=None):
+        params = super(KeysetChangeList, self).get_filters_params(params)
+        for name in (AFTER_VAR, BEFORE_VAR):
+            params.pop(name, None)
+        return params
+
+    @cached_property
+    def sharded(self):
+        return sharding.is_sharded(self.model)
+
+    def _get_paginator(self, request):
+        if not self.sharded:
+            return self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        return ShardedPaginator([self.model_admin.get_paginator(request, self.queryset.using(using),
+                                                                self.list_per_page)
+                                 for using in sharding.shards()],
+                                self.list_per_page)
+
+    def _get_sharded_results(self, request):
+        """Results sorted by another column, merged from each shard"""
+        offset = self.page_num * self.list_per_page
+        result_list = []
+        for using in sharding.shards():
+            result_list.extend(self.queryset.using(using)[:offset + self.list_per_page])
+        sharding.sort_objects(result_list, self.queryset.query.order_by)
+        paginator = self._get_paginator(request)
+        self.result_count = paginator.count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = result_list[offset:offset + self.list_per_page]
+        self.can_show_all = False
+        self.multi_page = self.result_count > self.list_per_page
+        self.paginator = paginator
+
+    def url_for_result(self, result):
+        url = super(KeysetChangeList, self).url_for_result(result)
+        if self.sharded:
+            url += '?%s=%s' % (SHARD_VAR, result._state.db)
+        return url
+
+    def get_results(self, request):
+        ordering = tuple(self.queryset.query.order_by)
+        if ordering not in (('-pk',), ('pk',)):
+            # sorted by another column or ranked by search
+            if self.sharded:
+                self._get_sharded_results(request)
+            else:
+                super(KeysetChangeList, self).get_results(request)
+            self.keyset = False
+            return
+
+        descending = ordering == ('-pk',)
+        queryset = self.queryset
+        after = request.GET.get(AFTER_VAR)
+        before = request.GET.get(BEFORE_VAR)
+        if after is not None:
+            queryset = queryset.filter(**{'pk__lt' if descending else 'pk__gt': after})
+        elif before is not None:
+            queryset = queryset.filter(**{'pk__gt' if descending else 'pk__lt': before}).reverse()
+        # one more than needed tells us whether there is another page
+        if self.sharded:
+            result_list = []
+            for using in sharding.shards():
+                result_list.extend(queryset.using(using)[:self.list_per_page + 1])
+            result_list.sort(key=lambda obj: obj.pk,
+                             reverse=descending == (before is None))
+            result_list = result_list[:self.list_per_page + 1]
+        else:
+            result_list = list(queryset[:self.list_per_page + 1])
+        has_more = len(result_list) > self.list_per_page
+        result_list = result_list[:self.list_per_page]
+        if before is not None:
+            result_list.reverse()
+
+        paginator = self._get_paginator(request)
+        self.keyset = True
+        self.keyset_next = None
+        self.keyset_previous = None
+        if result_list:
+            if has_more or before is not None:
+                self.keyset_next = result_list[-1].pk
+            if after is not None or (before is not None and has_more):
+                self.keyset_previous = result_list[0].pk
+        self.result_count = paginator.count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = result_list
+        self.can_show_all = False
+        self.multi_page = self.keyset_next is not None or self.keyset_previous is not None
+        self.paginator = paginator
+
+    def keyset_url(self, var, pk):
+        return self.get_query_string({var: pk}, [AFTER_VAR, BEFORE_VAR])
+
+    def keyset_next_url(self):
+        return self.keyset_url(AFTER_VAR, self.keyset_next)
+
+    def keyset_previous_url(self):
+        return self.keyset_url(BEFORE_VAR, self.keyset_previous)
+
+    def keyset_first_url(self):
+        return self.get_query_string(remove=[AFTER_VAR, BEFORE_VAR])
+
+
+class RequestDatabaseMixin(object):
+    """Reads from the database in which the record being changed was found"""
+
+    def get_queryset(self, request):
+        queryset = super(RequestDatabaseMixin, self).get_queryset(request)
+        using = getattr(request, _DATABASE_ATTR, None)
+        return queryset if using is None else queryset.using(using)
+
+
+class LargeTableAdmin(RequestDatabaseMixin, admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    change_list_template = 'admin/keyset_change_list.html'
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_object(self, request, object_id, from_field=None):
+        if not sharding.is_sharded(self.model):
+            return super(LargeTableAdmin, self).get_object(request, object_id, from_field)
+        databases = sharding.shards()
+        if request.GET.get(SHARD_VAR) in databases:
+            databases = [request.GET[SHARD_VAR]]
+        for using in databases:
+            setattr(request, _DATABASE_ATTR, using)
+            obj = super(LargeTableAdmin, self).get_object(request, object_id, from_field)
+            if obj is not None:
+                return obj
+        delattr(request, _DATABASE_ATTR)
+        return None
+
+
+class LimitedInlineFormSet(BaseInlineFormSet):
+    """Shows at most the inline's `max_shown` records"""
+
+    max_shown = 50
+
+    def get_queryset(self):
+        if not hasattr(self, '_limited_queryset'):
+            queryset = super(LimitedInlineFormSet, self).get_queryset()
+            self._limited_queryset = queryset[:self.max_shown]
+        return self._limited_queryset
+
+
+class LimitedInline(RequestDatabaseMixin, admin.TabularInline):
+    """Tabular inline which shows at most `max_shown` records"""
+
+    formset = LimitedInlineFormSet
+    max_shown = 50
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super(LimitedInline, self).get_formset(request, obj, **kwargs)
+        formset.max_shown = self.max_shown
+        return formset
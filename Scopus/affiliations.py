@@ -0,0 +1,199 @@
+"""Optional dictionary encoding of authorship affiliations
+
+Each `Authorship` row repeats its affiliation's text, country and city,
+although a few distinct affiliations account for most rows. With
+`SCOPUS_NORMALIZE_AFFILIATIONS = True` in settings, each distinct
+(affiliation_id, affiliation, country, city) is stored once, in the
+`affiliation` table, keyed by afid and a hash of the text. Authorships are
+loaded referring to it by `affiliation_ref`, with their own affiliation,
+country and city left empty.
+
+The loader interns affiliations in a per-process cache of key to id, so
+that only affiliations it has not seen before are looked up, and those not
+yet in the table are inserted in bulk, ignoring any inserted concurrently
+by other loaders. Ids are only cached once committed, so that a rolled
+back transaction leaves none behind.
+
+The `authorship_denormalized` view, created by migration 0009, presents
+authorships in their original shape, taking affiliation, country and city
+from whichever table holds them. Use `details` in Python. Authorships
+loaded beforehand are converted by `manage.py normalize_affiliations`.
+"""
+
+import hashlib
+
+import django.db
+from django.conf import settings
+from django.db import transaction
+
+
+# Affiliations inserted or looked up per query; 5 parameters each
+BATCH_SIZE = 150
+
+# Authorships converted per transaction by `normalize_existing`
+NORMALIZE_BATCH_SIZE = 1000
+
+# Interned affiliations remembered by each process
+MAX_CACHE_SIZE = 1000000
+
+# Affiliation key to Affiliation.id, by database alias
+_cache = {}
+
+
+def is_enabled():
+    return getattr(settings, 'SCOPUS_NORMALIZE_AFFILIATIONS', False)
+
+
+def text_hash(affiliation, country, city):
+    text = u'\x00'.join([affiliation or u'', country or u'', city or u''])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _key(authorship):
+    afid = authorship.affiliation_id
+    return (-1 if afid is None else afid,
+            text_hash(authorship.affiliation, authorship.country, authorship.city))
+
+
+def details(authorship):
+    """(affiliation, country, city) of an authorship, in either storage
+
+    Select the authorship with `select_related('affiliation_ref')`.
+    """
+    if authorship.affiliation_ref_id is None:
+        return authorship.affiliation, authorship.country, authorship.city
+    ref = authorship.affiliation_ref
+    return ref.affiliation, ref.country, ref.city
+
+
+def _insert_ignore_sql(connection):
+    from Scopus.models import Affiliation
+    quote_name = connection.ops.quote_name
+    columns = ', '.join(quote_name(c) for c in
+                        ['affiliation_id', 'text_hash', 'affiliation', 'country', 'city'])
+    table = quote_name(Affiliation._meta.db_table)
+    if connection.vendor == 'sqlite':
+        return 'INSERT OR IGNORE INTO {t} ({cols}) VALUES {{values}}'.format(t=table, cols=columns)
+    if connection.vendor == 'mysql':
+        return 'INSERT IGNORE INTO {t} ({cols}) VALUES {{values}}'.format(t=table, cols=columns)
+    if connection.vendor == 'postgresql':
+        return ('INSERT INTO {t} ({cols}) VALUES {{values}} ON CONFLICT DO NOTHING'
+                .format(t=table, cols=columns))
+    return None
+
+
+def _lookup(keys, using='default'):
+    """Ids of the affiliations with keys, where present"""
+    from Scopus.models import Affiliation
+    ids = {}
+    keys = set(keys)
+    hashes = sorted(set(h for _, h in keys))
+    for start in range(0, len(hashes), BATCH_SIZE):
+        for pk, afid, h in (Affiliation.objects.using(using)
+                            .filter(text_hash__in=hashes[start:start + BATCH_SIZE])
+                            .values_list('id', 'affiliation_id', 'text_hash')):
+            if (afid, h) in keys:
+                ids[afid, h] = pk
+    return ids
+
+
+def _upsert(rows, using='default'):
+    """Insert affiliations not already present, returning all their ids
+
+    rows maps key to (affiliation, country, city).
+    """
+    from Scopus.models import Affiliation
+    connection = django.db.connections[using]
+    sql = _insert_ignore_sql(connection)
+    with transaction.atomic(using=using):
+        if sql is None:
+            existing = _lookup(rows, using=using)
+            Affiliation.objects.using(using).bulk_create(
+                [Affiliation(affiliation_id=afid, text_hash=h,
+                             affiliation=affiliation, country=country, city=city)
+                 for (afid, h), (affiliation, country, city) in sorted(rows.items())
+                 if (afid, h) not in existing],
+                batch_size=BATCH_SIZE)
+        else:
+            items = sorted(rows.items())
+            cursor = connection.cursor()
+            for start in range(0, len(items), BATCH_SIZE):
+                batch = items[start:start + BATCH_SIZE]
+                cursor.execute(sql.format(values=', '.join(['(%s, %s, %s, %s, %s)'] * len(batch))),
+                               [value for (afid, h), text in batch
+                                for value in (afid, h) + tuple(text)])
+    return _lookup(rows, using=using)
+
+
+def _remember(ids, using='default'):
+    """Cache ids once committed
+
+    Within a transaction, they are cached when it commits (Django 1.9+),
+    or otherwise not at all.
+    """
+    def update():
+        _cache.setdefault(using, {}).update(ids)
+
+    if not django.db.connections[using].in_atomic_block:
+        update()
+    elif hasattr(transaction, 'on_commit'):
+        transaction.on_commit(update, using=using)
+
+
+def intern(authorships, using='default'):
+    """Refer authorships to Affiliation records, creating any needed
+
+    Sets each authorship's affiliation_ref, and empties its affiliation,
+    country and city. Authorships must not yet be saved.
+    """
+    cache = _cache.setdefault(using, {})
+    keys = [_key(authorship) for authorship in authorships]
+    if len(cache) + len(keys) > MAX_CACHE_SIZE:
+        cache.clear()
+    missing = {}
+    for key, authorship in zip(keys, authorships):
+        if key not in cache:
+            missing[key] = (authorship.affiliation, authorship.country, authorship.city)
+    ids = {}
+    if missing:
+        ids = _upsert(missing, using=using)
+        _remember(ids, using=using)
+    for key, authorship in zip(keys, authorships):
+        authorship.affiliation_ref_id = ids[key] if key in ids else cache[key]
+        authorship.affiliation = ''
+        authorship.country = ''
+        authorship.city = ''
+
+
+def normalize_existing(batch_size=NORMALIZE_BATCH_SIZE, callback=None, using='default'):
+    """Intern the affiliations of authorships loaded without normalization
+
+    Works through authorships in id order, one transaction per batch, so
+    may be interrupted and run again. callback, if given, is called with
+    the number of authorships converted so far. Returns that number.
+    """
+    from Scopus.models import Authorship
+    connection = django.db.connections[using]
+    quote_name = connection.ops.quote_name
+    sql = ('UPDATE {t} SET {ref} = %s, {a} = %s, {co} = %s, {ci} = %s WHERE id = %s'
+           .format(t=quote_name(Authorship._meta.db_table), ref=quote_name('affiliation_ref_id'),
+                   a=quote_name('affiliation'), co=quote_name('country'), ci=quote_name('city')))
+    n_converted = 0
+    last_id = 0
+    while True:
+        with transaction.atomic(using=using):
+            batch = list(Authorship.objects.using(using)
+                         .filter(id__gt=last_id, affiliation_ref__isnull=True)
+                         .order_by('id')
+                         .only('id', 'affiliation_id', 'affiliation', 'country', 'city')
+                         [:batch_size])
+            if not batch:
+                return n_converted
+            last_id = batch[-1].id
+            intern(batch, using=using)
+            connection.cursor().executemany(
+                sql, [(authorship.affiliation_ref_id, '', '', '', authorship.id)
+                      for authorship in batch])
+        n_converted += len(batch)
+        if callback is not None:
+            callback(n_converted)
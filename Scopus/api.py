@@ -0,0 +1,310 @@
+"""Read-only JSON Lines API for looking up many records at once
+
+Endpoints, under /api/, each taking lists of IDs as comma-separated or
+repeated GET parameters, or as a POST body (a JSON list, a JSON object of
+parameter to list, or whitespace-separated IDs for the first parameter):
+
+* documents/?eid=...  or ?author_id=...  or ?source_id=... (Source.id),
+  with ?include=authors,itemids,abstract to add related records;
+* authorships/?eid=...  or ?author_id=...  or ?affiliation_id=...
+* sources/?source_id=...  or ?scopus_source_id=...
+* citations/?eid=...&direction=cited_by (default) or references
+
+Each response streams one JSON object per line. Records are fetched in
+chunks of CHUNK_SIZE IDs, with one query per chunk for each related table,
+so the number of queries does not grow with the number of records
+matched. Serialized documents are kept in an in-process LRU cache of
+SCOPUS_API_CACHE_SIZE documents, which is not invalidated: documents
+reloaded while the server runs may be served as they were, until it is
+restarted. Set SCOPUS_API_CACHE_SIZE = 0 where the data is being changed.
+
+With SCOPUS_SHARDS, lookups fan out to the shards which may hold the
+records, and results are merged (see sharding.py).
+
+Requires a logged-in user, unless `SCOPUS_API_PUBLIC = True` in settings.
+"""
+
+import functools
+import json
+import operator
+
+from django.conf import settings
+from django.conf.urls import url
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from Scopus.models import Document, Source, Authorship, ItemID, Citation, CompactCitation
+from Scopus import compact_citations
+from Scopus import compression
+from Scopus import affiliations
+from Scopus import sharding
+from Scopus.caching import LRUCache
+
+
+# IDs per query
+CHUNK_SIZE = 500
+
+# Most IDs accepted per request
+MAX_IDS = 10000
+
+# Serialized documents kept in each process
+CACHE_SIZE = 10000
+
+INCLUDES = ('authors', 'itemids', 'abstract')
+
+CONTENT_TYPE = 'application/x-ndjson'
+
+
+document_cache = LRUCache(getattr(settings, 'SCOPUS_API_CACHE_SIZE', CACHE_SIZE))
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _chunks(seq, size=CHUNK_SIZE):
+    for start in range(0, len(seq), size):
+        yield seq[start:start + size]
+
+
+def _get_ids(request, names):
+    """The first of names given in the request, and its list of int IDs"""
+    params = {}
+    if request.method == 'POST' and request.body.strip():
+        body = request.body.decode('utf-8')
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = body.split()
+        if isinstance(data, dict):
+            params.update(data)
+        else:
+            params[names[0]] = data
+    for name in names:
+        if name not in params and name in request.GET:
+            params[name] = [value for values in request.GET.getlist(name)
+                            for value in values.split(',') if value]
+    for name in names:
+        if name in params:
+            values = params[name]
+            if not isinstance(values, list):
+                values = [values]
+            try:
+                ids = [int(value) for value in values]
+            except (TypeError, ValueError):
+                raise BadRequest('%s must be integers' % name)
+            if len(ids) > MAX_IDS:
+                raise BadRequest('At most %d IDs may be requested at once' % MAX_IDS)
+            # remove duplicates, keeping order
+            seen = set()
+            return name, [x for x in ids if not (x in seen or seen.add(x))]
+    raise BadRequest('One of %s is required' % ', '.join(names))
+
+
+def _json_lines(records):
+    for record in records:
+        yield json.dumps(record, sort_keys=True) + '\n'
+
+
+def api_view(func):
+    """Streams the records func(request) yields, as JSON Lines
+
+    POST is accepted only to carry lists of IDs too long for a URL, and is
+    exempt from CSRF checks so that clients holding a session cookie need
+    no token: the views read but never write, and a forged cross-site
+    request cannot read their response.
+    """
+    @csrf_exempt
+    @require_http_methods(['GET', 'POST'])
+    def view(request):
+        if not (getattr(settings, 'SCOPUS_API_PUBLIC', False)
+                or request.user.is_authenticated()):
+            return JsonResponse({'error': 'Authentication required'}, status=403)
+        try:
+            # evaluate the request's parameters before streaming
+            records = func(request)
+        except BadRequest as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        return StreamingHttpResponse(_json_lines(records), content_type=CONTENT_TYPE)
+    view.__name__ = func.__name__
+    view.__doc__ = func.__doc__
+    return view
+
+
+def _source_dict(source):
+    return {'id': source.id,
+            'scopus_source_id': source.scopus_source_id,
+            'source_type': source.source_type,
+            'source_title': source.source_title,
+            'source_abbrev': source.source_abbrev,
+            'issn_print': source.issn_print,
+            'issn_electronic': source.issn_electronic}
+
+
+def _authorship_dict(authorship):
+    affiliation, country, city = affiliations.details(authorship)
+    return {'eid': authorship.document_id,
+            'author_id': authorship.author_id,
+            'initials': authorship.initials,
+            'surname': authorship.surname,
+            'order': authorship.order,
+            'affiliation_id': authorship.affiliation_id,
+            'affiliation': affiliation,
+            'country': country,
+            'city': city}
+
+
+def _fetch_documents(eids, includes):
+    """Serialized documents for eids (one chunk), in any order"""
+    documents = {}
+    for using, shard_eids in sharding.locate(eids):
+        documents.update(_fetch_shard_documents(shard_eids, includes, using))
+    return documents
+
+
+def _fetch_shard_documents(eids, includes, using='default'):
+    documents = {document.eid: {'eid': document.eid,
+                                'doi': document.doi,
+                                'pub_year': document.pub_year,
+                                'group_id': document.group_id,
+                                'title': document.title,
+                                'citation_count': document.citation_count,
+                                'title_language': document.title_language,
+                                'citation_type': document.citation_type,
+                                'source': _source_dict(document.source)}
+                 for document in (Document.objects.using(using).filter(eid__in=eids)
+                                  .select_related('source'))}
+    eids = list(documents)
+    if 'authors' in includes:
+        for document in documents.values():
+            document['authors'] = []
+        for authorship in (Authorship.objects.using(using).filter(document_id__in=eids)
+                           .select_related('affiliation_ref').order_by('order', 'id')):
+            authorship = _authorship_dict(authorship)
+            documents[authorship.pop('eid')]['authors'].append(authorship)
+    if 'itemids' in includes:
+        for document in documents.values():
+            document['itemids'] = {}
+        for document_id, item_type, item_id in (ItemID.objects.using(using)
+                                                .filter(document_id__in=eids)
+                                                .values_list('document_id', 'item_type', 'item_id')):
+            documents[document_id]['itemids'][item_type] = item_id
+    if 'abstract' in includes:
+        for document in documents.values():
+            document['abstract'] = None
+        for document_id, abstract in (compression.abstract_model().objects.using(using)
+                                      .filter(document_id__in=eids)
+                                      .values_list('document_id', 'abstract')):
+            documents[document_id]['abstract'] = abstract
+    return documents
+
+
+def _documents(eids, includes):
+    """Serialized documents for eids, in order, omitting those not found"""
+    for chunk in _chunks(eids):
+        found = {}
+        missing = []
+        for eid in chunk:
+            document = document_cache.get((eid, includes))
+            if document is None:
+                missing.append(eid)
+            else:
+                found[eid] = document
+        for eid, document in _fetch_documents(missing, includes).items():
+            document_cache.set((eid, includes), document)
+            found[eid] = document
+        for eid in chunk:
+            if eid in found:
+                yield found[eid]
+
+
+def _document_eids(name, ids):
+    """EIDs of documents by the given authors, or in the given sources"""
+    for chunk in _chunks(ids):
+        eids = set()
+        for using in sharding.read_aliases():
+            if name == 'author_id':
+                eids.update(Authorship.objects.using(using).filter(author_id__in=chunk)
+                            .values_list('document_id', flat=True).distinct())
+            else:
+                eids.update(Document.objects.using(using).filter(source_id__in=chunk)
+                            .values_list('eid', flat=True))
+        # Records are streamed one chunk of IDs at a time
+        for eid_chunk in _chunks(sorted(eids)):
+            yield eid_chunk
+
+
+@api_view
+def documents(request):
+    name, ids = _get_ids(request, ['eid', 'author_id', 'source_id'])
+    includes = tuple(sorted(set(value for value in request.GET.get('include', '').split(',')
+                                if value)))
+    for include in includes:
+        if include not in INCLUDES:
+            raise BadRequest('include must be from %s' % ', '.join(INCLUDES))
+    if name == 'eid':
+        return _documents(ids, includes)
+    return (document for eids in _document_eids(name, ids)
+            for document in _documents(eids, includes))
+
+
+def _shards_for(name, ids):
+    """(alias, ids) for the databases which may hold records with ids"""
+    if name == 'eid':
+        return sharding.locate(ids)
+    return [(using, ids) for using in sharding.read_aliases()]
+
+
+@api_view
+def authorships(request):
+    name, ids = _get_ids(request, ['eid', 'author_id', 'affiliation_id'])
+    field = 'document_id' if name == 'eid' else name
+    ordering = (field, 'document_id', 'order', 'id')
+
+    def key(authorship):
+        return tuple(getattr(authorship, attr) for attr in ordering)
+
+    return (_authorship_dict(authorship)
+            for chunk in _chunks(ids)
+            for authorship in sharding.merged(
+                [Authorship.objects.using(using).filter(**{field + '__in': shard_ids})
+                 .select_related('affiliation_ref').order_by(*ordering)
+                 for using, shard_ids in _shards_for(name, chunk)], key))
+
+
+@api_view
+def sources(request):
+    name, ids = _get_ids(request, ['source_id', 'scopus_source_id'])
+    field = 'id' if name == 'source_id' else name
+    return (_source_dict(source)
+            for chunk in _chunks(ids)
+            for source in Source.objects.filter(**{field + '__in': chunk}).order_by(field, 'id'))
+
+
+@api_view
+def citations(request):
+    name, eids = _get_ids(request, ['eid'])
+    direction = request.GET.get('direction', 'cited_by')
+    if direction not in ('cited_by', 'references'):
+        raise BadRequest('direction must be cited_by or references')
+    model = CompactCitation if compact_citations.is_compact() else Citation
+    field = 'cite_to' if direction == 'cited_by' else 'cite_from'
+    # citations are stored with the cited document
+    shards = (sharding.locate if direction == 'cited_by'
+              else functools.partial(_shards_for, 'cite_from'))
+    return ({'cite_to': cite_to, 'cite_from': cite_from}
+            for chunk in _chunks(eids)
+            for cite_to, cite_from in sharding.merged(
+                [model.objects.using(using).filter(**{field + '__in': shard_eids})
+                 .order_by(field).values_list('cite_to', 'cite_from').iterator()
+                 for using, shard_eids in shards(chunk)],
+                operator.itemgetter(0 if direction == 'cited_by' else 1)))
+
+
+urlpatterns = [
+    url(r'^documents/$', documents, name='api-documents'),
+    url(r'^authorships/$', authorships, name='api-authorships'),
+    url(r'^sources/$', sources, name='api-sources'),
+    url(r'^citations/$', citations, name='api-citations'),
+]
@@ -0,0 +1,741 @@
+"""Reading and pairing of Scopus XML from directories and archives
+
+Nothing here depends on Django, so that it may be used without a database,
+and in lean extraction workers.
+"""
+
+import fnmatch
+import logging
+import time
+import os
+import tarfile
+import zipfile
+import itertools
+import re
+import tempfile
+import shutil
+import sys
+import stat
+import struct
+import subprocess
+import threading
+import zlib
+import io
+from collections import OrderedDict
+
+try:
+    from queue import Full, Queue
+except ImportError:
+    from Queue import Full, Queue
+
+from Scopus.xml_extract import json_log
+
+
+# Bytes of unpaired XML held in memory while pairing before spilling to disk
+MAX_BACKLOG_BYTES = 256 * 1024 * 1024
+
+# Number of XML pairs that I/O threads may read ahead of extraction
+READ_AHEAD = 1000
+
+# Seconds an I/O thread waits on a full buffer before checking whether
+# the consumer has stopped
+PUT_TIMEOUT = 1
+
+
+# A path component naming a year, such as 2014 or 2014.zip
+_YEAR_RE = re.compile(r'^(\d{4})(?:\D|$)')
+
+_EID_RE = re.compile(r'(?<=2-s2.0-)[0-9]+')
+
+
+def path_eid(path):
+    """The EID in a Scopus XML path, or None"""
+    eids = _EID_RE.findall(path)
+    return int(eids[-1]) if eids else None
+
+
+def parse_ranges(value):
+    """Inclusive (low, high) ranges from a string like '1990,2000-2010'"""
+    ranges = []
+    for part in value.split(','):
+        low, sep, high = part.strip().partition('-')
+        if not low:
+            continue
+        ranges.append((int(low), int(high) if sep else int(low)))
+    return ranges
+
+
+def read_eids(path):
+    """EIDs listed one per line in a file, as written by `manage.py audit`"""
+    with open(path) as f:
+        return [int(line) for line in (line.strip() for line in f)
+                if line and not line.startswith('#')]
+
+
+class PathFilter(object):
+    """Selects documents by their paths, before any file is opened
+
+    Scopus data is laid out as <year>/.../2-s2.0-<eid>/{2-s2.0-<eid>.xml,
+    citedby.xml}, within archives which may themselves be named by year.
+    Directories and archives are pruned by the year their names begin
+    with, and by exclude patterns; archive members are selected from zip
+    central directories and tar headers, by year, EID and pattern. Paths
+    without a year are not excluded by year. Years are only read from
+    paths below the directories given to load, so that these may be named
+    like /data/2019-snapshot.
+
+    Parameters
+    ----------
+    years : collection of ints, optional
+    eid_ranges : list of (int, int), optional
+        Inclusive ranges of EIDs to select
+    eids : collection of ints, optional
+        Select only these EIDs
+    sample : float, optional
+        Select this fraction of EIDs, by a hash of the EID, which is stable
+        across runs
+    eid_modulo : (int, int), optional
+        (m, r) selects EIDs where eid % m == r
+    include : list of strings, optional
+        Select documents whose directory matches any of these glob patterns.
+        Within archives, the directory is that of the member.
+    exclude : list of strings, optional
+        Skip directories, archives and documents whose paths match any of
+        these glob patterns
+    """
+
+    def __init__(self, years=None, eid_ranges=None, sample=None,
+                 eid_modulo=None, include=None, exclude=None, eids=None):
+        self.years = None if years is None else set(years)
+        self.eid_ranges = eid_ranges
+        self.eids = None if eids is None else frozenset(eids)
+        self.sample = sample
+        self.eid_modulo = eid_modulo
+        self.include = include
+        self.exclude = exclude
+
+    def _years_ok(self, path):
+        if self.years is None or not path:
+            return True
+        for component in re.split(r'[\\/]', path):
+            match = _YEAR_RE.match(component)
+            if match and int(match.group(1)) not in self.years:
+                return False
+        return True
+
+    def _excluded(self, path):
+        return any(fnmatch.fnmatch(path, pattern) for pattern in self.exclude or ())
+
+    def allow_source(self, path, root=False):
+        """Whether a directory or archive may hold selected documents
+
+        Only the name of path is checked by year, its parent directories
+        having been checked as they were walked. A root directory, as
+        given to load, is not checked by year.
+        """
+        if not (root and os.path.isdir(path)) and not self._years_ok(os.path.basename(path)):
+            return False
+        return not self._excluded(path)
+
+    def allow_eid(self, eid):
+        if self.eids is not None and eid not in self.eids:
+            return False
+        if self.eid_ranges and not any(low <= eid <= high for low, high in self.eid_ranges):
+            return False
+        if self.eid_modulo is not None and eid % self.eid_modulo[0] != self.eid_modulo[1]:
+            return False
+        if self.sample is not None:
+            if (zlib.crc32(str(eid).encode('ascii')) & 0xFFFFFFFF) >= self.sample * 2 ** 32:
+                return False
+        return True
+
+    def allow_document(self, path, root=None):
+        """Whether an XML file or archive member is of a selected document
+
+        Both files of a document share a directory, and so are selected
+        together. Given the directory being walked as root, only the part
+        of path below it is checked by year.
+        """
+        directory = os.path.dirname(path)
+        if root is not None:
+            below_root = os.path.relpath(directory, root)
+            below_root = '' if below_root == os.curdir else below_root
+        else:
+            below_root = directory
+        if not self._years_ok(below_root) or self._excluded(directory):
+            return False
+        if self.include and not any(fnmatch.fnmatch(directory, pattern)
+                                    for pattern in self.include):
+            return False
+        eid = path_eid(path)
+        return eid is None or self.allow_eid(eid)
+
+
+def _with_retry(func, retries=3, wait=1, wait_mul=5):
+    # By default, wait 1s, 5s, 25s, 125s
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            if not retries:
+                raise
+            time.sleep(wait)
+            return _with_retry(func,
+                               retries=retries - 1,
+                               wait=wait * wait_mul,
+                               wait_mul=wait_mul)(*args, **kwargs)
+    return wrapper
+
+
+class _StreamReader(object):
+    """Wraps a non-seekable binary stream, allowing read data to be pushed back"""
+
+    def __init__(self, fileobj, chunk_size=2 ** 16):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self._pushed = b''
+
+    def unread(self, data):
+        self._pushed = data + self._pushed
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            data = self._pushed + self.fileobj.read()
+            self._pushed = b''
+            return data
+        parts = [self._pushed[:n]]
+        self._pushed = self._pushed[n:]
+        n -= len(parts[0])
+        while n > 0:
+            chunk = self.fileobj.read(n)
+            if not chunk:
+                break
+            parts.append(chunk)
+            n -= len(chunk)
+        return b''.join(parts)
+
+    def read_exactly(self, n):
+        data = self.read(n)
+        if len(data) != n:
+            raise EOFError('Stream ended %d bytes early' % (n - len(data)))
+        return data
+
+    def close(self):
+        self.fileobj.close()
+
+
+_ZIP_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+_ZIP_DATA_DESCRIPTOR_SIG = b'PK\x07\x08'
+
+
+def _zip64_sizes(extra):
+    """Get (uncompressed, compressed) sizes from a zip64 extra field"""
+    while len(extra) >= 4:
+        header_id, size = struct.unpack('<2H', extra[:4])
+        if header_id == 1:
+            return struct.unpack('<2Q', extra[4:20])
+        extra = extra[4 + size:]
+
+
+def _inflate_ended(decompressor, remaining):
+    """Whether a raw deflate stream has ended
+
+    Python 2's decompressors lack `eof`; data after the end of the stream is
+    then left in `unused_data`, or none remains of a member of known size.
+    """
+    if hasattr(decompressor, 'eof'):
+        return decompressor.eof
+    return bool(decompressor.unused_data) or remaining == 0
+
+
+def _generate_zip_stream(reader, select=None):
+    """Yields (filename, file object) from zip data read sequentially
+
+    Only local headers are used, so the central directory at the end of
+    the zip is not needed. Members with a trailing data descriptor are
+    supported when deflated, since the deflate stream marks its own end.
+
+    Members whose filename select(filename) rejects are skipped without
+    being decompressed, where their size is known from the local header.
+    """
+    while True:
+        header = reader.read(_ZIP_LOCAL_HEADER.size)
+        if not header.startswith(b'PK\x03\x04'):
+            # central directory or end of stream
+            return
+        (_, _, flags, method, _, _, _,
+         compressed_size, _, filename_len, extra_len) = _ZIP_LOCAL_HEADER.unpack(header)
+        filename = reader.read_exactly(filename_len).decode('utf-8' if flags & 0x800 else 'cp437')
+        extra = reader.read_exactly(extra_len)
+        if compressed_size == 0xFFFFFFFF:
+            compressed_size = _zip64_sizes(extra)[1]
+        has_descriptor = flags & 0x08
+        if select is not None and not has_descriptor and not select(filename):
+            while compressed_size > 0:
+                compressed_size -= len(reader.read_exactly(min(reader.chunk_size,
+                                                               compressed_size)))
+            continue
+        if method == zipfile.ZIP_DEFLATED:
+            decompressor = zlib.decompressobj(-15)
+            parts = []
+            remaining = None if has_descriptor else compressed_size
+            while not _inflate_ended(decompressor, remaining):
+                chunk = reader.read(reader.chunk_size if remaining is None
+                                    else min(reader.chunk_size, remaining))
+                if not chunk:
+                    raise EOFError('Zip stream ended within %r' % filename)
+                if remaining is not None:
+                    remaining -= len(chunk)
+                parts.append(decompressor.decompress(chunk))
+            parts.append(decompressor.flush())
+            reader.unread(decompressor.unused_data)
+            data = b''.join(parts)
+        elif method == zipfile.ZIP_STORED and not has_descriptor:
+            data = reader.read_exactly(compressed_size)
+        else:
+            raise ValueError('Unsupported compression for streaming zip '
+                             'member %r: method=%d, flags=%d'
+                             % (filename, method, flags))
+        if has_descriptor:
+            descriptor = reader.read_exactly(4)
+            if descriptor != _ZIP_DATA_DESCRIPTOR_SIG:
+                reader.unread(descriptor)
+            sizes_len = 16 if _zip64_sizes(extra) is not None else 8
+            reader.read_exactly(4 + sizes_len)
+        if select is not None and not select(filename):
+            continue
+        yield filename, io.BytesIO(data)
+
+
+def _is_stream(path):
+    """Whether path is to be read as a non-seekable stream"""
+    if path == '-' or path.endswith('.gpg'):
+        return True
+    try:
+        return stat.S_ISFIFO(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def _generate_stream_files(path, passphrase_file=None, select=None):
+    """Yields (path, file object) from a tar or zip stream
+
+    path may be '-' for stdin, a named pipe, or a GPG-encrypted tar or
+    zip, which is decrypted with `gpg -d` into a pipe rather than to disk.
+    Only members whose path select(path) accepts, if given, are yielded.
+    """
+    proc = None
+    if path == '-':
+        fileobj = getattr(sys.stdin, 'buffer', sys.stdin)
+    elif path.endswith('.gpg'):
+        cmd = ['gpg', '--batch', '--quiet', '--decrypt']
+        if passphrase_file is not None:
+            # GnuPG 2.1+ otherwise asks a pinentry agent, ignoring the file
+            cmd.extend(['--pinentry-mode', 'loopback',
+                        '--passphrase-file=' + passphrase_file])
+        proc = subprocess.Popen(cmd + [path], stdout=subprocess.PIPE)
+        fileobj = proc.stdout
+    else:
+        fileobj = _with_retry(open)(path, 'rb')
+
+    reader = _StreamReader(fileobj)
+    try:
+        magic = reader.read(4)
+        reader.unread(magic)
+        if magic == b'PK\x03\x04':
+            for tup in _generate_zip_stream(reader, select=select):
+                yield tup
+        else:
+            with tarfile.open(fileobj=reader, mode='r|*') as archive:
+                for info in archive:
+                    if select is not None and not select(info.path):
+                        continue
+                    # members must be read before advancing the stream
+                    yield info.path, archive.extractfile(info)
+        # consume the zip central directory or tar padding, so that the
+        # writer does not see a broken pipe
+        while reader.read(reader.chunk_size):
+            pass
+    finally:
+        if proc is None:
+            if path != '-':
+                fileobj.close()
+        else:
+            proc.stdout.close()
+            if proc.wait() != 0:
+                json_log(error='gpg failed to decrypt %r' % path,
+                         returncode=proc.returncode,
+                         method=logging.error)
+
+
+def _generate_files(path, recurse=True, passphrase_file=None, path_filter=None,
+                    root=True):
+    """Yields (path, file object) for files in path, selected by path_filter
+
+    Members of archives are yielded with their path within the archive.
+    root is False for subdirectories of the path given.
+    """
+    # XXX: Had some problems on windows with opening files. Will do so with
+    # retries.
+    if path_filter is None:
+        select = None
+    else:
+        select = path_filter.allow_document
+        if not path_filter.allow_source(path, root=root):
+            return
+    if os.path.isdir(path):
+        for child in os.listdir(path):
+            child = os.path.join(path, child)
+            if child.endswith('.xml'):
+                if select is None or select(child, root=path):
+                    yield child, _with_retry(open)(child, 'rb')
+            elif recurse:
+                for tup in _generate_files(child,
+                                           passphrase_file=passphrase_file,
+                                           path_filter=path_filter,
+                                           root=False):
+                    yield tup
+    elif _is_stream(path):
+        for tup in _generate_stream_files(path, passphrase_file, select=select):
+            yield tup
+    elif tarfile.is_tarfile(path):
+        with _with_retry(tarfile.open)(path, 'r') as archive:
+            for info in archive:
+                if select is None or select(info.path):
+                    yield info.path, archive.extractfile(info)
+    elif zipfile.is_zipfile(path):
+        archive = _with_retry(zipfile.ZipFile)(path, 'r')
+        # members are selected from the central directory
+        for info in archive.filelist:
+            if select is None or select(info.filename):
+                # zipfile cannot concurrently open multiple files :(
+                yield info.filename, _with_retry(archive.open)(info)
+
+
+def list_members(path, recurse=True, passphrase_file=None, path_filter=None,
+                 root=True):
+    """Yields the paths of XML files in path, without reading them
+
+    As for `_generate_files`, but zip members are listed from the central
+    directory, and tar members from their headers. Streamed archives are
+    read through, but their members are not decompressed where their size
+    is known.
+    """
+    if path_filter is not None and not path_filter.allow_source(path, root=root):
+        return
+    select = None if path_filter is None else path_filter.allow_document
+    if os.path.isdir(path):
+        for child in os.listdir(path):
+            child = os.path.join(path, child)
+            if child.endswith('.xml'):
+                if select is None or select(child, root=path):
+                    yield child
+            elif recurse:
+                for member in list_members(child, passphrase_file=passphrase_file,
+                                           path_filter=path_filter, root=False):
+                    yield member
+    elif _is_stream(path):
+        names = []
+
+        def collect(name):
+            if name.endswith('.xml') and (select is None or select(name)):
+                names.append(name)
+            return False
+
+        for _ in _generate_stream_files(path, passphrase_file, select=collect):
+            pass
+        for name in names:
+            yield name
+    elif tarfile.is_tarfile(path):
+        with _with_retry(tarfile.open)(path, 'r') as archive:
+            for info in archive:
+                if info.path.endswith('.xml') and (select is None or select(info.path)):
+                    yield info.path
+    elif zipfile.is_zipfile(path):
+        archive = _with_retry(zipfile.ZipFile)(path, 'r')
+        try:
+            for name in archive.namelist():
+                if name.endswith('.xml') and (select is None or select(name)):
+                    yield name
+        finally:
+            archive.close()
+
+
+class PairingBacklog(object):
+    """XML members awaiting their pair, with bounded memory usage
+
+    Up to max_bytes of XML is held in memory. Beyond that, the oldest
+    entries are spilled to an anonymous temporary file and are read back
+    when their pair arrives, so that memory use is predictable however
+    archive members are ordered.
+    """
+
+    def __init__(self, max_bytes=MAX_BACKLOG_BYTES):
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()  # key -> (path, xml)
+        self._spilled = {}  # key -> (path, offset, length)
+        self._spill_file = None
+        self.n_bytes = 0
+        self.peak_bytes = 0
+        self.peak_entries = 0
+        self.n_spilled = 0
+
+    def __len__(self):
+        return len(self._memory) + len(self._spilled)
+
+    def __contains__(self, key):
+        return key in self._memory or key in self._spilled
+
+    def paths(self):
+        return ([path for path, _ in self._memory.values()] +
+                [path for path, _, _ in self._spilled.values()])
+
+    def put(self, key, path, xml):
+        self._memory[key] = (path, xml)
+        if xml is not None:
+            self.n_bytes += len(xml)
+        while self.n_bytes > self.max_bytes and self._memory:
+            self._spill(*self._memory.popitem(last=False))
+        self.peak_bytes = max(self.peak_bytes, self.n_bytes)
+        self.peak_entries = max(self.peak_entries, len(self))
+
+    def _spill(self, key, value):
+        path, xml = value
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(prefix='scopus-backlog-')
+        self._spill_file.seek(0, os.SEEK_END)
+        offset = self._spill_file.tell()
+        if xml is not None:
+            self._spill_file.write(xml)
+            self.n_bytes -= len(xml)
+            length = len(xml)
+        else:
+            length = None
+        self._spilled[key] = (path, offset, length)
+        self.n_spilled += 1
+
+    def pop(self, key):
+        """Remove the entry for key, returning (path, xml)"""
+        if key in self._memory:
+            path, xml = self._memory.pop(key)
+            if xml is not None:
+                self.n_bytes -= len(xml)
+            return path, xml
+        path, offset, length = self._spilled.pop(key)
+        if length is None:
+            return path, None
+        self._spill_file.seek(offset)
+        return path, self._spill_file.read(length)
+
+    def close(self):
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+
+def generate_xml_pairs(path, eid_filter=None, count_only=False,
+                       max_backlog_bytes=MAX_BACKLOG_BYTES, recurse=True,
+                       passphrase_file=None, path_filter=None):
+    """Finds and returns contents for pairs of XML documents and citedby
+
+    path may be:
+        * a directory in which to find XML/TAR/ZIP files (in subdirectories
+          too if recurse)
+        * a tar file
+        * a zip file
+        * '-' or a named pipe, from which a tar or zip is streamed
+        * a GPG-encrypted tar or zip (.gpg), decrypted with passphrase_file
+
+    Members awaiting their pair are held in a PairingBacklog of at most
+    max_backlog_bytes in memory. Only documents selected by path_filter, a
+    `PathFilter`, are read; eid_filter(eid) is True for any further EIDs
+    to skip.
+    """
+    n_skips = 0
+    backlog = PairingBacklog(max_backlog_bytes)
+    for path, f in _generate_files(path, recurse=recurse,
+                                   passphrase_file=passphrase_file,
+                                   path_filter=path_filter):
+        if not path.endswith('.xml'):
+            if f is not None:
+                f.close()
+            continue
+
+        # TODO: filter before opening, or after pairing to avoid DB queries
+        if eid_filter is not None and eid_filter(path_eid(path)):
+            n_skips += 1
+            if n_skips % 100000 == 0:
+                json_log(info='Skipped %d files so far' % n_skips,
+                         method=logging.info)
+            f.close()
+            continue
+        if count_only:
+            xml = None
+        else:
+            xml = f.read()
+            f.close()
+        key = os.path.dirname(path)
+        if key in backlog:
+            other_path, other_xml = backlog.pop(key)
+            if other_path == path:
+                json_log(error='Found duplicate xmls for %r' % path,
+                         method=logging.error)
+                backlog.put(key, path, xml)
+                continue
+            if path.endswith('citedby.xml'):
+                yield other_path, other_xml, xml
+            else:
+                assert other_path.endswith('citedby.xml'), other_path
+                yield path, xml, other_xml
+
+        else:
+            backlog.put(key, path, xml)
+
+    if n_skips:
+        json_log(info='Skipped %d files (two per doc) altogether' % n_skips,
+                 method=logging.warning)
+    json_log(info='Pairing backlog peaked at %d bytes in memory' % backlog.peak_bytes,
+             peak_bytes=backlog.peak_bytes,
+             peak_entries=backlog.peak_entries,
+             n_spilled=backlog.n_spilled,
+             method=logging.warning if backlog.n_spilled else logging.info)
+    if backlog:
+        json_log(error='Found unpaired XML files: %s'
+                 % backlog.paths(),
+                 exception=True,
+                 method=logging.error)
+    backlog.close()
+
+
+def _iter_sources(path, path_filter=None, root=True):
+    """Split path into independently pairable sources
+
+    Each archive is a source, as is each directory of XML files (not
+    including its subdirectories). Yields (path, recurse) pairs, omitting
+    those that path_filter excludes.
+    """
+    if path_filter is not None and not path_filter.allow_source(path, root=root):
+        return
+    if not os.path.isdir(path):
+        yield path, True
+        return
+    has_xml = False
+    for child in sorted(os.listdir(path)):
+        if child.endswith('.xml'):
+            has_xml = True
+            continue
+        for tup in _iter_sources(os.path.join(path, child), path_filter=path_filter,
+                                 root=False):
+            yield tup
+    if has_xml:
+        yield path, False
+
+
+def _stage_to_scratch(path, scratch_dir):
+    """Copy an archive to local scratch space, returning the copy's path"""
+    fd, local_path = tempfile.mkstemp(prefix='scopus-',
+                                      suffix='-' + os.path.basename(path),
+                                      dir=scratch_dir)
+    os.close(fd)
+    _with_retry(shutil.copyfile)(path, local_path)
+    return local_path
+
+
+def _generate_source_pairs(source, scratch_dir=None, **kwargs):
+    path, recurse = source
+    if scratch_dir is None or os.path.isdir(path) or _is_stream(path):
+        for tup in generate_xml_pairs(path, recurse=recurse, **kwargs):
+            yield tup
+        return
+    local_path = _stage_to_scratch(path, scratch_dir)
+    try:
+        for tup in generate_xml_pairs(local_path, recurse=recurse, **kwargs):
+            yield tup
+    finally:
+        os.remove(local_path)
+
+
+_DONE = object()
+
+
+def read_ahead(paths, n_threads=1, buffer_size=READ_AHEAD, scratch_dir=None,
+               on_thread_exit=None, **kwargs):
+    """Generate XML pairs from paths, reading in background threads
+
+    Archive and file I/O is performed in n_threads threads, each of which
+    pairs XML from one source (see `_iter_sources`) at a time, so that
+    latency on network mounts is overlapped with extraction. At most
+    buffer_size pairs are held awaiting extraction.
+
+    Parameters
+    ----------
+    paths : list of strings
+    n_threads : int
+    buffer_size : int
+    scratch_dir : string, optional
+        If given, each archive is copied to a temporary file in this
+        directory before being read, and removed after. With multiple
+        threads, copies overlap with the reading of other archives.
+    on_thread_exit : callable, optional
+        Called in each I/O thread when it is done, e.g. to close database
+        connections used by an eid_filter.
+    **kwargs
+        Passed to `generate_xml_pairs`
+    """
+    sources = itertools.chain.from_iterable(
+        _iter_sources(path, path_filter=kwargs.get('path_filter'))
+        for path in paths)
+    lock = threading.Lock()
+    queue = Queue(maxsize=buffer_size)
+    # set when the consumer stops, so that threads do not block on a full
+    # queue forever
+    stopped = threading.Event()
+
+    def put(item):
+        """Queue item, unless the consumer has stopped; returns whether queued"""
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=PUT_TIMEOUT)
+                return True
+            except Full:
+                pass
+        return False
+
+    def work():
+        try:
+            while not stopped.is_set():
+                with lock:
+                    source = next(sources, None)
+                if source is None:
+                    break
+                for tup in _generate_source_pairs(source,
+                                                  scratch_dir=scratch_dir,
+                                                  **kwargs):
+                    if not put(tup):
+                        return
+        except Exception:
+            put(sys.exc_info())
+        finally:
+            if on_thread_exit is not None:
+                on_thread_exit()
+            put(_DONE)
+
+    for i in range(n_threads):
+        thread = threading.Thread(target=work, name='read-ahead-%d' % i)
+        # Do not block exit if the consumer stops early
+        thread.daemon = True
+        thread.start()
+
+    n_running = n_threads
+    try:
+        while n_running:
+            tup = queue.get()
+            if tup is _DONE:
+                n_running -= 1
+            elif len(tup) == 3 and isinstance(tup[1], BaseException):
+                # re-raise from I/O thread
+                raise tup[1]
+            else:
+                yield tup
+    finally:
+        stopped.set()
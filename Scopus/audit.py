@@ -0,0 +1,228 @@
+"""Reconciliation of archive contents against the database
+
+After a long load, `audit` finds documents that are missing from the
+database, present more than once in the archives, or only partly written,
+without a query per EID. Each side is reduced to sorted NumPy arrays:
+
+* the EIDs in the archives, from member names alone (zip central
+  directories, tar headers and directory listings; see
+  `archives.list_members`);
+* the EIDs of the document table, with their citation_count, and for each
+  other table the number of rows per document, by one streamed, grouped
+  query per table (in each database, with SCOPUS_SHARDS).
+
+These are then compared with vectorized set operations.
+
+A document is reported as partial where the table of item IDs (which
+every document has) holds none of its rows, or where citation_count is
+positive but no citation rows were written. Documents may legitimately
+lack authorships or an abstract, or have a citation_count differing from
+the number of citing EIDs listed, so these are counted but not reported
+as partial.
+
+The EIDs found missing may be loaded with the loader's `--eids-file`.
+Partial documents are skipped by the loader as already present, and must
+be deleted before they are reloaded.
+
+Requires numpy. Used by `manage.py audit`.
+"""
+
+import logging
+import os
+
+import django.db
+import numpy as np
+
+from Scopus.archives import list_members, path_eid
+from Scopus.graph import _Int64Chunks
+from Scopus.models import Authorship, CompactCitation, Citation, Document, ItemID
+from Scopus import compact_citations
+from Scopus import compression
+from Scopus import sharding
+
+
+# Rows fetched from the database at a time
+FETCH_SIZE = 100000
+
+# Tables holding rows per document, with their document column
+_ROW_TABLES = ('itemid', 'authorship', 'abstract', 'citation')
+
+
+def _table(name):
+    """(model, document column) of a table, in whichever storage is in use"""
+    if name == 'itemid':
+        return ItemID, 'document_id'
+    if name == 'authorship':
+        return Authorship, 'document_id'
+    if name == 'abstract':
+        return compression.abstract_model(), 'document_id'
+    return (CompactCitation if compact_citations.is_compact() else Citation), 'cite_to'
+
+
+def _fetch(sql, n_columns, using='default'):
+    """Rows of an integer query, as an array of shape (n_columns, n_rows)"""
+    cursor = django.db.connections[using].cursor()
+    cursor.execute(sql)
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.int64).reshape(-1, n_columns))
+    cursor.close()
+    if not chunks:
+        return np.zeros((n_columns, 0), dtype=np.int64)
+    return np.concatenate(chunks).T
+
+
+def _aliases(using):
+    return sharding.read_aliases() if using is None else [using]
+
+
+def _combined(arrays):
+    """Arrays of sorted (key, count) columns, one per database, as one
+
+    Counts of a key found in more than one database are summed.
+    """
+    rows = np.concatenate(arrays, axis=1)
+    rows = rows[:, np.argsort(rows[0], kind='mergesort')]
+    keys, starts = np.unique(rows[0], return_index=True)
+    counts = (np.add.reduceat(rows[1], starts) if len(keys)
+              else np.zeros(0, dtype=np.int64))
+    return np.array([keys, counts], dtype=np.int64).reshape(2, -1)
+
+
+def document_eids(using=None):
+    """Sorted EIDs of the document table, with their citation_count
+
+    Read from every database in SCOPUS_SHARDS, or `using` alone if given.
+    """
+    arrays = []
+    for alias in _aliases(using):
+        quote_name = django.db.connections[alias].ops.quote_name
+        arrays.append(_fetch('SELECT eid, citation_count FROM %s ORDER BY eid'
+                             % quote_name(Document._meta.db_table), 2, using=alias))
+    return _combined(arrays)
+
+
+def rows_per_document(table, using=None):
+    """Sorted EIDs having rows in table, with the number of rows of each
+
+    Read as by `document_eids`.
+    """
+    model, column = _table(table)
+    arrays = []
+    for alias in _aliases(using):
+        quote_name = django.db.connections[alias].ops.quote_name
+        arrays.append(_fetch('SELECT {c}, COUNT(*) FROM {t} GROUP BY {c} ORDER BY {c}'
+                             .format(c=quote_name(column),
+                                     t=quote_name(model._meta.db_table)),
+                             2, using=alias))
+    return _combined(arrays)
+
+
+def archive_eids(paths, **kwargs):
+    """EIDs of documents in the archives, from their member names
+
+    Returns (eids, citedby_eids), each sorted and including any repeats:
+    the EIDs of each document XML, and of each citedby.xml.
+
+    kwargs are passed to `archives.list_members`.
+    """
+    doc_eids, citedby_eids = _Int64Chunks(), _Int64Chunks()
+    for counter, member in enumerate(member for path in paths
+                                     for member in list_members(path, **kwargs)):
+        eid = path_eid(member)
+        if eid is None:
+            continue
+        if os.path.basename(member) == 'citedby.xml':
+            citedby_eids.append(eid)
+        else:
+            doc_eids.append(eid)
+        if counter % 1000000 == 0 and counter > 0:
+            logging.info('Listed %d archive members' % counter)
+    return np.sort(doc_eids.to_array()), np.sort(citedby_eids.to_array())
+
+
+def _counts_for(eids, keys, counts):
+    """counts for each of eids, looked up in sorted keys; 0 where absent"""
+    result = np.zeros(len(eids), dtype=np.int64)
+    if len(keys):
+        idx = np.minimum(np.searchsorted(keys, eids), len(keys) - 1)
+        found = keys[idx] == eids
+        result[found] = counts[idx[found]]
+    return result
+
+
+def audit(paths=(), tables=None, using=None, **kwargs):
+    """Compare archives (if any paths are given) with the database
+
+    Parameters
+    ----------
+    paths : list of strings
+        Archives or directories, as for the loader
+    tables : collection of strings, optional
+        The tables loaded, from db_loader.TABLES. Tables not loaded are not
+        checked. Default: all
+    using : string, optional
+        The database to check. Default: every database in SCOPUS_SHARDS
+    kwargs
+        Passed to `archives.list_members`, e.g. path_filter
+
+    Returns
+    -------
+    report : dict
+        Counts, by name
+    eids : dict
+        Sorted arrays of EIDs: 'missing' from the database, 'partial' in
+        the database, 'duplicated' in the archives, and 'unexpected' in the
+        database but not the archives
+    """
+    tables = set(_ROW_TABLES if tables is None else tables)
+    report = {}
+    eids = {}
+
+    db_eids, citation_count = document_eids(using=using)
+    report['db_documents'] = len(db_eids)
+
+    partial = []
+    for table in _ROW_TABLES:
+        if table not in tables:
+            continue
+        keys, counts = rows_per_document(table, using=using)
+        report[table + '_rows'] = int(counts.sum())
+        has_rows = np.in1d(db_eids, keys, assume_unique=True)
+        report['documents_without_' + table] = int(len(db_eids) - has_rows.sum())
+        # rows whose document is absent
+        orphaned = ~np.in1d(keys, db_eids, assume_unique=True)
+        report['orphaned_' + table + '_rows'] = int(counts[orphaned].sum())
+        if table == 'itemid':
+            partial.append(db_eids[~has_rows])
+        elif table == 'citation':
+            n_citations = _counts_for(db_eids, keys, counts)
+            report['citation_count_mismatches'] = int((n_citations != citation_count).sum())
+            partial.append(db_eids[(citation_count > 0) & (n_citations == 0)])
+    eids['partial'] = (np.unique(np.concatenate(partial)) if partial
+                       else np.zeros(0, dtype=np.int64))
+    report['partial'] = len(eids['partial'])
+
+    if paths:
+        doc_eids, citedby_eids = archive_eids(paths, **kwargs)
+        doc_eids, n_copies = np.unique(doc_eids, return_counts=True)
+        report['archive_documents'] = len(doc_eids)
+        eids['duplicated'] = doc_eids[n_copies > 1]
+        report['duplicated'] = len(eids['duplicated'])
+        report['unpaired'] = len(np.setxor1d(doc_eids, np.unique(citedby_eids),
+                                             assume_unique=True))
+        eids['missing'] = np.setdiff1d(doc_eids, db_eids, assume_unique=True)
+        report['missing'] = len(eids['missing'])
+        eids['unexpected'] = np.setdiff1d(db_eids, doc_eids, assume_unique=True)
+        report['unexpected'] = len(eids['unexpected'])
+    return report, eids
+
+
+def write_eids(path, eids):
+    """Write EIDs one per line, for the loader's --eids-file"""
+    with open(path, 'w') as f:
+        for eid in eids.tolist():
+            f.write('%d\n' % eid)
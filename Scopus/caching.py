@@ -0,0 +1,39 @@
+"""In-process caches shared by the API and lazy snapshot access
+
+Nothing here imports Django.
+"""
+
+import collections
+import threading
+
+
+class LRUCache(object):
+    """Thread-safe mapping which discards the least recently used items"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+            self._items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
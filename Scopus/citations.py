@@ -0,0 +1,124 @@
+"""Pages of the documents citing, or cited by, a document
+
+Used for the cited-by and references panels of the Document admin. Citation
+has no foreign key to Document, and a highly cited document may have tens
+of thousands of citing documents, so each panel shows one page at a time:
+
+* the citation table is read through its cite_to (or cite_from) index,
+  seeking past the previous page on a key stored in that index (`id` for
+  `citation`, the other EID for `citation_compact`), rather than sorting
+  all of a document's citations;
+* titles of a page of documents are fetched in one query;
+* the number of citing documents is Document.citation_count, from
+  citedby.xml, rather than a COUNT(*); references are counted only up to
+  COUNT_LIMIT.
+
+With SCOPUS_SHARDS, a document's citing documents are read from its
+shard, and the documents it cites from every shard (see sharding.py).
+
+Pages are cached (in Django's default cache) for CACHE_SECONDS, or
+`SCOPUS_CITATION_CACHE_SECONDS` in settings, so that popular documents are
+served without querying the citation table.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+
+from Scopus.models import Document, Citation, CompactCitation
+from Scopus import compact_citations
+from Scopus import sharding
+
+
+PAGE_SIZE = 25
+
+COUNT_LIMIT = 1000
+
+CACHE_SECONDS = 600
+
+# direction: (column matching the document, column of the other document)
+DIRECTIONS = {
+    'cited_by': ('cite_to', 'cite_from'),
+    'references': ('cite_from', 'cite_to'),
+}
+
+
+def _cache_seconds():
+    return getattr(settings, 'SCOPUS_CITATION_CACHE_SECONDS', CACHE_SECONDS)
+
+
+def _citation_model():
+    return CompactCitation if compact_citations.is_compact() else Citation
+
+
+def _page(direction, eid, after=None, limit=PAGE_SIZE, databases=('default',)):
+    model = _citation_model()
+    column, other = DIRECTIONS[direction]
+    # A key which the index on column also orders by. ids are not
+    # comparable across shards, so there the other EID is used.
+    key = 'id' if model is Citation and not sharding.is_enabled() else other
+    rows = []
+    for using in databases:
+        queryset = model.objects.using(using).filter(**{column: eid})
+        if after is not None:
+            queryset = queryset.filter(**{key + '__gt': after})
+        rows.extend(queryset.order_by(key).values_list(key, other)[:limit + 1])
+    rows = sorted(rows)[:limit + 1]
+    next_key = rows[limit - 1][0] if len(rows) > limit else None
+    eids = [other_eid for _, other_eid in rows[:limit]]
+
+    documents = {}
+    for using, shard_eids in sharding.locate(eids):
+        documents.update((doc_eid, (title, pub_year)) for doc_eid, title, pub_year in
+                         Document.objects.using(using).filter(eid__in=shard_eids)
+                         .values_list('eid', 'title', 'pub_year'))
+    return {
+        'documents': [(other_eid,) + documents.get(other_eid, (None, None))
+                      for other_eid in eids],
+        'next': next_key,
+    }
+
+
+def citation_page(document, direction, after=None, limit=PAGE_SIZE):
+    """One page of the documents citing, or cited by, document
+
+    Parameters
+    ----------
+    document : Document
+    direction : 'cited_by' or 'references'
+    after : int, optional
+        The 'next' value of the previous page
+    limit : int
+
+    Returns
+    -------
+    dict
+        'documents' is a list of (eid, title, pub_year), with title and
+        pub_year None for documents not loaded. 'next' is the value of
+        `after` for the next page, or None. 'count' is the total number of
+        documents, and 'count_limited' is True if more were not counted.
+    """
+    cache_key = 'Scopus.citations:%s:%s:%s:%s:%d' % (
+        _citation_model()._meta.db_table, direction, document.eid, after, limit)
+    page = cache.get(cache_key)
+    if page is None:
+        if direction == 'references':
+            databases = sharding.read_aliases()
+        elif document._state.db is not None:
+            # citations are stored with the cited document
+            databases = [document._state.db]
+        else:
+            databases = [using for using, _ in sharding.locate([document.eid])]
+        page = _page(direction, document.eid, after=after, limit=limit,
+                     databases=databases)
+        if direction == 'cited_by':
+            page['count'] = document.citation_count
+            page['count_limited'] = False
+        else:
+            column, _ = DIRECTIONS[direction]
+            page['count'] = min(COUNT_LIMIT, sum(
+                _citation_model().objects.using(using)
+                .filter(**{column: document.eid})[:COUNT_LIMIT].count()
+                for using in databases))
+            page['count_limited'] = page['count'] == COUNT_LIMIT
+        cache.set(cache_key, page, _cache_seconds())
+    return page
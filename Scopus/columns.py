@@ -0,0 +1,433 @@
+"""Columnar store of document attributes for analytics
+
+Filtering or counting documents by year, type, source or language through
+the ORM creates a model instance per row. Instead, `DocumentColumns` holds
+one NumPy array per attribute of Document (and its source's source_type),
+sorted by EID, so that filters and group-by counts are vectorized:
+
+* eid, pub_year, group_id (-1 where null), source_id and citation_count;
+* citation_type, title_language and source_type, dictionary-encoded: each
+  is an array of small integer codes into an array of its distinct values.
+
+A store is built from the database (`from_database`) and saved to a
+directory of `.npy` files which `DocumentColumns.load` memory-maps.
+`update` brings a saved store up to date after a load, fetching only the
+documents with EIDs beyond its newest, and comparing EIDs to find any
+loaded out of order (or deleted) only where the number of documents
+differs. `python -m Scopus.db_loader --columns DIR` runs it after loading.
+
+Requires numpy. Nothing here imports Django except the functions reading
+the database.
+
+Example::
+
+    python -m Scopus.columns /path/to/columns
+
+    >>> store = DocumentColumns.load('/path/to/columns')
+    >>> mask = store.where(pub_year__gte=2010, citation_type=['ar', 're'])
+    >>> store.count_by('source_type', mask)
+    {'j': 1520, 'p': 23}
+    >>> store.count_by(['pub_year', 'citation_type'])
+    {(2010, 'ar'): 1200, ...}
+"""
+
+import logging
+import os
+
+import numpy as np
+
+from Scopus.xml_extract import json_log
+
+
+# Columns, in the order they are fetched, with their dtypes
+COLUMNS = [
+    ('eid', np.int64),
+    ('pub_year', np.int16),
+    ('group_id', np.int64),
+    ('source_id', np.int64),
+    ('citation_count', np.int32),
+    ('citation_type', np.int16),
+    ('title_language', np.int16),
+    ('source_type', np.int16),
+]
+
+# Columns stored as codes into an array of values, saved as <name>_values.npy
+ENCODED = ('citation_type', 'title_language', 'source_type')
+
+LOOKUPS = ('exact', 'in', 'gt', 'gte', 'lt', 'lte')
+
+# Rows fetched from the database at a time
+FETCH_SIZE = 100000
+
+# EIDs per query, when fetching documents loaded out of EID order
+IN_SIZE = 1000
+
+_NAMES = [name for name, _ in COLUMNS]
+
+
+class DocumentColumns(object):
+    """Document attributes as arrays sorted by eid
+
+    Each of COLUMNS is an attribute, e.g. `store.pub_year[i]` is the year
+    of the document with EID `store.eid[i]`. For ENCODED columns the value
+    is `store.values[name][store.<name>[i]]`, or `decode(name, codes)`.
+    `index` maps EIDs to rows.
+    """
+
+    def __init__(self, columns, values):
+        for name in _NAMES:
+            setattr(self, name, columns[name])
+        self.values = values
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from chunks of database rows
+
+        rows is an iterable of lists of tuples, each holding the values of
+        COLUMNS, with strings for ENCODED columns and None for null.
+        """
+        values = dict((name, []) for name in ENCODED)
+        codes = dict((name, {}) for name in ENCODED)
+        chunks = []
+        for chunk in rows:
+            if not chunk:
+                continue
+            columns = list(zip(*chunk))
+            arrays = []
+            for (name, dtype), column in zip(COLUMNS, columns):
+                if name in ENCODED:
+                    column_codes = codes[name]
+                    for value in set(column):
+                        if value not in column_codes:
+                            column_codes[value] = len(values[name])
+                            values[name].append(value)
+                    column = [column_codes[value] for value in column]
+                elif name == 'group_id':
+                    column = [-1 if value is None else value for value in column]
+                arrays.append(np.array(column, dtype=dtype))
+            chunks.append(arrays)
+        columns = {}
+        for i, (name, dtype) in enumerate(COLUMNS):
+            columns[name] = (np.concatenate([chunk[i] for chunk in chunks]) if chunks
+                             else np.zeros(0, dtype=dtype))
+        values = dict((name, np.array([u'' if value is None else value
+                                       for value in values[name]], dtype=np.unicode_))
+                      for name in ENCODED)
+        return cls(columns, values)._sorted()
+
+    def _sorted(self):
+        if len(self.eid) and not (self.eid[1:] > self.eid[:-1]).all():
+            return self.take(np.argsort(self.eid, kind='mergesort'))
+        return self
+
+    def take(self, rows):
+        """A store of the given rows (an array of indices or boolean mask)"""
+        return DocumentColumns(dict((name, getattr(self, name)[rows]) for name in _NAMES),
+                               self.values)
+
+    def extended(self, other):
+        """A store of the rows of self and other, which must have no EIDs in common"""
+        other_values = dict((name, list(values)) for name, values in self.values.items())
+        columns = {}
+        for name in _NAMES:
+            column = getattr(other, name)
+            if name in ENCODED:
+                # recode other's values as self's, adding any new ones
+                known = dict((value, code) for code, value in enumerate(other_values[name]))
+                mapping = []
+                for value in other.values[name].tolist():
+                    if value not in known:
+                        known[value] = len(other_values[name])
+                        other_values[name].append(value)
+                    mapping.append(known[value])
+                column = np.array(mapping, dtype=column.dtype)[column]
+            columns[name] = np.concatenate([getattr(self, name), column])
+        values = dict((name, np.array(values, dtype=np.unicode_))
+                      for name, values in other_values.items())
+        return DocumentColumns(columns, values)._sorted()
+
+    def save(self, directory):
+        """Write each array to directory/<name>.npy
+
+        Each file is written under a temporary name and then renamed, so
+        that a store memory-mapped by another process remains readable.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        arrays = [(name, getattr(self, name)) for name in _NAMES]
+        arrays += [(name + '_values', self.values[name]) for name in ENCODED]
+        for name, array in arrays:
+            path = os.path.join(directory, name + '.npy')
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, array)
+            if os.path.exists(path):
+                # os.rename does not replace files on Windows
+                os.remove(path)
+            os.rename(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Load a saved store, memory-mapping its arrays by default"""
+        columns = dict((name, np.load(os.path.join(directory, name + '.npy'),
+                                      mmap_mode=mmap_mode))
+                       for name in _NAMES)
+        values = dict((name, np.load(os.path.join(directory, name + '_values.npy')))
+                      for name in ENCODED)
+        return cls(columns, values)
+
+    def __len__(self):
+        return len(self.eid)
+
+    def index(self, eids):
+        """Rows for an EID or array of EIDs, by binary search
+
+        Raises KeyError for EIDs not in the store.
+        """
+        scalar = np.ndim(eids) == 0
+        eids = np.atleast_1d(np.asarray(eids, dtype=np.int64))
+        rows = np.searchsorted(self.eid, eids)
+        missing = ~self._found(eids, rows)
+        if missing.any():
+            raise KeyError(eids[missing].tolist())
+        return rows[0] if scalar else rows
+
+    def _found(self, eids, rows):
+        found = rows < len(self.eid)
+        found[found] = self.eid[rows[found]] == eids[found]
+        return found
+
+    def contains(self, eids):
+        """Whether each of an array of EIDs is in the store"""
+        eids = np.atleast_1d(np.asarray(eids, dtype=np.int64))
+        return self._found(eids, np.searchsorted(self.eid, eids))
+
+    def codes(self, name, values):
+        """Codes of values of an ENCODED column; -1 for values not present"""
+        known = dict((value, code) for code, value in enumerate(self.values[name].tolist()))
+        return np.array([known.get(value, -1) for value in values], dtype=np.int16)
+
+    def decode(self, name, codes):
+        return self.values[name][codes]
+
+    def where(self, mask=None, **conditions):
+        """Boolean mask of the rows meeting all conditions
+
+        Conditions are given as for Django's filter, with lookups from
+        LOOKUPS, e.g. `where(pub_year__gte=2000, citation_type__in=['ar',
+        're'], source_type='j')`. A list or tuple without a lookup is taken
+        as `__in`. Values of ENCODED columns are strings, and only
+        `exact` and `in` apply to them. Rows must also be True in mask, if
+        given.
+        """
+        result = np.ones(len(self), dtype=bool) if mask is None else np.array(mask, dtype=bool)
+        for key, value in conditions.items():
+            name, _, lookup = key.partition('__')
+            if name not in _NAMES:
+                raise ValueError('Unknown column %r' % name)
+            if not lookup:
+                lookup = 'in' if isinstance(value, (list, tuple, set, frozenset)) else 'exact'
+            if lookup not in LOOKUPS:
+                raise ValueError('Unknown lookup %r' % lookup)
+            column = getattr(self, name)
+            if name in ENCODED:
+                if lookup not in ('exact', 'in'):
+                    raise ValueError('Only exact and in lookups apply to %s' % name)
+                value = self.codes(name, [value] if lookup == 'exact' else value)
+                lookup = 'in'
+            if lookup == 'exact':
+                result &= column == value
+            elif lookup == 'in':
+                result &= np.in1d(column, np.asarray(list(value)))
+            elif lookup == 'gt':
+                result &= column > value
+            elif lookup == 'gte':
+                result &= column >= value
+            elif lookup == 'lt':
+                result &= column < value
+            else:
+                result &= column <= value
+        return result
+
+    def count_by(self, names, mask=None):
+        """Number of rows with each value of a column, or combination of columns
+
+        Parameters
+        ----------
+        names : string or list of strings
+            Column names. Where a list, keys of the result are tuples
+        mask : array of bool, optional
+            Count only these rows, e.g. from `where`
+
+        Returns
+        -------
+        dict mapping values to counts, with ENCODED columns decoded
+        """
+        scalar = not isinstance(names, (list, tuple))
+        if scalar:
+            names = [names]
+        columns = [np.asarray(getattr(self, name)) for name in names]
+        if mask is not None:
+            columns = [column[mask] for column in columns]
+        if not len(columns[0]):
+            return {}
+        keys, counts = np.unique(np.stack([column.astype(np.int64) for column in columns], axis=1),
+                                 axis=0, return_counts=True)
+        keys = [self.decode(name, keys[:, i]).tolist() if name in ENCODED
+                else keys[:, i].tolist()
+                for i, name in enumerate(names)]
+        keys = keys[0] if scalar else list(zip(*keys))
+        return dict(zip(keys, counts.tolist()))
+
+    def record(self, eid):
+        """The attributes of one document, as a dict"""
+        row = self.index(eid)
+        return dict((name, self.decode(name, getattr(self, name)[row]).item() if name in ENCODED
+                     else getattr(self, name)[row].item())
+                    for name in _NAMES)
+
+
+def _select(connection):
+    from Scopus.models import Document, Source
+    quote_name = connection.ops.quote_name
+    columns = ['d.' + quote_name(Document._meta.get_field(name).column)
+               for name in ['eid', 'pub_year', 'group_id', 'source', 'citation_count',
+                            'citation_type', 'title_language']]
+    columns.append('s.' + quote_name(Source._meta.get_field('source_type').column))
+    return ('SELECT %s FROM %s d INNER JOIN %s s ON s.%s = d.%s'
+            % (', '.join(columns),
+               quote_name(Document._meta.db_table),
+               quote_name(Source._meta.db_table),
+               quote_name(Source._meta.pk.column),
+               quote_name(Document._meta.get_field('source').column)))
+
+
+def _fetch_rows(using, after=None, eids=None):
+    """Chunks of rows for COLUMNS: all, with EIDs above after, or of eids"""
+    import django.db
+    from Scopus.models import Document
+    connection = django.db.connections[using]
+    sql = _select(connection)
+    eid_column = 'd.' + connection.ops.quote_name(Document._meta.pk.column)
+    if eids is not None:
+        eids = [int(eid) for eid in eids]
+        queries = [(sql + ' WHERE %s IN (%s)' % (eid_column, ', '.join(['%s'] * len(chunk))), chunk)
+                   for chunk in (eids[i:i + IN_SIZE] for i in range(0, len(eids), IN_SIZE))]
+    elif after is not None:
+        queries = [(sql + ' WHERE %s > %%s' % eid_column, [int(after)])]
+    else:
+        queries = [(sql, [])]
+    for query, params in queries:
+        cursor = connection.cursor()
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            yield rows
+        cursor.close()
+
+
+def _aliases(using):
+    from Scopus import sharding
+    return sharding.read_aliases() if using is None else [using]
+
+
+def _document_eids(aliases):
+    import django.db
+    from Scopus.models import Document
+    chunks = []
+    for alias in aliases:
+        connection = django.db.connections[alias]
+        quote_name = connection.ops.quote_name
+        cursor = connection.cursor()
+        cursor.execute('SELECT %s FROM %s' % (quote_name(Document._meta.pk.column),
+                                              quote_name(Document._meta.db_table)))
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.int64).ravel())
+        cursor.close()
+    return np.sort(np.concatenate(chunks)) if chunks else np.zeros(0, dtype=np.int64)
+
+
+def _count_documents(aliases):
+    from Scopus.models import Document
+    return sum(Document.objects.using(alias).count() for alias in aliases)
+
+
+def from_database(using=None):
+    """Build a DocumentColumns from the Document and Source tables
+
+    Django must be set up. Rows are streamed from the database in chunks
+    of FETCH_SIZE. By default, documents are read from every shard (see
+    `sharding`), or the default database.
+    """
+    rows = (chunk for alias in _aliases(using) for chunk in _fetch_rows(alias))
+    return DocumentColumns.from_rows(rows)
+
+
+def update(directory, using=None):
+    """Bring the store saved in directory up to date with the database
+
+    Builds it if directory holds no store. Otherwise only documents with
+    EIDs beyond the store's newest are fetched, unless the store then
+    differs in size from the document table, in which case all EIDs are
+    compared to fetch those missing and drop those deleted. Documents
+    already in the store are not refreshed.
+
+    Returns (store, change in the number of rows).
+    """
+    aliases = _aliases(using)
+    if not os.path.exists(os.path.join(directory, 'eid.npy')):
+        store = from_database(using)
+        store.save(directory)
+        return store, len(store)
+
+    # loaded fully, as the saved files are replaced
+    store = DocumentColumns.load(directory, mmap_mode=None)
+    n_before = len(store)
+    after = store.eid[-1] if n_before else None
+    new = DocumentColumns.from_rows(chunk for alias in aliases
+                                    for chunk in _fetch_rows(alias, after=after))
+    store = store.extended(new)
+    if len(store) != _count_documents(aliases):
+        db_eids = _document_eids(aliases)
+        n_deleted = len(store)
+        store = store.take(np.in1d(store.eid, db_eids, assume_unique=True))
+        n_deleted -= len(store)
+        missing = np.setdiff1d(db_eids, store.eid, assume_unique=True)
+        json_log(info='Comparing columnar store with all EIDs',
+                 n_missing=len(missing), n_deleted=n_deleted)
+        if len(missing):
+            store = store.extended(DocumentColumns.from_rows(
+                chunk for alias in aliases
+                for chunk in _fetch_rows(alias, eids=missing.tolist())))
+    store.save(directory)
+    return store, len(store) - n_before
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Build or update a columnar store of documents')
+    parser.add_argument('out_dir', help='Directory of .npy files')
+    parser.add_argument('--rebuild', action='store_true', default=False,
+                        help='Build from scratch, rather than updating a saved store')
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)-15s %(message)s")
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Scopus.settings')
+    import django
+    django.setup()
+    if args.rebuild:
+        store = from_database()
+        store.save(args.out_dir)
+        n_added = len(store)
+    else:
+        store, n_added = update(args.out_dir)
+    json_log(info='Saved columnar store', out_dir=args.out_dir,
+             n_rows=len(store), n_added=n_added)
+
+
+if __name__ == '__main__':
+    main()
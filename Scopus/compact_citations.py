@@ -0,0 +1,84 @@
+"""Optional compact storage of citation edges
+
+The `citation` table stores each edge with a surrogate `id` and a separate
+index on each of `cite_to` and `cite_from`, several times the 16 bytes of
+data per edge. `citation_compact` instead has a composite primary key
+(cite_to, cite_from), which determines the physical row order (WITHOUT
+ROWID on SQLite, clustered on InnoDB and MSSQL), and a single secondary
+index on cite_from (which implicitly includes the primary key where the
+table is clustered on it, and is on (cite_from, cite_to) elsewhere). The
+table is created by migration 0004, and `citation_canonical`, keyed alike,
+by migration 0010.
+
+Set `SCOPUS_COMPACT_CITATIONS = True` in settings to load citations into
+`citation_compact` instead of `citation`. Existing citations can be copied
+across with `manage.py compact_citations`.
+"""
+
+import django.db
+from django.db import transaction
+from django.conf import settings
+
+
+TABLE = 'citation_compact'
+
+# Duplicate edges (e.g. repeated in citedby.xml, or saved again on retry)
+# are ignored. {values} is a VALUES list or a SELECT of (cite_to, cite_from).
+INSERT_SQL = {
+    'sqlite': 'INSERT OR IGNORE INTO {t} (cite_to, cite_from) {values}',
+    'mysql': 'INSERT IGNORE INTO {t} (cite_to, cite_from) {values}',
+    'postgresql': 'INSERT INTO {t} (cite_to, cite_from) {values} ON CONFLICT DO NOTHING',
+    None: 'INSERT INTO {t} (cite_to, cite_from) '
+          'SELECT DISTINCT v.cite_to, v.cite_from FROM ({values}) v (cite_to, cite_from) '
+          'WHERE NOT EXISTS (SELECT 1 FROM {t} x '
+          'WHERE x.cite_to = v.cite_to AND x.cite_from = v.cite_from)',
+}
+
+# Number of edges per INSERT statement, within SQLite's variable limit
+BATCH_SIZE = 450
+
+
+def is_compact():
+    return getattr(settings, 'SCOPUS_COMPACT_CITATIONS', False)
+
+
+def _for_vendor(mapping, connection):
+    return mapping.get(connection.vendor, mapping[None])
+
+
+def insert_edges(edges, using='default', table=TABLE):
+    """Insert (cite_to, cite_from) pairs, ignoring those already present"""
+    connection = django.db.connections[using]
+    cursor = connection.cursor()
+    edges = list(edges)
+    sql = _for_vendor(INSERT_SQL, connection)
+    for start in range(0, len(edges), BATCH_SIZE):
+        batch = edges[start:start + BATCH_SIZE]
+        values = 'VALUES ' + ', '.join(['(%s, %s)'] * len(batch))
+        cursor.execute(sql.format(t=table, values=values),
+                       [x for edge in batch for x in edge])
+
+
+def copy_from_citation(using='default', batch_size=1000000, start_id=0,
+                       callback=None):
+    """Copy edges from the citation table, in batches of ids
+
+    Returns the last id copied, from which copying may be resumed.
+    """
+    from Scopus.models import Citation
+
+    connection = django.db.connections[using]
+    sql = _for_vendor(INSERT_SQL, connection).format(
+        t=TABLE,
+        values='SELECT cite_to, cite_from FROM {c} WHERE id > %s AND id <= %s'
+               .format(c=Citation._meta.db_table))
+    max_id = Citation.objects.using(using).order_by('-id').values_list('id', flat=True).first()
+    last_id = start_id
+    while max_id is not None and last_id < max_id:
+        next_id = min(last_id + batch_size, max_id)
+        with transaction.atomic(using=using):
+            connection.cursor().execute(sql, [last_id, next_id])
+        last_id = next_id
+        if callback is not None:
+            callback(last_id, max_id)
+    return last_id
@@ -0,0 +1,197 @@
+"""Optional compressed storage of abstracts
+
+Abstracts make up most of the database's bytes, but are rarely queried.
+With `SCOPUS_ABSTRACT_COMPRESSION = 'zlib'` (or `'zstd'`) in settings,
+abstracts are loaded into `abstract_compressed` instead of `abstract`, as
+compressed BLOBs, which `CompressedTextField` decompresses transparently.
+
+Compression happens in `db_loader.aggregate_records`, and so in the loader's
+worker processes (except with --lean-workers), not in the process saving
+to the database. Compressed values carry a one-byte prefix naming their
+codec, so that either may be read whatever the setting.
+
+zstd requires the zstandard package. Short texts like abstracts compress
+much better with a dictionary trained on a sample of them: train one with
+`manage.py compress_abstracts --train-dictionary PATH` and set
+`SCOPUS_ZSTD_DICTIONARY = PATH`. Keep the dictionary: abstracts compressed
+with it cannot be read without it.
+
+`manage.py compress_abstracts` moves existing abstracts between the tables
+in batches; `--decompress` moves them back, as is needed before unapplying
+migration 0008, which drops `abstract_compressed`.
+"""
+
+import zlib
+
+import django.db
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import models, transaction
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+CODECS = ('zlib', 'zstd')
+
+_PREFIXES = {'zlib': b'z', 'zstd': b's'}
+
+ZLIB_LEVEL = 6
+
+ZSTD_LEVEL = 9
+
+# Bytes in a trained zstd dictionary
+DICTIONARY_SIZE = 112640
+
+# Abstracts moved per transaction
+BATCH_SIZE = 500
+
+# Compressors and decompressors, made once per process
+_zstd = {}
+
+
+class Compressed(bytes):
+    """Bytes already compressed, to be stored as they are"""
+
+
+def codec():
+    """The configured codec, or None where abstracts are not compressed"""
+    name = getattr(settings, 'SCOPUS_ABSTRACT_COMPRESSION', None)
+    if name is not None and name not in CODECS:
+        raise ValueError('SCOPUS_ABSTRACT_COMPRESSION must be one of %s, not %r'
+                         % (', '.join(CODECS), name))
+    return name
+
+
+def is_enabled():
+    return codec() is not None
+
+
+def abstract_model():
+    """The model abstracts are loaded into"""
+    from Scopus.models import Abstract, CompressedAbstract
+    return CompressedAbstract if is_enabled() else Abstract
+
+
+def _zstd_dictionary():
+    path = getattr(settings, 'SCOPUS_ZSTD_DICTIONARY', None)
+    if path is None:
+        return None
+    with open(path, 'rb') as f:
+        return zstandard.ZstdCompressionDict(f.read())
+
+
+def _zstd_codec(kind):
+    if zstandard is None:
+        raise ImportError('zstd compression requires the zstandard package')
+    if not _zstd:
+        dictionary = _zstd_dictionary()
+        _zstd['compressor'] = zstandard.ZstdCompressor(level=ZSTD_LEVEL,
+                                                       dict_data=dictionary)
+        _zstd['decompressor'] = zstandard.ZstdDecompressor(dict_data=dictionary)
+    return _zstd[kind]
+
+
+def compress(text, name=None):
+    """Compress text with the named (or configured) codec
+
+    Returns `Compressed` bytes.
+    """
+    if name is None:
+        name = codec() or 'zlib'
+    data = text.encode('utf-8')
+    if name == 'zstd':
+        data = _zstd_codec('compressor').compress(data)
+    else:
+        data = zlib.compress(data, ZLIB_LEVEL)
+    return Compressed(_PREFIXES[name] + data)
+
+
+def decompress(data):
+    """Text from bytes produced by `compress`"""
+    data = bytes(data)
+    prefix, data = data[:1], data[1:]
+    if prefix == _PREFIXES['zstd']:
+        data = _zstd_codec('decompressor').decompress(data)
+    elif prefix == _PREFIXES['zlib']:
+        data = zlib.decompress(data)
+    else:
+        raise ValueError('Unknown compression prefix %r' % prefix)
+    return data.decode('utf-8')
+
+
+def to_text(value):
+    """Text of a value which may be `Compressed`"""
+    if isinstance(value, Compressed):
+        return decompress(value)
+    return value
+
+
+class CompressedTextField(models.BinaryField):
+    """Text stored as compressed bytes
+
+    Values are compressed when saved, unless already `Compressed`, and
+    decompressed when loaded.
+    """
+
+    def from_db_value(self, value, expression, connection, context):
+        if value is None:
+            return value
+        return decompress(value)
+
+    def to_python(self, value):
+        if isinstance(value, Compressed):
+            return decompress(value)
+        return value
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if value is not None and not isinstance(value, Compressed):
+            value = compress(value)
+        return super(CompressedTextField, self).get_db_prep_value(value, connection,
+                                                                  prepared=prepared)
+
+
+def train_dictionary(texts, size=DICTIONARY_SIZE):
+    """Train a zstd dictionary on a sample of texts, returning its bytes"""
+    if zstandard is None:
+        raise ImportError('Training a dictionary requires the zstandard package')
+    samples = [text.encode('utf-8') for text in texts if text]
+    return zstandard.train_dictionary(size, samples).as_bytes()
+
+
+def move_abstracts(to_compressed=True, batch_size=BATCH_SIZE, callback=None):
+    """Move abstracts into (or out of) `abstract_compressed`, in batches
+
+    Each batch is moved in one transaction, keeping ids, so that an
+    interrupted move may simply be run again. callback, if given, is called
+    with the number of abstracts moved so far. Returns that number.
+    """
+    from Scopus.models import Abstract, CompressedAbstract
+
+    source, target = Abstract, CompressedAbstract
+    if not to_compressed:
+        source, target = target, source
+    n_moved = 0
+    while True:
+        with transaction.atomic():
+            batch = list(source.objects.order_by('id')
+                         .values_list('id', 'document_id', 'abstract')[:batch_size])
+            if not batch:
+                break
+            if to_compressed:
+                batch = [(pk, document_id, compress(abstract))
+                         for pk, document_id, abstract in batch]
+            target.objects.bulk_create([target(id=pk, document_id=document_id, abstract=abstract)
+                                        for pk, document_id, abstract in batch])
+            source.objects.filter(id__in=[pk for pk, _, _ in batch]).delete()
+        n_moved += len(batch)
+        if callback is not None:
+            callback(n_moved)
+    # ids were given explicitly, so sequences (on PostgreSQL) must catch up
+    connection = django.db.connections['default']
+    cursor = connection.cursor()
+    for sql in connection.ops.sequence_reset_sql(no_style(), [target]):
+        cursor.execute(sql)
+    return n_moved
@@ -6,17 +6,15 @@ import logging
 import multiprocessing
 import time
 import os
-import tarfile
-import zipfile
 import itertools
 import functools
 import warnings
-import re
 
 import django
 from django.utils.encoding import smart_str, smart_text
 import django.db
 from django.db import transaction
+from django.conf import settings
 
 django.setup()
 
@@ -27,20 +25,84 @@ from Scopus.models import (
     Citation,
     Authorship,
     Abstract,
+    CompressedAbstract,
 )
-from Scopus.xml_extract import (
-    extract_document_information,
-    extract_document_citations,
-    json_log,
+from Scopus.xml_extract import json_log
+from Scopus.archives import (
+    MAX_BACKLOG_BYTES,
+    READ_AHEAD,
+    PathFilter,
+    _with_retry,
+    generate_xml_pairs,
+    parse_ranges,
+    read_ahead,
+    read_eids,
 )
+from Scopus.workers import (
+    extract_item,
+    init_worker,
+)
+from Scopus import sqlite_shards
+from Scopus import work_queue
+from Scopus import compact_citations
+from Scopus import rollups
+from Scopus import fulltext
+from Scopus import compression
+from Scopus import affiliations
+from Scopus import profiling
+from Scopus import sharding
+from Scopus import document_groups
 
 
 # Higher value for MAX_BATCH_SIZE increases the speed of loading data to DB since
 # it opens/closes the connection once per MAX_BATCH_SIZE of records.
 MAX_BATCH_SIZE = 5000
 
+# Tables that may be loaded. Document is always loaded.
+TABLES = ('document', 'itemid', 'authorship', 'citation', 'abstract')
+
+# The xml_extract field each optional table is produced from
+TABLE_FIELDS = {
+    'itemid': 'itemid',
+    'authorship': 'authors',
+    'abstract': 'abstract',
+}
+
+
+def get_tables(tables=None):
+    """Determine which tables to load
+
+    Parameters
+    ----------
+    tables : iterable of strings or comma-separated string, optional
+        Names from TABLES. If None, settings.SCOPUS_TABLES is used if
+        defined; otherwise all tables are loaded.
 
-def aggregate_records(item):
+    Returns
+    -------
+    frozenset, always including 'document'
+    """
+    if tables is None:
+        tables = getattr(settings, 'SCOPUS_TABLES', None)
+        if tables is None:
+            return frozenset(TABLES)
+    if isinstance(tables, basestring):
+        tables = [name.strip() for name in tables.split(',') if name.strip()]
+    tables = frozenset(tables)
+    unknown = tables.difference(TABLES)
+    if unknown:
+        raise ValueError('Unknown tables %s. Expected some of %s'
+                         % (sorted(unknown), ', '.join(TABLES)))
+    return tables | {'document'}
+
+
+def get_fields(tables):
+    """List the xml_extract fields needed to load tables"""
+    return [TABLE_FIELDS[name] for name in TABLES
+            if name in TABLE_FIELDS and name in tables]
+
+
+def aggregate_records(item, tables=TABLES):
     """Creates Django model objects from an object produced in xml_extract
 
     Parameters
@@ -48,6 +110,9 @@ def aggregate_records(item):
     item : dict
         Key 'document' points to the output of `extract_document_information`.
         Key 'citation' points to the output of `extract_document_citations`.
+    tables : collection of strings, optional
+        Names from TABLES. Records are only produced for these tables;
+        others are returned as empty lists.
     """
     itemids = []
     authorships = []
@@ -78,8 +143,9 @@ def aggregate_records(item):
 
         return obj  # allow chaining
 
-    for item_name, item_id in document['itemid'].items():
-        itemids.append(truncate_fields(ItemID(document_id=eid, item_id=item_id, item_type=item_name)))
+    if 'itemid' in tables:
+        for item_name, item_id in document['itemid'].items():
+            itemids.append(truncate_fields(ItemID(document_id=eid, item_id=item_id, item_type=item_name)))
 
     (scopus_source_id,
      source_title,
@@ -110,13 +176,21 @@ def aggregate_records(item):
 
     truncate_fields(documents[-1])
 
-    if document['abstract']:
-        abstracts.append(Abstract(document_id=eid,
-                                  abstract=document['abstract']))
-        truncate_fields(abstracts[-1])
-
-    for (author_id, initials, surname, order), affiliations in document['authors'].items():
-        for afid, (affiliation_lines, country, city) in affiliations.items():
+    if document['abstract'] and 'abstract' in tables:
+        abstract = truncate_fields(Abstract(document_id=eid,
+                                            abstract=document['abstract']))
+        if compression.is_enabled():
+            # compressed here, in the worker, rather than when saved
+            abstract = CompressedAbstract(document_id=eid,
+                                          abstract=compression.compress(abstract.abstract))
+        abstracts.append(abstract)
+
+    if 'authorship' not in tables:
+        authors = {}
+    else:
+        authors = document['authors']
+    for (author_id, initials, surname, order), author_affiliations in authors.items():
+        for afid, (affiliation_lines, country, city) in author_affiliations.items():
             authorships.append(Authorship(author_id=author_id,
                                           initials=smart_str(initials),
                                           surname=smart_str(surname),
@@ -129,53 +203,78 @@ def aggregate_records(item):
                                           ))
             truncate_fields(authorships[-1])
 
-    for citation in item['citation']['eid']:
-        citations.append(Citation(cite_to=eid, cite_from=citation))
+    if 'citation' in tables:
+        for citation in item['citation']['eid']:
+            citations.append(Citation(cite_to=eid, cite_from=citation))
 
     return documents[-1], itemids, authorships, citations, abstracts
 
 
-def _with_retry(func, retries=3, wait=1, wait_mul=5):
-    # By default, wait 1s, 5s, 25s, 125s
-    def wrapper(*args, **kwargs):
-        try:
-            return func(*args, **kwargs)
-        except Exception:
-            if not retries:
-                raise
-            time.sleep(wait)
-            return _with_retry(func,
-                               retries=retries - 1,
-                               wait=wait * wait_mul,
-                               wait_mul=wait_mul)(*args, **kwargs)
-    return wrapper
-
-
-@transaction.atomic
-def bulk_create(doc_records):
-    documents, itemids, authorships, citations, abstracts = zip(*doc_records)
-    Document.objects.bulk_create(documents)
-    ItemID.objects.bulk_create(sum(itemids, []))
-    Authorship.objects.bulk_create(sum(authorships, []))
-    Citation.objects.bulk_create(sum(citations, []))
-    Abstract.objects.bulk_create(sum(abstracts, []))
-
-
-@transaction.atomic
-def create_doc(doc_record):
-    doc_record[0].save()
-    for same_model_objs in doc_record[1:]:
-        for obj in same_model_objs:
-            obj.save()
-
-
-def load_to_db(doc_records):
+def _update_derived(doc_records, using='default'):
+    """Update tables derived from newly saved records
+
+    Metrics and summaries are updated by `_save_records` once the records
+    are committed.
+    """
+    fulltext.index_documents(doc_records, using=using)
+    document_groups.update(doc_records, using=using)
+
+
+def _update_rollups(doc_records):
+    # metrics and summaries are kept in the default database
+    with transaction.atomic():
+        rollups.update(doc_records)
+
+
+def bulk_create(doc_records, with_derived=True, using='default'):
+    with transaction.atomic(using=using):
+        documents, itemids, authorships, citations, abstracts = zip(*doc_records)
+        Document.objects.using(using).bulk_create(documents)
+        for model, records in [(ItemID, itemids),
+                               (Authorship, authorships),
+                               (Citation, citations),
+                               (compression.abstract_model(), abstracts)]:
+            records = list(itertools.chain.from_iterable(records))
+            if not records:
+                # tables outside the projection have no records at all
+                continue
+            if model is Citation and compact_citations.is_compact():
+                compact_citations.insert_edges(((c.cite_to, c.cite_from)
+                                                for c in records), using=using)
+            else:
+                model.objects.using(using).bulk_create(records)
+        if with_derived:
+            _update_derived(doc_records, using=using)
+
+
+def create_doc(doc_record, with_derived=True, using='default'):
+    with transaction.atomic(using=using):
+        doc_record[0].save(using=using)
+        for same_model_objs in doc_record[1:]:
+            if (same_model_objs and isinstance(same_model_objs[0], Citation)
+                    and compact_citations.is_compact()):
+                compact_citations.insert_edges(((c.cite_to, c.cite_from)
+                                                for c in same_model_objs), using=using)
+                continue
+            for obj in same_model_objs:
+                obj.save(using=using)
+        if with_derived:
+            _update_derived([doc_record], using=using)
+
+
+def load_to_db(doc_records, with_derived=True):
     """Save Django objects
 
     Save referenced sources first, then attempt to bulk create
     all documents and associated records atomically, falling
     back to creating each document and associated records atomically.
+    Derived tables (the full-text index and document groups) are updated
+    in the same transactions, and metrics and summaries after them, unless
+    with_derived is False.
+    With SCOPUS_SHARDS, records are saved to each document's shard (see
+    sharding.py).
     """
+    new_sources = []
 
     for doc_record in doc_records:
         doc = doc_record[0]
@@ -193,126 +292,127 @@ def load_to_db(doc_records):
         if created:
             # store other fields
             source.save()
+            new_sources.append(source)
         assert doc.source.pk is not None
         doc.source_id = doc.source.pk
 
+    if with_derived and new_sources:
+        fulltext.index_sources(new_sources)
+
+    if sharding.is_enabled():
+        groups = sharding.group_records(doc_records)
+    else:
+        groups = [('default', doc_records)]
     try:
-        _with_retry(bulk_create)(doc_records)
+        for using, records in groups:
+            if using != 'default':
+                _with_retry(sharding.replicate_sources)(
+                    [doc_record[0].source for doc_record in records], using)
+            _save_records(records, with_derived=with_derived, using=using)
+    finally:
+        # Avoid memory leak when DEBUG == True
+        django.db.reset_queries()
+
+
+def _save_records(doc_records, with_derived=True, using='default'):
+    """Save records to one database, in bulk if possible"""
+    if affiliations.is_enabled():
+        try:
+            _with_retry(affiliations.intern)([authorship for doc_record in doc_records
+                                              for authorship in doc_record[2]],
+                                             using=using)
+        except Exception:
+            # authorships are then saved with their affiliations in full
+            json_log(error='Interning affiliations failed',
+                     exception=True)
+
+    saved = doc_records
+    try:
+        _with_retry(bulk_create)(doc_records, with_derived=with_derived, using=using)
     except Exception:
         json_log(error='Falling back to one-by-one',
                  method=logging.debug)
         # When transaction as bulk is failed, then go through each query
         # one by one and create them. Also, log failed queries.
+        saved = []
         for doc_record in doc_records:
             try:
-                _with_retry(create_doc)(doc_record)
+                _with_retry(create_doc)(doc_record, with_derived=with_derived, using=using)
+                saved.append(doc_record)
             except Exception:
                 json_log(error='Loading to database failed',
                          context={'eid': doc_record[0].eid},
                          exception=True)
-    finally:
-        # Avoid memory leak when DEBUG == True
-        django.db.reset_queries()
+    if with_derived and rollups.is_enabled() and saved:
+        try:
+            _with_retry(_update_rollups)(saved)
+        except Exception:
+            json_log(error='Updating metrics failed; run manage.py rebuild_metrics '
+                           'and corpus_stats --rebuild',
+                     exception=True)
 
 
-def _generate_files(path):
-    # XXX: Had some problems on windows with opening files. Will do so with
-    # retries.
-    if os.path.isdir(path):
-        for child in os.listdir(path):
-            child = os.path.join(path, child)
-            if child.endswith('.xml'):
-                yield child, _with_retry(open)(child, 'rb')
-            else:
-                for tup in _generate_files(child):
-                    yield tup
-    elif tarfile.is_tarfile(path):
-        with _with_retry(tarfile.open)(path, 'r') as archive:
-            for info in archive:
-                yield info.path, archive.extractfile(info)
-    elif zipfile.is_zipfile(path):
-        archive = _with_retry(zipfile.ZipFile)(path, 'r')
-        for info in archive.filelist:
-            # zipfile cannot concurrently open multiple files :(
-            yield info.filename, _with_retry(archive.open)(info)
-
-
-def generate_xml_pairs(path, eid_filter=None, count_only=False):
-    """Finds and returns contents for pairs of XML documents and citedby
-
-    path may be:
-        * a directory in which to find XML/TAR/ZIP files
-        * a tar file
-        * a zip file
-    """
-    n_skips = 0
-    backlog = {}
-    for path, f in _generate_files(path):
-        if not path.endswith('.xml'):
-            if f is not None:
-                f.close()
-            continue
+def _aggregate_one(item, tables=TABLES):
+    try:
+        return aggregate_records(item, tables=tables)
+    except Exception:
+        json_log(error='Uncaught error in producing django records',
+                 context={'eid': item['document'].get('eid')},
+                 exception=True)
 
-        # TODO: filter before opening, or after pairing to avoid DB queries
-        if (eid_filter is not None
-                and eid_filter(int(re.findall('(?<=2-s2.0-)[0-9]+', path)[-1]))):
-            n_skips += 1
-            if n_skips % 100000 == 0:
-                json_log(info='Skipped %d files so far' % n_skips,
-                         method=logging.info)
-            f.close()
-            continue
-        if count_only:
-            xml = None
-        else:
-            xml = f.read()
-            f.close()
-        key = os.path.dirname(path)
-        if key in backlog:
-            other_path, other_xml = backlog.pop(key)
-            if other_path == path:
-                json_log(error='Found duplicate xmls for %r' % path,
-                         method=logging.error)
-                backlog[key] = (path, xml)
-                continue
-            if path.endswith('citedby.xml'):
-                yield other_path, other_xml, xml
-            else:
-                assert other_path.endswith('citedby.xml'), other_path
-                yield path, xml, other_xml
 
-        else:
-            backlog[key] = (path, xml)
+def _process_one(tup, tables=TABLES):
+    item = extract_item(tup, fields=get_fields(tables),
+                        with_eids='citation' in tables)
+    if item is not None:
+        return _aggregate_one(item, tables=tables)
 
-    if n_skips:
-        json_log(info='Skipped %d files (two per doc) altogether' % n_skips,
-                 method=logging.warning)
-    if backlog:
-        json_log(error='Found unpaired XML files: %s'
-                 % [path for path, _ in backlog.values()],
-                 exception=True,
-                 method=logging.error)
 
+def _load_shard_batch(xml_pairs, tables=TABLES):
+    """Extract and load a batch of documents into this worker's shard"""
+    doc_records = [doc_record
+                   for doc_record in (_process_one(tup, tables=tables)
+                                      for tup in xml_pairs)
+                   if doc_record is not None]
+    if doc_records:
+        # shards lack the metrics tables; they are rebuilt after merging
+        load_to_db(doc_records, with_derived=False)
+    return len(xml_pairs)
 
-def _process_one(tup):
-    path, doc_file, citedby_file = tup
-    try:
-        item = {'document': extract_document_information(doc_file),
-                'citation': extract_document_citations(citedby_file)}
-    except Exception:
-        json_log(error='Uncaught error in extraction from XML',
-                 context={'path': path},
-                 exception=True)
-        return
 
-    if item['document'] is not None:
+def _init_shard_worker(created_time, modules, shard_dir, profile=None):
+    init_worker(created_time, modules, profile)
+    sqlite_shards.open_shard(shard_dir)
+
+
+def _merge_shards(shard_dir):
+    sqlite_shards.merge_shards(shard_dir)
+    # shard workers do not maintain derived tables
+    if rollups.is_enabled():
+        json_log(info='Rebuilt document summary',
+                 n_rows=rollups.rebuild_summary())
         try:
-            return aggregate_records(item)
-        except Exception:
-            json_log(error='Uncaught error in producing django records',
-                     context={'eid': item['document'].get('eid')},
+            json_log(info='Rebuilt metrics', n_rows=rollups.rebuild())
+        except ImportError:
+            json_log(error='Could not rebuild metrics; run manage.py rebuild_metrics',
                      exception=True)
+    if fulltext.is_enabled():
+        for name in sorted(fulltext.INDEXES):
+            if fulltext.is_available(name):
+                json_log(info='Updated full-text index', index=name,
+                         n_indexed=fulltext.index_missing(name))
+    if document_groups.is_enabled():
+        json_log(info='Resolved document groups',
+                 **document_groups.resolve(backfill=True))
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
             return
+        yield chunk
 
 
 try:
@@ -321,7 +421,12 @@ except NameError:
     basestring = str
 
 
-def extract_and_load_docs(paths, pool=None):
+def extract_and_load_docs(paths, pool=None, tables=None,
+                          max_backlog_bytes=MAX_BACKLOG_BYTES,
+                          io_threads=0, read_ahead_size=READ_AHEAD,
+                          scratch_dir=None, passphrase_file=None,
+                          lean_workers=False, shard_dir=None, on_batch=None,
+                          path_filter=None):
     """Main driver for loading all XML from a path to a database
 
     Parameters
@@ -330,16 +435,57 @@ def extract_and_load_docs(paths, pool=None):
 
         This can either be a directory to be recursed (containing XML or Zip or
         TAR), or a single Zip or TAR file.
+    tables : iterable of strings, optional
+        Which of TABLES to load. See `get_tables`.
+    max_backlog_bytes : int, optional
+        Memory bound on XML awaiting pairing. See `PairingBacklog`.
+    io_threads : int, optional
+        If positive, read and pair XML in this many background threads.
+        Otherwise read synchronously. See `read_ahead`.
+    read_ahead_size : int, optional
+        The number of pairs background threads may read ahead.
+    scratch_dir : string, optional
+        Copy archives here before reading them. Requires io_threads.
+    passphrase_file : string, optional
+        Used to decrypt .gpg archives as they are read.
+    lean_workers : boolean, default False
+        If True, pool workers only extract from XML, without Django, and
+        Django records are produced in this process.
+    shard_dir : string, optional
+        If given, pool workers extract and load into their own SQLite shard
+        databases (see `sqlite_shards`), having been initialized with
+        `_init_shard_worker`. The shards must be merged afterwards.
+    on_batch : callable, optional
+        Called with the number of XML pairs processed so far, after each
+        batch is saved.
+    path_filter : archives.PathFilter, optional
+        Selects documents to load by year, EID or path, before reading them
     """
     if isinstance(paths, basestring):
         paths = [paths]
+    tables = get_tables(tables)
 
     def already_saved(eid):
+        if sharding.is_enabled():
+            return sharding.document_exists(eid)
         return Document.objects.filter(eid=eid).exists()
 
-    xml_pairs = itertools.chain.from_iterable(
-        generate_xml_pairs(path, _with_retry(already_saved))
-        for path in paths)
+    if io_threads > 0:
+        xml_pairs = read_ahead(paths, n_threads=io_threads,
+                               buffer_size=read_ahead_size,
+                               scratch_dir=scratch_dir,
+                               eid_filter=_with_retry(already_saved),
+                               max_backlog_bytes=max_backlog_bytes,
+                               passphrase_file=passphrase_file,
+                               path_filter=path_filter,
+                               on_thread_exit=django.db.connections.close_all)
+    else:
+        xml_pairs = itertools.chain.from_iterable(
+            generate_xml_pairs(path, _with_retry(already_saved),
+                               max_backlog_bytes=max_backlog_bytes,
+                               passphrase_file=passphrase_file,
+                               path_filter=path_filter)
+            for path in paths)
 
     if pool is None:
         try:
@@ -349,14 +495,38 @@ def extract_and_load_docs(paths, pool=None):
     else:
         imap = functools.partial(pool.imap_unordered, chunksize=200)
 
+    if shard_dir is not None:
+        load = functools.partial(_load_shard_batch, tables=tables)
+        counter = 0
+        for n_pairs in pool.imap_unordered(load, _chunks(xml_pairs, 200)):
+            if counter // MAX_BATCH_SIZE != (counter + n_pairs) // MAX_BATCH_SIZE:
+                logging.info('Loaded %d records to shards' % (counter + n_pairs))
+            counter += n_pairs
+            if on_batch is not None:
+                on_batch(counter)
+        logging.info('Done loading %d records to shards' % counter)
+        return
+
+    if lean_workers:
+        extract = functools.partial(extract_item, fields=get_fields(tables),
+                                    with_eids='citation' in tables)
+        aggregate = functools.partial(_aggregate_one, tables=tables)
+        results = (None if item is None else aggregate(item)
+                   for item in imap(extract, xml_pairs))
+    else:
+        results = imap(functools.partial(_process_one, tables=tables),
+                       xml_pairs)
+
     counter = -1
     doc_records = []
 
-    for counter, doc_record in enumerate(imap(_process_one, xml_pairs)):
+    for counter, doc_record in enumerate(results):
         if counter % MAX_BATCH_SIZE == 0:
             if counter > 0:
                 logging.info('Saving after %d records' % counter)
                 load_to_db(doc_records)
+                if on_batch is not None:
+                    on_batch(counter)
             doc_records = []
 
         if doc_record is None:
@@ -371,27 +541,194 @@ def extract_and_load_docs(paths, pool=None):
     # At end of the year, flush out all remaining records
     logging.info('Saving after %d records' % counter)
     load_to_db(doc_records)
+    if on_batch is not None:
+        on_batch(counter + 1)
     logging.info('Done')
 
 
+def _path_filter(args):
+    """A PathFilter from command-line arguments, or None"""
+    kwargs = {}
+    if args.years is not None:
+        kwargs['years'] = [year for low, high in parse_ranges(args.years)
+                           for year in range(low, high + 1)]
+    if args.eids is not None:
+        kwargs['eid_ranges'] = parse_ranges(args.eids)
+    if args.eids_file is not None:
+        kwargs['eids'] = read_eids(args.eids_file)
+    if args.sample is not None:
+        if not 0 < args.sample <= 1:
+            raise ValueError('--sample must be between 0 and 1')
+        kwargs['sample'] = args.sample
+    if args.eid_modulo is not None:
+        modulus, _, remainder = args.eid_modulo.partition(':')
+        kwargs['eid_modulo'] = (int(modulus), int(remainder or 0))
+    if args.include:
+        kwargs['include'] = args.include
+    if args.exclude:
+        kwargs['exclude'] = args.exclude
+    if not kwargs:
+        return None
+    return PathFilter(**kwargs)
+
+
 def main():
     ap = argparse.ArgumentParser('Extract Scopus snapshot to database')
     ap.add_argument('-j', '--jobs', type=int, default=1,
                     help='Number of concurrent workers. FIXME: this appears to degrade performance significantly, at least on Windows')
+    ap.add_argument('--lean-workers', action='store_true', default=False,
+                    help='Workers only extract from XML, without loading '
+                         'Django, and records are produced in the main '
+                         'process. Workers start faster and use less memory.')
+    ap.add_argument('--start-method', default=None,
+                    choices=['fork', 'spawn', 'forkserver'],
+                    help='How to start worker processes (Python 3 only). '
+                         'Default: the platform default')
+    ap.add_argument('--preload', action='store_true', default=False,
+                    help='With --start-method forkserver, import worker '
+                         'modules (and Django) once in the forkserver, so '
+                         'that workers are forked ready to run.')
+    ap.add_argument('--sqlite-shards', metavar='DIR', default=None,
+                    help='For SQLite only: each worker loads into its own '
+                         'shard database in DIR, tuned for loading; the '
+                         'shards are then merged into the main database. '
+                         'Requires --jobs > 1.')
+    ap.add_argument('--merge-only', action='store_true', default=False,
+                    help='Only merge shards already in --sqlite-shards DIR')
+    ap.add_argument('--queue', action='store_true', default=False,
+                    help='Register archives in paths in the database work '
+                         'queue, then claim and load archives from the queue '
+                         'until none remain. Run on several hosts to share '
+                         'the work.')
+    ap.add_argument('--queue-status', action='store_true', default=False,
+                    help='Report progress of the work queue and exit')
+    ap.add_argument('--reset-failed', action='store_true', default=False,
+                    help='Return failed archives in the work queue to pending')
+    ap.add_argument('--lease-seconds', type=int, default=work_queue.LEASE_SECONDS,
+                    help='With --queue, other loaders may take over an archive '
+                         'if its lease is not renewed for this long. '
+                         'Default: %(default)s')
     ap.add_argument('--count-only', action='store_true', default=False,
                     help='Do not load. Only count how many documents there are to load.')
-    ap.add_argument('paths', nargs='+',
-                    help='Scopus XML files or directories, zips or tars thereof')
+    ap.add_argument('--tables', default=None,
+                    help='Comma-separated list of tables to load, from: %s. '
+                         'document is always loaded. Extraction of fields '
+                         'only needed for other tables is skipped. '
+                         'Default: settings.SCOPUS_TABLES, or all.'
+                         % ', '.join(TABLES))
+    ap.add_argument('--max-backlog-mb', type=float,
+                    default=MAX_BACKLOG_BYTES / 2 ** 20,
+                    help='Megabytes of XML to hold in memory while awaiting '
+                         'its pair, beyond which it is spilled to a temporary '
+                         'file. Default: %(default)s')
+    ap.add_argument('--io-threads', type=int, default=0,
+                    help='Read archives in this many background threads, '
+                         'overlapping I/O with extraction. Useful when data '
+                         'is on a network mount. Default: read synchronously')
+    ap.add_argument('--read-ahead', type=int, default=READ_AHEAD,
+                    help='Number of XML pairs that I/O threads may read '
+                         'ahead of extraction. Default: %(default)s')
+    ap.add_argument('--scratch-dir', default=None,
+                    help='Copy each archive to this local directory before '
+                         'reading it. Requires --io-threads')
+    ap.add_argument('--passphrase-file', default=None,
+                    help='Passphrase file for decrypting .gpg archives, '
+                         'which are decrypted through a pipe as they are '
+                         'loaded. Use with --io-threads to decrypt several '
+                         'at once')
+    ap.add_argument('--years', default=None,
+                    help='Only load from year directories, archives and '
+                         'archive members for these years, e.g. 2015-2017 '
+                         'or 2001,2010. Paths without a year are not '
+                         'excluded')
+    ap.add_argument('--eids', default=None,
+                    help='Only load documents with EIDs in these ranges, '
+                         'e.g. 84893000000-84893999999')
+    ap.add_argument('--eids-file', default=None, metavar='PATH',
+                    help='Only load documents with EIDs listed in PATH, one '
+                         'per line, e.g. as written by manage.py audit')
+    ap.add_argument('--sample', type=float, default=None, metavar='FRACTION',
+                    help='Only load this fraction of documents, selected by '
+                         'a hash of their EIDs, e.g. 0.01')
+    ap.add_argument('--eid-modulo', default=None, metavar='M:R',
+                    help='Only load documents with EID %% M == R')
+    ap.add_argument('--include', action='append', default=None, metavar='GLOB',
+                    help='Only load documents whose directory (within '
+                         'archives, the member directory) matches GLOB, '
+                         'e.g. "*/2-s2.0-8489*". May be repeated')
+    ap.add_argument('--exclude', action='append', default=None, metavar='GLOB',
+                    help='Skip directories, archives and documents whose '
+                         'paths match GLOB. May be repeated')
+    ap.add_argument('--profile', metavar='DIR', default=None,
+                    help='Profile this process and each worker, writing '
+                         'their profiles and a merged report to DIR. See '
+                         'Scopus/profiling.py for the overhead of each mode')
+    ap.add_argument('--profile-mode', default='cprofile', choices=profiling.MODES,
+                    help='cprofile records every call; sample records '
+                         'stacks periodically, with less overhead')
+    ap.add_argument('--profile-interval', type=float, default=profiling.SAMPLE_INTERVAL,
+                    metavar='SECONDS',
+                    help='CPU seconds between samples with --profile-mode '
+                         'sample. Default: %(default)s')
+    ap.add_argument('--profile-memory', action='store_true', default=False,
+                    help='With --profile, also trace memory allocations '
+                         'with tracemalloc (Python 3)')
+    ap.add_argument('--columns', metavar='DIR', default=None,
+                    help='After loading, update the columnar store of '
+                         'document attributes in DIR, building it if absent. '
+                         'See Scopus/columns.py. Requires numpy')
+    ap.add_argument('paths', nargs='*',
+                    help='Scopus XML files or directories, zips or tars '
+                         'thereof, optionally GPG-encrypted. Use - to read '
+                         'a tar or zip from stdin')
     args = ap.parse_args()
+    max_backlog_bytes = int(args.max_backlog_mb * 2 ** 20)
+    if args.scratch_dir is not None and args.io_threads < 1:
+        ap.error('--scratch-dir requires --io-threads')
+    if args.preload and args.start_method != 'forkserver':
+        ap.error('--preload requires --start-method forkserver')
+    if args.sqlite_shards is not None:
+        if not sqlite_shards.is_sqlite():
+            ap.error('--sqlite-shards requires a SQLite database')
+        if args.jobs < 2 and not args.merge_only:
+            ap.error('--sqlite-shards requires --jobs > 1')
+        if args.lean_workers:
+            ap.error('--sqlite-shards cannot be used with --lean-workers')
+        if sharding.is_enabled():
+            ap.error('--sqlite-shards cannot be used with SCOPUS_SHARDS')
+    elif args.merge_only:
+        ap.error('--merge-only requires --sqlite-shards')
+    try:
+        path_filter = _path_filter(args)
+    except (ValueError, IOError) as e:
+        ap.error(str(e))
+    try:
+        tables = get_tables(args.tables)
+    except ValueError as e:
+        ap.error(str(e))
 
     FORMAT = "%(asctime)-15s %(message)s"
     logging.basicConfig(format=FORMAT)
 
+    worker_profile = None
+    if args.profile is not None:
+        worker_profile = {'directory': args.profile, 'mode': args.profile_mode,
+                          'interval': args.profile_interval,
+                          'memory': args.profile_memory}
+        try:
+            profiling.start(role='main', **worker_profile)
+        except ValueError as e:
+            ap.error(str(e))
+        logging.warning('Profiling to %s' % args.profile)
+
     if args.count_only:
         logging.warning('COUNTING ONLY')
         count = -1
-        gen = itertools.chain.from_iterable(generate_xml_pairs(path, count_only=True)
-                                            for path in args.paths)
+        gen = itertools.chain.from_iterable(
+            generate_xml_pairs(path, count_only=True,
+                               passphrase_file=args.passphrase_file,
+                               path_filter=path_filter)
+            for path in args.paths)
         for count, (path, _, _) in enumerate(gen):
             if (count + 1) % 100000 == 0:
                 logging.warning('Found %d XML pairs so far. Up to %s' % (count + 1, path))
@@ -399,20 +736,89 @@ def main():
                         % (count + 1,))
         return
 
+    if args.merge_only:
+        _merge_shards(args.sqlite_shards)
+        return
+
+    if args.queue_status or args.reset_failed:
+        if args.reset_failed:
+            logging.warning('Reset %d failed archives' % work_queue.reset_failed())
+        json_log(info='Work queue progress', progress=work_queue.progress())
+        return
+    if not args.paths:
+        ap.error('paths are required')
+
+    logging.info('Loading tables: %s' % ', '.join(sorted(tables)))
+
     logging.info('Extracting from XML in %d processes' % max(1, args.jobs))
     if args.jobs > 1:
-        pool = multiprocessing.Pool(processes=args.jobs)
+        if args.start_method is None:
+            context = multiprocessing
+        else:
+            context = multiprocessing.get_context(args.start_method)
+        worker_modules = ['Scopus.workers']
+        if not args.lean_workers:
+            worker_modules.append('Scopus.db_loader')
+        if args.preload:
+            context.set_forkserver_preload(worker_modules)
+        if args.sqlite_shards is None:
+            initializer = init_worker
+            initargs = (time.time(), worker_modules, worker_profile)
+        else:
+            if not os.path.isdir(args.sqlite_shards):
+                os.makedirs(args.sqlite_shards)
+            initializer = _init_shard_worker
+            initargs = (time.time(), worker_modules, args.sqlite_shards,
+                        worker_profile)
+        pool = context.Pool(processes=args.jobs,
+                            initializer=initializer,
+                            initargs=initargs)
     else:
         pool = None
 
     warnings.filterwarnings('ignore', category=UnicodeWarning,
                             module='.*sqlserver_ado.*')
-    extract_and_load_docs(args.paths, pool=pool)
+    load = functools.partial(extract_and_load_docs, pool=pool, tables=tables,
+                             max_backlog_bytes=max_backlog_bytes,
+                             io_threads=args.io_threads,
+                             read_ahead_size=args.read_ahead,
+                             scratch_dir=args.scratch_dir,
+                             passphrase_file=args.passphrase_file,
+                             lean_workers=args.lean_workers,
+                             shard_dir=args.sqlite_shards,
+                             path_filter=path_filter)
+    if args.queue:
+        logging.warning('Registered %d new archives in work queue'
+                        % work_queue.register(args.paths, path_filter=path_filter))
+        work_queue.run(lambda path, on_batch: load([path], on_batch=on_batch),
+                       lease_seconds=args.lease_seconds)
+    else:
+        load(args.paths)
 
     if pool is not None:
         pool.close()
         pool.join()
 
+    if args.sqlite_shards is not None:
+        _merge_shards(args.sqlite_shards)
+    elif document_groups.is_enabled():
+        # groups whose documents were loaded in different batches
+        for using in sharding.read_aliases():
+            json_log(info='Resolved document groups', database=using,
+                     **document_groups.resolve(using=using))
+
+    if args.columns is not None:
+        from Scopus import columns
+        store, n_added = columns.update(args.columns)
+        json_log(info='Updated columnar store', out_dir=args.columns,
+                 n_rows=len(store), n_added=n_added)
+
+    if args.profile is not None:
+        # workers have written their profiles on exiting
+        profiling.stop()
+        logging.warning('Wrote profiling report to %s'
+                        % os.path.join(args.profile, 'report.txt'))
+
 
 if __name__ == '__main__':
     main()
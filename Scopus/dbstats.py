@@ -0,0 +1,63 @@
+"""Storage statistics from database catalogues"""
+
+import django.db
+
+
+def table_size_bytes(table, using='default'):
+    """Bytes used by a table and its indexes, or None if unavailable
+
+    On SQLite this requires the dbstat virtual table (SQLITE_ENABLE_DBSTAT_VTAB).
+    """
+    connection = django.db.connections[using]
+    cursor = connection.cursor()
+    if connection.vendor == 'sqlite':
+        sql = ('SELECT SUM(pgsize) FROM dbstat WHERE name IN '
+               '(SELECT name FROM sqlite_master WHERE tbl_name = %s)')
+    elif connection.vendor == 'mysql':
+        sql = ('SELECT data_length + index_length FROM information_schema.tables '
+               'WHERE table_schema = DATABASE() AND table_name = %s')
+    elif connection.vendor == 'postgresql':
+        sql = 'SELECT pg_total_relation_size(%s)'
+    else:
+        return None
+    try:
+        cursor.execute(sql, [table])
+    except django.db.DatabaseError:
+        return None
+    row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    return int(row[0])
+
+
+def estimated_row_count(table, using='default'):
+    """Number of rows in a table according to the database's statistics
+
+    Returns None where no estimate is available. On SQLite, statistics are
+    gathered by ANALYZE; without them the largest rowid is used.
+    """
+    connection = django.db.connections[using]
+    cursor = connection.cursor()
+    if connection.vendor == 'sqlite':
+        queries = [('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table]),
+                   ('SELECT MAX(rowid) FROM %s' % connection.ops.quote_name(table), [])]
+    elif connection.vendor == 'mysql':
+        queries = [('SELECT table_rows FROM information_schema.tables '
+                    'WHERE table_schema = DATABASE() AND table_name = %s', [table])]
+    elif connection.vendor == 'postgresql':
+        queries = [('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [table])]
+    else:
+        return None
+    for sql, params in queries:
+        try:
+            cursor.execute(sql, params)
+        except django.db.DatabaseError:
+            continue
+        row = cursor.fetchone()
+        if row is None or row[0] is None:
+            continue
+        # sqlite_stat1.stat begins with the number of rows
+        estimate = int(float(str(row[0]).split()[0]))
+        if estimate >= 0:
+            return estimate
+    return None
@@ -0,0 +1,230 @@
+"""Optional canonicalisation of duplicate documents by group_id
+
+Documents which Elsevier believes to be duplicates share a group_id,
+itself the EID of one of them. Ignoring duplicates in SQL otherwise takes
+a self-join on `document.group_id`. With `SCOPUS_DOCUMENT_GROUPS = True`
+in settings, the loader keeps the `document_group` table, mapping each
+document's EID to:
+
+* canonical_eid: its group_id, where the document with that EID is
+  loaded, otherwise the least EID loaded in the group (documents without
+  a group_id are their own group);
+* group_size: the number of documents of the group loaded.
+
+With `SCOPUS_CANONICAL_CITATIONS = True` too, citations are also written
+to `citation_canonical` as edges between canonical EIDs (citing EIDs not
+loaded are kept as they are), keyed on (cite_to, cite_from) like
+`citation_compact`, so that group-aware citation queries are single index
+lookups.
+
+Each batch is mapped as it is loaded, within its transaction, knowing
+only the documents of the batch. `resolve` then corrects groups whose
+documents were loaded in different batches, in bulk: it recomputes the
+groups having more than one document loaded, and rewrites canonical
+citation edges whose ends are no longer canonical. The loader runs it
+after loading; `manage.py resolve_groups` also maps documents loaded
+beforehand (as does the loader after merging --sqlite-shards).
+
+With SCOPUS_SHARDS, both tables are sharded with documents, and groups
+are resolved within each shard.
+"""
+
+import collections
+
+import django.db
+from django.conf import settings
+from django.db import transaction
+
+from Scopus.models import Citation, CompactCitation, Document, DocumentGroup
+from Scopus import compact_citations
+
+
+CITATION_TABLE = 'citation_canonical'
+
+# Rows per bulk insert or update
+BATCH_SIZE = 500
+
+# Rows fetched at a time by `resolve`
+FETCH_SIZE = 100000
+
+
+def is_enabled():
+    return getattr(settings, 'SCOPUS_DOCUMENT_GROUPS', False) or canonical_citations()
+
+
+def canonical_citations():
+    return getattr(settings, 'SCOPUS_CANONICAL_CITATIONS', False)
+
+
+def _canonical(group_id, eids):
+    """The canonical EID of a group given the EIDs of its loaded documents"""
+    return group_id if group_id in eids else min(eids)
+
+
+def update(doc_records, using='default'):
+    """Map newly saved documents, and write their canonical citations
+
+    Must be run in the transaction saving them. Groups are formed from the
+    documents of doc_records alone; see `resolve`.
+    """
+    if not is_enabled():
+        return
+    groups = collections.defaultdict(set)
+    for doc_record in doc_records:
+        document = doc_record[0]
+        group_id = document.eid if document.group_id is None else document.group_id
+        groups[group_id].add(document.eid)
+    mapping = {}
+    for group_id, eids in groups.items():
+        canonical = _canonical(group_id, eids)
+        for eid in eids:
+            mapping[eid] = canonical
+    DocumentGroup.objects.using(using).bulk_create(
+        [DocumentGroup(eid=eid, canonical_eid=mapping[eid], group_size=len(eids))
+         for _, eids in sorted(groups.items()) for eid in sorted(eids)],
+        batch_size=BATCH_SIZE)
+
+    if canonical_citations():
+        edges = set((mapping.get(citation.cite_to, citation.cite_to),
+                     mapping.get(citation.cite_from, citation.cite_from))
+                    for doc_record in doc_records for citation in doc_record[3])
+        compact_citations.insert_edges(sorted(edges), using=using, table=CITATION_TABLE)
+
+
+def canonical_eids(eids, using='default'):
+    """Canonical EID of each of eids, as a dict; absent where not mapped"""
+    eids = list(eids)
+    result = {}
+    for start in range(0, len(eids), BATCH_SIZE):
+        result.update(DocumentGroup.objects.using(using)
+                      .filter(eid__in=eids[start:start + BATCH_SIZE])
+                      .values_list('eid', 'canonical_eid'))
+    return result
+
+
+def _backfill(connection):
+    """Map documents without a row as their own groups, copying their citations"""
+    quote_name = connection.ops.quote_name
+    group_table = quote_name(DocumentGroup._meta.db_table)
+    cursor = connection.cursor()
+    if canonical_citations():
+        citation_model = CompactCitation if compact_citations.is_compact() else Citation
+        # as yet uncanonicalised; `_rewrite_edges` follows
+        cursor.execute(
+            'INSERT INTO {cc} (cite_to, cite_from) '
+            'SELECT DISTINCT c.cite_to, c.cite_from FROM {c} c '
+            'WHERE NOT EXISTS (SELECT 1 FROM {g} g WHERE g.eid = c.cite_to) '
+            'AND NOT EXISTS (SELECT 1 FROM {cc} x '
+            'WHERE x.cite_to = c.cite_to AND x.cite_from = c.cite_from)'
+            .format(cc=quote_name(CITATION_TABLE), g=group_table,
+                    c=quote_name(citation_model._meta.db_table)))
+    cursor.execute(
+        'INSERT INTO {g} (eid, canonical_eid, group_size) '
+        'SELECT d.eid, d.eid, 1 FROM {d} d '
+        'WHERE NOT EXISTS (SELECT 1 FROM {g} g WHERE g.eid = d.eid)'
+        .format(g=group_table, d=quote_name(Document._meta.db_table)))
+    return cursor.rowcount
+
+
+def _resolve_groups(connection, using):
+    """Recompute groups of more than one document, returning the rows changed"""
+    quote_name = connection.ops.quote_name
+    cursor = connection.cursor()
+    cursor.execute(
+        'SELECT d.group_id, d.eid, g.canonical_eid, g.group_size '
+        'FROM {d} d LEFT JOIN {g} g ON g.eid = d.eid '
+        'WHERE d.group_id IN (SELECT group_id FROM {d} WHERE group_id IS NOT NULL '
+        'GROUP BY group_id HAVING COUNT(*) > 1) '
+        'ORDER BY d.group_id, d.eid'
+        .format(d=quote_name(Document._meta.db_table),
+                g=quote_name(DocumentGroup._meta.db_table)))
+    changed = []
+    created = []
+
+    def check(group_id, group):
+        eids = set(eid for eid, _, _ in group)
+        canonical = _canonical(group_id, eids)
+        for eid, old_canonical, old_size in group:
+            if old_canonical is None:
+                created.append(DocumentGroup(eid=eid, canonical_eid=canonical,
+                                             group_size=len(eids)))
+            elif (old_canonical, old_size) != (canonical, len(eids)):
+                changed.append((canonical, len(eids), eid))
+
+    group_id = None
+    group = []
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        for row_group_id, eid, old_canonical, old_size in rows:
+            if row_group_id != group_id and group:
+                check(group_id, group)
+                group = []
+            group_id = row_group_id
+            group.append((eid, old_canonical, old_size))
+    if group:
+        check(group_id, group)
+    cursor.close()
+
+    sql = ('UPDATE {g} SET canonical_eid = %s, group_size = %s WHERE eid = %s'
+           .format(g=quote_name(DocumentGroup._meta.db_table)))
+    for start in range(0, len(changed), BATCH_SIZE):
+        with transaction.atomic(using=using):
+            connection.cursor().executemany(sql, changed[start:start + BATCH_SIZE])
+    DocumentGroup.objects.using(using).bulk_create(created, batch_size=BATCH_SIZE)
+    return len(changed) + len(created)
+
+
+def _rewrite_edges(connection):
+    """Replace ends of canonical citations which are not canonical
+
+    Returns the number of edges removed.
+    """
+    quote_name = connection.ops.quote_name
+    cursor = connection.cursor()
+    n_removed = 0
+    for column in ('cite_to', 'cite_from'):
+        ends = {'cite_to': 'c.cite_to', 'cite_from': 'c.cite_from'}
+        ends[column] = 'g.canonical_eid'
+        cursor.execute(
+            'INSERT INTO {cc} (cite_to, cite_from) '
+            'SELECT DISTINCT {to}, {from_} FROM {cc} c JOIN {g} g ON g.eid = c.{col} '
+            'WHERE g.canonical_eid <> g.eid '
+            'AND NOT EXISTS (SELECT 1 FROM {cc} x WHERE x.cite_to = {to} AND x.cite_from = {from_})'
+            .format(cc=quote_name(CITATION_TABLE), g=quote_name(DocumentGroup._meta.db_table),
+                    to=ends['cite_to'], from_=ends['cite_from'], col=column))
+        cursor.execute(
+            'DELETE FROM {cc} WHERE {col} IN '
+            '(SELECT eid FROM {g} WHERE canonical_eid <> eid)'
+            .format(cc=quote_name(CITATION_TABLE), g=quote_name(DocumentGroup._meta.db_table),
+                    col=column))
+        n_removed += cursor.rowcount
+    return n_removed
+
+
+def resolve(using='default', backfill=False):
+    """Correct groups spanning batches, and the canonical citations
+
+    Parameters
+    ----------
+    using : string
+        Database alias
+    backfill : boolean
+        First map documents loaded without `update` (e.g. before
+        SCOPUS_DOCUMENT_GROUPS was set), which scans the document table
+
+    Returns a dict of counts: documents 'added' by backfill, group rows
+    'changed', and non-canonical citation edges 'rewritten'.
+    """
+    connection = django.db.connections[using]
+    counts = {'added': 0}
+    if backfill:
+        with transaction.atomic(using=using):
+            counts['added'] = _backfill(connection)
+    counts['changed'] = _resolve_groups(connection, using)
+    counts['rewritten'] = 0
+    if canonical_citations():
+        with transaction.atomic(using=using):
+            counts['rewritten'] = _rewrite_edges(connection)
+    return counts
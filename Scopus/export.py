@@ -0,0 +1,299 @@
+"""Export of tables to compressed files, partitioned by publication year
+
+Each table is written to one gzipped CSV or JSON Lines file per pub_year,
+under OUT_DIR/<table>/pub_year=<year>.<format>.gz. Tables without a year
+(`source` and `affiliation`) go to OUT_DIR/<table>/all.<format>.gz. Rows of
+`authorship`, `itemid`, `abstract` and `citation` take the year of their
+document, through document_id or cite_to.
+
+Rows are streamed as tuples (no model instances are created, and no
+result cache is kept), a chunk of CHUNK_SIZE documents at a time: the
+documents of a year are paged by seeking on eid, and each table's rows for
+a chunk of documents are then read in (document, primary key) order. Memory
+use does not grow with table size.
+
+Partitions are exported in parallel, and export may be resumed. While a
+partition is being written it is named *.partial, and after each chunk its
+progress is recorded in a *.state file; each chunk is a separate gzip
+member, so the file is valid up to the recorded size. An interrupted
+export is resumed from the last recorded chunk of each partial partition,
+skipping partitions already complete.
+
+Used by `manage.py export`.
+"""
+
+import csv
+import gzip
+import io
+import itertools
+import json
+import os
+
+import django
+import django.db
+
+from Scopus.models import (
+    Abstract,
+    Affiliation,
+    Authorship,
+    Citation,
+    CompactCitation,
+    CompressedAbstract,
+    Document,
+    ItemID,
+    Source,
+)
+from Scopus import compact_citations
+from Scopus import compression
+
+try:
+    unicode
+except NameError:
+    unicode = str
+
+
+TABLES = ('document', 'authorship', 'itemid', 'abstract', 'citation', 'source', 'affiliation')
+
+# Tables without a publication year, each exported to one file
+UNPARTITIONED = ('source', 'affiliation')
+
+FORMATS = ('csv', 'jsonl')
+
+# Documents per chunk, and so per query and per gzip member
+CHUNK_SIZE = 500
+
+# Rows encoded at a time
+WRITE_SIZE = 1000
+
+COMPRESS_LEVEL = 6
+
+# Each table's model and the field relating it to Document
+_TABLE_MODELS = {
+    'document': (Document, None),
+    'authorship': (Authorship, 'document'),
+    'itemid': (ItemID, 'document'),
+    'abstract': (Abstract, 'document'),
+    'citation': (Citation, 'cite_to'),
+    'source': (Source, None),
+    'affiliation': (Affiliation, None),
+}
+
+
+def _model(table):
+    model, related = _TABLE_MODELS[table]
+    if model is Citation and compact_citations.is_compact():
+        model = CompactCitation
+    elif model is Abstract and compression.is_enabled():
+        # exported decompressed, as the abstract table would be
+        model = CompressedAbstract
+    return model, related
+
+
+def _fields(model):
+    """Field names (for values_list) and column names (for output)"""
+    fields = model._meta.concrete_fields
+    return [field.name for field in fields], [field.column for field in fields]
+
+
+def _ordering(model, related):
+    if model is CompactCitation:
+        # cite_to is not unique; the table's key is (cite_to, cite_from)
+        return ['cite_to', 'cite_from']
+    return [related, 'pk'] if related else ['pk']
+
+
+def partition_path(out_dir, table, year, fmt):
+    name = 'all' if year is None else 'pub_year=%d' % year
+    return os.path.join(out_dir, table, '%s.%s.gz' % (name, fmt))
+
+
+def _csv_bytes(rows, header=None):
+    buf = io.StringIO() if unicode is str else io.BytesIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    if header is not None:
+        writer.writerow(header)
+    for row in rows:
+        if unicode is not str:
+            # the Python 2 csv module writes bytes
+            row = [value.encode('utf-8') if isinstance(value, unicode) else value
+                   for value in row]
+        writer.writerow(row)
+    value = buf.getvalue()
+    return value.encode('utf-8') if unicode is str else value
+
+
+def _jsonl_bytes(rows, columns):
+    return b''.join((json.dumps(dict(zip(columns, row)), sort_keys=True) + '\n').encode('utf-8')
+                    for row in rows)
+
+
+def _chunks(table, year, after, chunk_size, using='default'):
+    """Rows of table for the year, a chunk at a time
+
+    Yields (rows, key) where rows iterates over the chunk's rows, and key is
+    the value of `after` from which to resume following the chunk.
+    """
+    model, related = _model(table)
+    names, _ = _fields(model)
+    while True:
+        if related is None:
+            # page through the table itself
+            queryset = model.objects.using(using).order_by('pk')
+            if year is not None:
+                queryset = queryset.filter(pub_year=year)
+            if after is not None:
+                queryset = queryset.filter(pk__gt=after)
+            rows = list(queryset.values_list(*names)[:chunk_size])
+            if not rows:
+                return
+            after = rows[-1][names.index(model._meta.pk.name)]
+            yield rows, after
+        else:
+            # page through the year's documents, then their rows in table
+            queryset = (Document.objects.using(using)
+                        .filter(pub_year=year).order_by('eid'))
+            if after is not None:
+                queryset = queryset.filter(eid__gt=after)
+            eids = list(queryset.values_list('eid', flat=True)[:chunk_size])
+            if not eids:
+                return
+            after = eids[-1]
+            rows = (model.objects.using(using)
+                    .filter(**{related + '__in': eids})
+                    .order_by(*_ordering(model, related))
+                    .values_list(*names).iterator())
+            yield rows, after
+
+
+def _write_member(f, rows, columns, fmt, header=False):
+    """Write rows to f as one gzip member, returning the number of rows"""
+    member = gzip.GzipFile(fileobj=f, mode='wb', compresslevel=COMPRESS_LEVEL)
+    if header and fmt == 'csv':
+        member.write(_csv_bytes([], header=columns))
+    n_rows = 0
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, WRITE_SIZE))
+        if not batch:
+            break
+        if fmt == 'csv':
+            member.write(_csv_bytes(batch))
+        else:
+            member.write(_jsonl_bytes(batch, columns))
+        n_rows += len(batch)
+    member.close()
+    return n_rows
+
+
+def _read_state(path):
+    try:
+        with open(path + '.state') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _write_state(path, state):
+    tmp_path = path + '.state.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    if os.path.exists(path + '.state'):
+        # os.rename does not replace files on Windows
+        os.remove(path + '.state')
+    os.rename(tmp_path, path + '.state')
+
+
+def export_partition(out_dir, table, year, fmt='csv', chunk_size=CHUNK_SIZE, using='default'):
+    """Write table's rows for the year (or all rows, if year is None)
+
+    Resumes a partition left partial by an earlier call. Returns the number
+    of rows in the partition, or None if it was already complete.
+    """
+    path = partition_path(out_dir, table, year, fmt)
+    if os.path.exists(path):
+        return None
+    partial_path = path + '.partial'
+    _, columns = _fields(_model(table)[0])
+
+    state = _read_state(path) if os.path.exists(partial_path) else None
+    if state is None:
+        state = {'after': None, 'size': 0, 'n_rows': 0}
+    with open(partial_path, 'ab') as f:
+        # discard anything written after the last recorded chunk
+        f.truncate(state['size'])
+        f.seek(state['size'])
+        for rows, after in _chunks(table, year, state['after'], chunk_size, using=using):
+            # each chunk is a complete gzip member
+            n_rows = _write_member(f, rows, columns, fmt, header=state['size'] == 0)
+            f.flush()
+            os.fsync(f.fileno())
+            state = {'after': after, 'size': f.tell(), 'n_rows': state['n_rows'] + n_rows}
+            _write_state(path, state)
+        if state['size'] == 0:
+            # an empty partition still has its header
+            _write_member(f, [], columns, fmt, header=True)
+    os.rename(partial_path, path)
+    if os.path.exists(path + '.state'):
+        os.remove(path + '.state')
+    return state['n_rows']
+
+
+def partition_years(using='default'):
+    return list(Document.objects.using(using).order_by('pub_year')
+                .values_list('pub_year', flat=True).distinct())
+
+
+def _init_worker():
+    django.setup()
+    # a forked worker must not share the parent's connection
+    django.db.connections.close_all()
+
+
+def _export_task(args):
+    table, year = args[1:3]
+    return table, year, export_partition(*args)
+
+
+def export(out_dir, tables=TABLES, fmt='csv', years=None, pool=None,
+           chunk_size=CHUNK_SIZE, callback=None):
+    """Export tables to out_dir, resuming any earlier export there
+
+    Parameters
+    ----------
+    out_dir : string
+    tables : iterable of strings
+        From TABLES
+    fmt : string
+        From FORMATS
+    years : iterable of ints, optional
+        Export only these years' partitions. Default: all years present.
+    pool : multiprocessing.Pool, optional
+        Export partitions in parallel, initialized with `_init_worker`
+    callback : callable, optional
+        Called with (table, year, n_rows) as each partition completes;
+        n_rows is None if it was already complete.
+
+    Returns the number of partitions exported.
+    """
+    if years is None:
+        years = partition_years()
+    tasks = []
+    for table in tables:
+        if not os.path.isdir(os.path.join(out_dir, table)):
+            os.makedirs(os.path.join(out_dir, table))
+        for year in ([None] if table in UNPARTITIONED else years):
+            tasks.append((out_dir, table, year, fmt, chunk_size))
+
+    if pool is None:
+        results = (_export_task(task) for task in tasks)
+    else:
+        # workers open their own connections
+        django.db.connections.close_all()
+        results = pool.imap_unordered(_export_task, tasks)
+    n_exported = 0
+    for table, year, n_rows in results:
+        if n_rows is not None:
+            n_exported += 1
+        if callback is not None:
+            callback(table, year, n_rows)
+    return n_exported
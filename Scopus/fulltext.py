@@ -0,0 +1,322 @@
+"""Full-text indexes of documents and sources, for search in the admin
+
+Each index is a table separate from the data it indexes, keyed by the
+indexed record's primary key:
+
+* `document_fts` indexes Document.title, Abstract.abstract and the names of
+  a document's authors;
+* `source_fts` indexes Source.source_title and Source.source_abbrev.
+
+The index is a contentless FTS5 table on SQLite, a table with FULLTEXT
+indexes on MySQL, and a table of tsvector columns with GIN indexes on
+PostgreSQL. Tables are created by migration 0007 where the backend supports
+them. `manage.py rebuild_fulltext` fills them with the data loaded; set
+`SCOPUS_FULLTEXT = True` in settings to also index documents as they are
+loaded. Records already indexed are not indexed again.
+"""
+
+import re
+
+import django.db
+from django.db import transaction
+from django.conf import settings
+
+from Scopus import compression
+
+
+# Name, indexed columns, and column sets which may be searched (each needs
+# its own FULLTEXT index on MySQL)
+INDEXES = {
+    'document': {
+        'table': 'document_fts',
+        'columns': ('title', 'abstract', 'authors'),
+        'search_columns': [('title', 'abstract', 'authors'), ('authors',)],
+    },
+    'source': {
+        'table': 'source_fts',
+        'columns': ('source_title', 'source_abbrev'),
+        'search_columns': [('source_title', 'source_abbrev')],
+    },
+}
+
+# PostgreSQL text search configuration. The corpus is multilingual, so
+# words are not stemmed.
+PG_CONFIG = 'simple'
+
+# Rows per INSERT, and records read at a time while rebuilding
+BATCH_SIZE = 200
+
+# Most results returned by a search
+SEARCH_LIMIT = 1000
+
+_WORD_RE = re.compile(r'\w+\*?', re.UNICODE)
+
+# Whether each index table exists, by (database alias, index name)
+_available = {}
+
+
+def is_enabled():
+    return getattr(settings, 'SCOPUS_FULLTEXT', False)
+
+
+def is_supported(connection):
+    if connection.vendor == 'sqlite':
+        cursor = connection.cursor()
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+    return connection.vendor in ('mysql', 'postgresql')
+
+
+def is_available(name='document', using='default'):
+    """Whether the index table exists"""
+    if (using, name) not in _available:
+        connection = django.db.connections[using]
+        _available[using, name] = (INDEXES[name]['table']
+                                   in connection.introspection.table_names())
+    return _available[using, name]
+
+
+def _pg_vector(column):
+    return "COALESCE({c}, to_tsvector('{cfg}', ''))".format(c=column, cfg=PG_CONFIG)
+
+
+def _pg_document(columns):
+    return ' || '.join(_pg_vector(c) for c in columns)
+
+
+def _insert(name, rows, using='default'):
+    """Index rows of (id, column values...), ignoring ids already indexed"""
+    rows = list(rows)
+    if not rows:
+        return
+    connection = django.db.connections[using]
+    index = INDEXES[name]
+    table, columns = index['table'], index['columns']
+    if connection.vendor == 'sqlite':
+        # FTS5 does not enforce unique rowids, so conflicts are found first
+        rows = list(dict((row[0], row) for row in reversed(rows)).values())
+        rows.sort(key=lambda row: row[0])
+        indexed = set()
+        for start in range(0, len(rows), BATCH_SIZE):
+            indexed.update(_indexed(name, [row[0] for row in rows[start:start + BATCH_SIZE]],
+                                    using=using))
+        rows = [row for row in rows if row[0] not in indexed]
+        sql = 'INSERT INTO {t} (rowid, {cols}) VALUES {values}'
+        placeholder = '(%s)' % ', '.join(['%s'] * (len(columns) + 1))
+    elif connection.vendor == 'mysql':
+        sql = 'INSERT IGNORE INTO {t} (id, {cols}) VALUES {values}'
+        placeholder = '(%s)' % ', '.join(['%s'] * (len(columns) + 1))
+    else:
+        sql = 'INSERT INTO {t} (id, {cols}) VALUES {values} ON CONFLICT DO NOTHING'
+        placeholder = '(%%s, %s)' % ', '.join(["to_tsvector('%s', %%s)" % PG_CONFIG] * len(columns))
+    cursor = connection.cursor()
+    for start in range(0, len(rows), BATCH_SIZE):
+        batch = rows[start:start + BATCH_SIZE]
+        cursor.execute(sql.format(t=table, cols=', '.join(columns),
+                                  values=', '.join([placeholder] * len(batch))),
+                       [value for row in batch for value in row])
+
+
+def _author_names(authorships):
+    names = []
+    for authorship in authorships:
+        name = ' '.join(part for part in (authorship.initials, authorship.surname) if part)
+        if name not in names:
+            names.append(name)
+    return '; '.join(names)
+
+
+def index_documents(doc_records, using='default'):
+    """Index newly saved documents
+
+    Parameters
+    ----------
+    doc_records : list of tuples
+        As produced by `db_loader.aggregate_records`
+    """
+    if not (is_enabled() and is_available('document', using=using)):
+        return
+    _insert('document',
+            [(document.eid, document.title,
+              '\n'.join(compression.to_text(abstract.abstract) for abstract in abstracts),
+              _author_names(authorships))
+             for document, _, authorships, _, abstracts in doc_records],
+            using=using)
+
+
+def index_sources(sources, using='default'):
+    """Index newly saved Source objects"""
+    if not (is_enabled() and is_available('source', using=using)):
+        return
+    _insert('source',
+            [(source.pk, source.source_title, source.source_abbrev)
+             for source in sources],
+            using=using)
+
+
+def _query(connection, terms):
+    if connection.vendor == 'sqlite':
+        # quote each word, so that user input is never FTS5 syntax
+        return ' '.join('"%s"%s' % (word.rstrip('*'), '*' if word.endswith('*') else '')
+                        for word in terms)
+    if connection.vendor == 'mysql':
+        return ' '.join('+' + word for word in terms)
+    return ' & '.join(word.rstrip('*') + (':*' if word.endswith('*') else '')
+                      for word in terms)
+
+
+def _search_sql(text, name, columns, limit, connection):
+    """SQL selecting fts_id of the best matches, best first, and ranking one
+
+    Returns (sql, params, rank_sql, rank_params) or None if text has no
+    words; see `match_sql`.
+    """
+    index = INDEXES[name]
+    table = index['table']
+    if columns is None:
+        columns = index['columns']
+    assert tuple(columns) in index['search_columns'], columns
+    terms = _WORD_RE.findall(text)
+    if not terms:
+        return None
+    query = _query(connection, terms)
+    if connection.vendor == 'sqlite':
+        if tuple(columns) != index['columns']:
+            query = '{%s} : (%s)' % (' '.join(columns), query)
+        sql = ('SELECT rowid AS fts_id FROM {t} WHERE {t} MATCH %s ORDER BY rank LIMIT %s'
+               .format(t=table))
+        params = [query, limit]
+        # rank is only available where matching
+        rank_sql = '(SELECT rank FROM {t} WHERE {t} MATCH %s AND rowid = {{key}})'.format(t=table)
+    elif connection.vendor == 'mysql':
+        match = 'MATCH ({cols}) AGAINST (%s IN BOOLEAN MODE)'.format(cols=', '.join(columns))
+        sql = ('SELECT id AS fts_id FROM {t} WHERE {m} ORDER BY {m} DESC LIMIT %s'
+               .format(t=table, m=match))
+        params = [query, query, limit]
+        rank_sql = '(SELECT -{m} FROM {t} WHERE id = {{key}})'.format(t=table, m=match)
+    else:
+        doc = _pg_document(columns)
+        tsquery = "to_tsquery('{cfg}', %s)".format(cfg=PG_CONFIG)
+        sql = ('SELECT id AS fts_id FROM {t} WHERE ({doc}) @@ {q} '
+               'ORDER BY ts_rank({doc}, {q}) DESC LIMIT %s'
+               .format(t=table, doc=doc, q=tsquery))
+        params = [query, query, limit]
+        rank_sql = ('(SELECT -ts_rank({doc}, {q}) FROM {t} WHERE id = {{key}})'
+                    .format(t=table, doc=doc, q=tsquery))
+    return sql, params, rank_sql, [query]
+
+
+def match_sql(text, name='document', columns=None, limit=SEARCH_LIMIT, using='default'):
+    """SQL for the records matching all words of text, and for their rank
+
+    Lets the best matches be filtered, ranked and paged by the database,
+    joined with the records' own table. Parameters are as for `search`.
+
+    Returns
+    -------
+    None if text has no words, else (keys_sql, keys_params, rank_sql,
+    rank_params). keys_sql selects the primary keys of the best `limit`
+    matches, for use in `IN (...)`. rank_sql is an expression for the rank
+    of a matching record, lower being better, in which `{key}` is to be
+    replaced by the column holding its primary key.
+    """
+    found = _search_sql(text, name, columns, limit, django.db.connections[using])
+    if found is None:
+        return None
+    sql, params, rank_sql, rank_params = found
+    # MySQL does not allow LIMIT directly within IN (...)
+    return 'SELECT fts_id FROM (%s) best' % sql, params, rank_sql, rank_params
+
+
+def search(text, name='document', columns=None, limit=SEARCH_LIMIT, using='default'):
+    """Primary keys of records matching all words of text, best first
+
+    Parameters
+    ----------
+    text : string
+        Words to search for. A word ending in * matches as a prefix.
+    name : string
+        A key of INDEXES
+    columns : tuple of strings, optional
+        One of the index's 'search_columns'. Default: all columns.
+    limit : int
+    """
+    connection = django.db.connections[using]
+    found = _search_sql(text, name, columns, limit, connection)
+    if found is None:
+        return []
+    sql, params, _, _ = found
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    return [pk for pk, in cursor.fetchall()]
+
+
+def _indexed(name, pks, using='default'):
+    connection = django.db.connections[using]
+    id_column = 'rowid' if connection.vendor == 'sqlite' else 'id'
+    cursor = connection.cursor()
+    cursor.execute('SELECT {c} FROM {t} WHERE {c} IN ({params})'
+                   .format(c=id_column, t=INDEXES[name]['table'],
+                           params=', '.join(['%s'] * len(pks))),
+                   list(pks))
+    return set(pk for pk, in cursor.fetchall())
+
+
+def clear(name, using='default'):
+    connection = django.db.connections[using]
+    table = INDEXES[name]['table']
+    if connection.vendor == 'sqlite':
+        sql = "INSERT INTO {t} ({t}) VALUES ('delete-all')"
+    else:
+        sql = 'DELETE FROM {t}'
+    connection.cursor().execute(sql.format(t=table))
+
+
+def index_missing(name, using='default', callback=None):
+    """Index records not yet in the index, in batches
+
+    Returns the number of records indexed.
+    """
+    from Scopus.models import Document, Source, Authorship
+
+    model = {'document': Document, 'source': Source}[name]
+    n_indexed = 0
+    last_pk = None
+    while True:
+        batch = model.objects.using(using).order_by('pk').defer(*[
+            field.name for field in model._meta.concrete_fields
+            if field.name not in ('title', 'source_title', 'source_abbrev')
+            and not field.primary_key])
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        batch = list(batch[:BATCH_SIZE])
+        if not batch:
+            return n_indexed
+        last_pk = batch[-1].pk
+        indexed = _indexed(name, [obj.pk for obj in batch], using=using)
+        batch = [obj for obj in batch if obj.pk not in indexed]
+        if name == 'source':
+            rows = [(source.pk, source.source_title, source.source_abbrev)
+                    for source in batch]
+        else:
+            eids = [document.eid for document in batch]
+            abstracts = {}
+            for document_id, abstract in (compression.abstract_model().objects.using(using)
+                                          .filter(document_id__in=eids)
+                                          .values_list('document_id', 'abstract')):
+                abstracts.setdefault(document_id, []).append(abstract)
+            authorships = {}
+            for authorship in (Authorship.objects.using(using)
+                               .filter(document_id__in=eids)
+                               .only('document_id', 'initials', 'surname')
+                               .order_by('order')):
+                authorships.setdefault(authorship.document_id, []).append(authorship)
+            rows = [(document.eid, document.title,
+                     '\n'.join(abstracts.get(document.eid, [])),
+                     _author_names(authorships.get(document.eid, [])))
+                    for document in batch]
+        with transaction.atomic(using=using):
+            _insert(name, rows, using=using)
+        n_indexed += len(rows)
+        if callback is not None:
+            callback(n_indexed)
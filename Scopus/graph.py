@@ -0,0 +1,424 @@
+"""In-memory citation graph for whole-network metrics
+
+Citation counts by year, PageRank or co-citation are expensive to compute
+with SQL joins over the citation table. Instead, `CitationGraph` holds the
+citation network as NumPy arrays in compressed sparse row (CSR) form, in
+both directions, with EIDs remapped to dense node numbers 0..n-1 in EID
+order. Metrics are then vectorized over all nodes.
+
+A graph may be built from the database (`from_database`) or directly from
+the archives (`from_archives`), and saved to a directory of `.npy` files
+which `CitationGraph.load` memory-maps, so that reloading is instantaneous.
+
+Requires numpy. Nothing here imports Django except `from_database`.
+
+Example::
+
+    python -m Scopus.graph /path/to/graph /path/to/scopus-data
+    python -m Scopus.graph --from-db /path/to/graph
+"""
+
+import itertools
+import logging
+import os
+
+import numpy as np
+
+from Scopus.archives import generate_xml_pairs
+from Scopus.workers import extract_item
+from Scopus.xml_extract import json_log
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+
+ARRAYS = ('eids', 'pub_year', 'group_id',
+          'in_indptr', 'in_indices', 'out_indptr', 'out_indices')
+
+# Rows fetched from the database at a time
+FETCH_SIZE = 100000
+
+
+class _Int64Chunks(object):
+    """Growable array of int64, kept as a list of NumPy chunks
+
+    Stands in for array.array('q'), which Python 2 lacks.
+    """
+
+    def __init__(self, chunk_size=FETCH_SIZE):
+        self.chunk_size = chunk_size
+        self._chunks = []
+        self._values = []
+
+    def _flush(self):
+        if self._values:
+            self._chunks.append(np.array(self._values, dtype=np.int64))
+            self._values = []
+
+    def append(self, value):
+        self._values.append(value)
+        if len(self._values) >= self.chunk_size:
+            self._flush()
+
+    def extend(self, values):
+        self._values.extend(values)
+        if len(self._values) >= self.chunk_size:
+            self._flush()
+
+    def to_array(self):
+        self._flush()
+        if not self._chunks:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(self._chunks)
+
+
+def _csr(rows, cols, n_nodes):
+    """indptr and indices for edges (rows, cols) sorted by row, then col"""
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_nodes), out=indptr[1:])
+    return indptr, cols[order].astype(np.int32 if n_nodes < 2 ** 31 else np.int64)
+
+
+def _gather(indptr, indices, nodes):
+    """Concatenated CSR rows of nodes"""
+    nodes = np.asarray(nodes, dtype=np.int64)
+    starts = indptr[nodes]
+    lengths = indptr[nodes + 1] - starts
+    ends = np.cumsum(lengths)
+    offsets = np.repeat(starts - ends + lengths, lengths) + np.arange(ends[-1] if len(ends) else 0)
+    return indices[offsets]
+
+
+class CitationGraph(object):
+    """Citation network in CSR form, in both directions
+
+    Node i has EID `eids[i]`. The documents citing node i are
+    `in_indices[in_indptr[i]:in_indptr[i + 1]]`, and those it cites
+    `out_indices[out_indptr[i]:out_indptr[i + 1]]`. `pub_year` and
+    `group_id` are -1 where unknown, e.g. for citing documents not loaded.
+
+    Query methods take and return EIDs; `index` maps EIDs to nodes.
+    """
+
+    def __init__(self, eids, pub_year, group_id,
+                 in_indptr, in_indices, out_indptr, out_indices):
+        self.eids = eids
+        self.pub_year = pub_year
+        self.group_id = group_id
+        self.in_indptr = in_indptr
+        self.in_indices = in_indices
+        self.out_indptr = out_indptr
+        self.out_indices = out_indices
+
+    @classmethod
+    def from_edges(cls, cite_to, cite_from, doc_eids=(), doc_pub_year=(),
+                   doc_group_id=()):
+        """Build from arrays of EIDs
+
+        Parameters
+        ----------
+        cite_to, cite_from : arrays of int
+            The cited and citing EID of each citation. Duplicates are ignored.
+        doc_eids, doc_pub_year, doc_group_id : arrays of int, optional
+            Attributes of documents, which need not include all cited or
+            citing EIDs.
+        """
+        cite_to = np.asarray(cite_to, dtype=np.int64)
+        cite_from = np.asarray(cite_from, dtype=np.int64)
+        doc_eids = np.asarray(doc_eids, dtype=np.int64)
+        eids = np.unique(np.concatenate([doc_eids, cite_to, cite_from]))
+        n_nodes = len(eids)
+
+        pub_year = np.full(n_nodes, -1, dtype=np.int16)
+        group_id = np.full(n_nodes, -1, dtype=np.int64)
+        if len(doc_eids):
+            doc_nodes = np.searchsorted(eids, doc_eids)
+            if len(doc_pub_year):
+                pub_year[doc_nodes] = doc_pub_year
+            if len(doc_group_id):
+                group_id[doc_nodes] = doc_group_id
+
+        to_nodes = np.searchsorted(eids, cite_to)
+        from_nodes = np.searchsorted(eids, cite_from)
+        del cite_to, cite_from
+        if len(to_nodes):
+            order = np.lexsort((from_nodes, to_nodes))
+            to_nodes = to_nodes[order]
+            from_nodes = from_nodes[order]
+            keep = np.ones(len(order), dtype=bool)
+            keep[1:] = (to_nodes[1:] != to_nodes[:-1]) | (from_nodes[1:] != from_nodes[:-1])
+            to_nodes = to_nodes[keep]
+            from_nodes = from_nodes[keep]
+
+        in_indptr, in_indices = _csr(to_nodes, from_nodes, n_nodes)
+        out_indptr, out_indices = _csr(from_nodes, to_nodes, n_nodes)
+        return cls(eids, pub_year, group_id,
+                   in_indptr, in_indices, out_indptr, out_indices)
+
+    def save(self, directory):
+        """Write each array to directory/<name>.npy"""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Load a saved graph, memory-mapping its arrays by default"""
+        return cls(*[np.load(os.path.join(directory, name + '.npy'),
+                             mmap_mode=mmap_mode)
+                     for name in ARRAYS])
+
+    def __len__(self):
+        return len(self.eids)
+
+    @property
+    def n_edges(self):
+        return len(self.in_indices)
+
+    def index(self, eids):
+        """Node numbers for an EID or array of EIDs
+
+        Raises KeyError for EIDs not in the graph.
+        """
+        scalar = np.ndim(eids) == 0
+        eids = np.atleast_1d(np.asarray(eids, dtype=np.int64))
+        nodes = np.searchsorted(self.eids, eids)
+        missing = nodes >= len(self.eids)
+        missing[~missing] = self.eids[nodes[~missing]] != eids[~missing]
+        if missing.any():
+            raise KeyError(eids[missing].tolist())
+        return nodes[0] if scalar else nodes
+
+    def in_degree(self):
+        """Number of citations of each node"""
+        return np.diff(self.in_indptr)
+
+    def out_degree(self):
+        """Number of references of each node (only to documents in the graph)"""
+        return np.diff(self.out_indptr)
+
+    def _edge_targets(self):
+        """The cited node of each edge in in_indices order"""
+        return np.repeat(np.arange(len(self), dtype=self.in_indices.dtype),
+                         self.in_degree())
+
+    def windowed_citations(self, window=3):
+        """Citations of each node within `window` years of publication
+
+        Counts citing documents published from the cited document's year to
+        `window - 1` years later. Nodes or citing documents without a
+        publication year are not counted.
+        """
+        target_year = np.repeat(self.pub_year, self.in_degree())
+        citing_year = self.pub_year[self.in_indices]
+        delta = citing_year.astype(np.int32) - target_year
+        counted = (target_year >= 0) & (citing_year >= 0) & (delta >= 0) & (delta < window)
+        return np.bincount(self._edge_targets()[counted], minlength=len(self))
+
+    def citations_by_year(self, eid):
+        """Citations of a document per citing year
+
+        Returns a dict of year to count, with citing documents of unknown
+        year counted under -1.
+        """
+        node = self.index(eid)
+        years = self.pub_year[self.in_indices[self.in_indptr[node]:self.in_indptr[node + 1]]]
+        years, counts = np.unique(years, return_counts=True)
+        return dict(zip(years.tolist(), counts.tolist()))
+
+    def pagerank(self, damping=0.85, tol=1e-10, max_iter=100):
+        """PageRank of each node by power iteration
+
+        The rank of nodes citing nothing is spread over all nodes.
+        """
+        n_nodes = len(self)
+        if n_nodes == 0:
+            return np.zeros(0)
+        out_degree = self.out_degree()
+        dangling = out_degree == 0
+        inv_out_degree = np.zeros(n_nodes)
+        inv_out_degree[~dangling] = 1. / out_degree[~dangling]
+        targets = self._edge_targets()
+        rank = np.full(n_nodes, 1. / n_nodes)
+        for i in range(max_iter):
+            contribution = (rank * inv_out_degree)[self.in_indices]
+            new_rank = damping * np.bincount(targets, weights=contribution,
+                                             minlength=n_nodes)
+            new_rank += (1 - damping + damping * rank[dangling].sum()) / n_nodes
+            err = np.abs(new_rank - rank).sum()
+            rank = new_rank
+            if err < n_nodes * tol:
+                break
+        else:
+            json_log(error='PageRank did not converge', n_iter=max_iter, err=err)
+        return rank
+
+    def cited_by(self, eid):
+        """EIDs of documents citing eid"""
+        node = self.index(eid)
+        return self.eids[self.in_indices[self.in_indptr[node]:self.in_indptr[node + 1]]]
+
+    def references(self, eid):
+        """EIDs of documents cited by eid"""
+        node = self.index(eid)
+        return self.eids[self.out_indices[self.out_indptr[node]:self.out_indptr[node + 1]]]
+
+    def neighbours(self, eid, hops=1, direction='in'):
+        """EIDs within `hops` citations of eid, excluding eid itself
+
+        direction is 'in' (citing, transitively), 'out' (cited) or 'both'.
+        """
+        directions = {'in': [(self.in_indptr, self.in_indices)],
+                      'out': [(self.out_indptr, self.out_indices)]}
+        directions['both'] = directions['in'] + directions['out']
+        seen = np.zeros(len(self), dtype=bool)
+        frontier = np.atleast_1d(self.index(eid))
+        seen[frontier] = True
+        for _ in range(hops):
+            found = [_gather(indptr, indices, frontier)
+                     for indptr, indices in directions[direction]]
+            frontier = np.unique(np.concatenate(found))
+            frontier = frontier[~seen[frontier]]
+            if not len(frontier):
+                break
+            seen[frontier] = True
+        seen[self.index(eid)] = False
+        return self.eids[np.flatnonzero(seen)]
+
+    def co_cited(self, eid):
+        """Documents cited together with eid, by number of co-citations
+
+        Returns (eids, counts), most co-cited first.
+        """
+        node = self.index(eid)
+        citing = self.in_indices[self.in_indptr[node]:self.in_indptr[node + 1]]
+        if not len(citing):
+            return self.eids[:0], np.zeros(0, dtype=np.int64)
+        cited = _gather(self.out_indptr, self.out_indices, citing)
+        cited, counts = np.unique(cited[cited != node], return_counts=True)
+        order = np.argsort(-counts, kind='mergesort')
+        return self.eids[cited[order]], counts[order]
+
+
+def from_database(using='default'):
+    """Build a CitationGraph from the Document and citation tables
+
+    Django must be set up. Rows are streamed from the database in chunks
+    of FETCH_SIZE.
+    """
+    import django.db
+    from Scopus.models import Document, Citation, CompactCitation
+    from Scopus import compact_citations
+
+    connection = django.db.connections[using]
+    quote_name = connection.ops.quote_name
+
+    def fetch(sql, n_columns):
+        cursor = connection.cursor()
+        cursor.execute(sql)
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.int64).reshape(-1, n_columns))
+        cursor.close()
+        if not chunks:
+            return np.zeros((n_columns, 0), dtype=np.int64)
+        return np.concatenate(chunks).T
+
+    citation_model = CompactCitation if compact_citations.is_compact() else Citation
+    cite_to, cite_from = fetch('SELECT cite_to, cite_from FROM %s'
+                               % quote_name(citation_model._meta.db_table), 2)
+    doc_eids, doc_pub_year, doc_group_id = fetch(
+        'SELECT eid, pub_year, COALESCE(group_id, -1) FROM %s'
+        % quote_name(Document._meta.db_table), 3)
+    return CitationGraph.from_edges(cite_to, cite_from,
+                                    doc_eids, doc_pub_year, doc_group_id)
+
+
+def _extract_edges(tup):
+    item = extract_item(tup, fields=())
+    if item is None:
+        return None
+    document = item['document']
+    return (document['eid'], document['pub-year'], document['group-id'],
+            item['citation']['eid'])
+
+
+def from_archives(paths, pool=None, **kwargs):
+    """Build a CitationGraph directly from archives, without a database
+
+    Parameters
+    ----------
+    paths : string or list of strings
+        Archives or directories, as for `generate_xml_pairs`
+    pool : multiprocessing.Pool, optional
+        Extract in these worker processes
+    kwargs
+        Passed to `generate_xml_pairs`
+    """
+    if isinstance(paths, basestring):
+        paths = [paths]
+    xml_pairs = itertools.chain.from_iterable(generate_xml_pairs(path, **kwargs)
+                                              for path in paths)
+    if pool is None:
+        results = (_extract_edges(tup) for tup in xml_pairs)
+    else:
+        results = pool.imap_unordered(_extract_edges, xml_pairs, chunksize=200)
+
+    doc_eids, doc_pub_year, doc_group_id = _Int64Chunks(), _Int64Chunks(), _Int64Chunks()
+    cite_to, cite_from = _Int64Chunks(), _Int64Chunks()
+    for counter, result in enumerate(results):
+        if result is None:
+            continue
+        eid, pub_year, group_id, citing = result
+        doc_eids.append(eid)
+        doc_pub_year.append(pub_year)
+        doc_group_id.append(group_id)
+        cite_to.extend([eid] * len(citing))
+        cite_from.extend(citing)
+        if counter % 100000 == 0 and counter > 0:
+            logging.info('Extracted citations from %d documents' % counter)
+
+    return CitationGraph.from_edges(cite_to.to_array(), cite_from.to_array(),
+                                    doc_eids.to_array(), doc_pub_year.to_array(),
+                                    doc_group_id.to_array())
+
+
+def main():
+    import argparse
+    import multiprocessing
+    parser = argparse.ArgumentParser(description='Build and save a citation graph')
+    parser.add_argument('out_dir', help='Directory to save .npy files in')
+    parser.add_argument('paths', nargs='*', help='Archives or directories to read')
+    parser.add_argument('--from-db', action='store_true', default=False,
+                        help='Read citations from the database instead of archives')
+    parser.add_argument('-j', dest='n_jobs', type=int, default=1,
+                        help='Number of extraction processes')
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)-15s %(message)s")
+
+    if args.from_db:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Scopus.settings')
+        import django
+        django.setup()
+        graph = from_database()
+    elif args.n_jobs > 1:
+        pool = multiprocessing.Pool(args.n_jobs)
+        graph = from_archives(args.paths, pool=pool)
+        pool.close()
+        pool.join()
+    else:
+        graph = from_archives(args.paths)
+    graph.save(args.out_dir)
+    json_log(info='Saved citation graph', out_dir=args.out_dir,
+             n_nodes=len(graph), n_edges=graph.n_edges)
+
+
+if __name__ == '__main__':
+    main()
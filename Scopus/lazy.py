@@ -0,0 +1,455 @@
+"""Access to documents straight from the archives, without loading a database
+
+For exploring a few thousand documents of a new snapshot, loading it all
+is unnecessary. `build_index` records, for each EID, the archive (or
+directory) holding its XML and how its members are reached, in a SQLite
+file, from member names alone (as `archives.list_members` does).
+`LazySnapshot` then reads and extracts documents on demand:
+
+    python -m Scopus.lazy index /path/to/index.sqlite3 /path/to/scopus-data
+    python -m Scopus.lazy show /path/to/index.sqlite3 85012345678
+
+    >>> snapshot = LazySnapshot('/path/to/index.sqlite3', cache_dir='/tmp/xml')
+    >>> doc = snapshot[85012345678]
+    >>> doc.title, doc.source.source_type, [a.surname for a in doc.authorships]
+    >>> docs = snapshot.get_many(eids)
+
+Records have the fields of the models: `Document`, with its `source` (a
+`Source`), `authorships`, `itemids`, `citations` and `abstract` text. They
+are namedtuples, so Django is not needed; `doc_records` produces unsaved
+model instances instead, as the loader would, e.g. for `load_to_db`.
+
+Members are read according to the kind of archive: files in directories
+and members of zips are opened directly, members of uncompressed tars are
+read at the offsets recorded in the index, while compressed tars and GPG
+archives are read through once per batch, selecting the members wanted.
+`get_many` groups EIDs by archive, so that each archive is opened once.
+
+Extracted documents are kept in a bounded LRU cache of `cache_size`
+documents. With `cache_dir`, the XML read is also kept on disk,
+compressed, so that it is not read from the archives again; the cache
+directory is not bounded in size.
+
+Nothing here imports Django, except `doc_records`.
+"""
+
+import collections
+import io
+import logging
+import os
+import sqlite3
+import struct
+import tarfile
+import zipfile
+import zlib
+
+from Scopus.archives import (
+    PathFilter,
+    _is_stream,
+    _iter_sources,
+    _with_retry,
+    generate_xml_pairs,
+    list_members,
+    path_eid,
+)
+from Scopus.caching import LRUCache
+from Scopus.workers import extract_item
+from Scopus.xml_extract import int_or_none, json_log
+
+
+Source = collections.namedtuple('Source', [
+    'scopus_source_id', 'source_type', 'source_title', 'source_abbrev',
+    'issn_print', 'issn_electronic'])
+
+Authorship = collections.namedtuple('Authorship', [
+    'document_id', 'author_id', 'initials', 'surname', 'order',
+    'affiliation_id', 'affiliation', 'country', 'city'])
+
+ItemID = collections.namedtuple('ItemID', ['document_id', 'item_id', 'item_type'])
+
+Citation = collections.namedtuple('Citation', ['cite_to', 'cite_from'])
+
+Document = collections.namedtuple('Document', [
+    'eid', 'doi', 'pub_year', 'group_id', 'title', 'source', 'citation_count',
+    'title_language', 'citation_type', 'abstract', 'authorships', 'itemids',
+    'citations'])
+
+# Documents kept extracted in memory
+CACHE_SIZE = 10000
+
+# EIDs per index query
+BATCH_SIZE = 500
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS archive (id INTEGER PRIMARY KEY, path TEXT UNIQUE, '
+    'kind TEXT, size INTEGER, mtime REAL)',
+    'CREATE TABLE IF NOT EXISTS member (eid INTEGER, archive_id INTEGER, '
+    'document TEXT, citedby TEXT, document_offset INTEGER, document_size INTEGER, '
+    'citedby_offset INTEGER, citedby_size INTEGER)',
+    'CREATE INDEX IF NOT EXISTS member_eid ON member (eid)',
+    'CREATE INDEX IF NOT EXISTS member_archive ON member (archive_id)',
+]
+
+# Length of the document XML, preceding it in disk cache files
+_LENGTH = struct.Struct('<Q')
+
+
+def _kind(path):
+    if os.path.isdir(path):
+        return 'directory'
+    if _is_stream(path):
+        if not path.endswith('.gpg'):
+            raise ValueError('Cannot index %r, which may only be read once' % path)
+        return 'stream'
+    if tarfile.is_tarfile(path):
+        try:
+            tarfile.open(path, 'r:').close()
+        except tarfile.ReadError:
+            # compressed, so cannot be read at offsets
+            return 'stream'
+        return 'tar'
+    if zipfile.is_zipfile(path):
+        return 'zip'
+    return None
+
+
+def _members(path, kind, recurse, passphrase_file=None, path_filter=None):
+    """Yields (name, offset, size) of XML members; offsets only for tars"""
+    if kind == 'tar':
+        select = None if path_filter is None else path_filter.allow_document
+        with _with_retry(tarfile.open)(path, 'r:') as archive:
+            for info in archive:
+                if info.name.endswith('.xml') and (select is None or select(info.name)):
+                    yield info.name, info.offset_data, info.size
+        return
+    for name in list_members(path, recurse=recurse, passphrase_file=passphrase_file,
+                             path_filter=path_filter):
+        yield name, None, None
+
+
+def _pairs(members):
+    """(eid, document member, citedby member) from (name, offset, size)"""
+    by_directory = collections.defaultdict(dict)
+    for name, offset, size in members:
+        role = 'citedby' if os.path.basename(name) == 'citedby.xml' else 'document'
+        by_directory[os.path.dirname(name)][role] = (name, offset, size)
+    for directory, pair in sorted(by_directory.items()):
+        if len(pair) != 2:
+            json_log(error='Found unpaired XML files: %s'
+                     % [name for name, _, _ in pair.values()],
+                     method=logging.error)
+            continue
+        eid = path_eid(pair['document'][0])
+        if eid is not None:
+            yield eid, pair['document'], pair['citedby']
+
+
+def build_index(index_path, paths, passphrase_file=None, path_filter=None):
+    """Record where the documents in paths are, in a SQLite file
+
+    Archives and directories already indexed are skipped unless their size
+    or modification time has changed, so the index may be extended with
+    new paths, or refreshed. Streams other than GPG files cannot be
+    indexed.
+
+    Returns the number of documents indexed.
+    """
+    connection = sqlite3.connect(index_path)
+    try:
+        for sql in SCHEMA:
+            connection.execute(sql)
+        n_indexed = 0
+        for path in paths:
+            for source, recurse in _iter_sources(path, path_filter=path_filter):
+                source = os.path.abspath(source)
+                kind = _kind(source)
+                if kind is None:
+                    continue
+                stat = os.stat(source)
+                row = connection.execute('SELECT id, size, mtime FROM archive WHERE path = ?',
+                                         (source,)).fetchone()
+                if row is not None:
+                    if row[1:] == (stat.st_size, stat.st_mtime):
+                        continue
+                    connection.execute('DELETE FROM member WHERE archive_id = ?', (row[0],))
+                    connection.execute('DELETE FROM archive WHERE id = ?', (row[0],))
+                archive_id = connection.execute(
+                    'INSERT INTO archive (path, kind, size, mtime) VALUES (?, ?, ?, ?)',
+                    (source, kind, stat.st_size, stat.st_mtime)).lastrowid
+                members = _members(source, kind, recurse, passphrase_file=passphrase_file,
+                                   path_filter=path_filter)
+                rows = [(eid, archive_id) + document + citedby
+                        for eid, document, citedby in _pairs(members)]
+                connection.executemany(
+                    'INSERT INTO member (eid, archive_id, document, document_offset, '
+                    'document_size, citedby, citedby_offset, citedby_size) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                connection.commit()
+                json_log(info='Indexed archive', path=source, kind=kind, n_documents=len(rows),
+                         method=logging.info)
+                n_indexed += len(rows)
+        return n_indexed
+    finally:
+        connection.close()
+
+
+def _record(item):
+    """A Document namedtuple from the output of `workers.extract_item`"""
+    document = item['document']
+    eid = document['eid']
+    (scopus_source_id, source_title, source_abbrev, source_type,
+     issn_print, issn_electronic) = document['source']
+    authorships = [Authorship(eid, author_id, initials, surname, int(order), afid,
+                              '\n'.join(affiliation_lines), country, city)
+                   for (author_id, initials, surname, order), affiliations
+                   in document['authors'].items()
+                   for afid, (affiliation_lines, country, city) in affiliations.items()]
+    authorships.sort(key=lambda authorship: authorship.order)
+    return Document(
+        eid=eid,
+        doi=document['doi'],
+        pub_year=document['pub-year'],
+        group_id=document['group-id'],
+        title=document['title'],
+        source=Source(int_or_none(scopus_source_id), source_type, source_title,
+                      source_abbrev, issn_print, issn_electronic),
+        citation_count=item['citation']['count'],
+        title_language=document['title_language'],
+        citation_type=document['citation_type'],
+        abstract=document['abstract'],
+        authorships=authorships,
+        itemids=[ItemID(eid, item_id, item_type)
+                 for item_type, item_id in sorted(document['itemid'].items())],
+        citations=[Citation(eid, cite_from) for cite_from in item['citation']['eid']],
+    )
+
+
+def as_dict(record):
+    """A record as nested dicts and lists, e.g. for JSON"""
+    if isinstance(record, tuple) and hasattr(record, '_fields'):
+        return collections.OrderedDict((name, as_dict(value))
+                                       for name, value in zip(record._fields, record))
+    if isinstance(record, list):
+        return [as_dict(value) for value in record]
+    return record
+
+
+class LazySnapshot(object):
+    """Documents of indexed archives, read and extracted on demand
+
+    Parameters
+    ----------
+    index_path : string
+        A SQLite file written by `build_index`
+    cache_size : int
+        Extracted documents kept in memory
+    cache_dir : string, optional
+        Keep the XML read here, so that it is not read from archives again
+    passphrase_file : string, optional
+        For GPG archives
+    fields : iterable of strings, optional
+        Passed to `extract_document_information`. Default: all
+    """
+
+    def __init__(self, index_path, cache_size=CACHE_SIZE, cache_dir=None,
+                 passphrase_file=None, fields=None):
+        if not os.path.exists(index_path):
+            raise ValueError('No index at %r; see build_index' % index_path)
+        self._index = sqlite3.connect(index_path)
+        self._cache = LRUCache(cache_size)
+        self.cache_dir = cache_dir
+        self.passphrase_file = passphrase_file
+        self.fields = fields
+        self.n_read = 0
+
+    def close(self):
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._index.execute('SELECT COUNT(DISTINCT eid) FROM member').fetchone()[0]
+
+    def __contains__(self, eid):
+        return self._index.execute('SELECT 1 FROM member WHERE eid = ?',
+                                   (int(eid),)).fetchone() is not None
+
+    def eids(self):
+        """All EIDs indexed, in order"""
+        return [eid for eid, in self._index.execute('SELECT DISTINCT eid FROM member ORDER BY eid')]
+
+    def __getitem__(self, eid):
+        records = self.get_many([eid])
+        if eid not in records:
+            raise KeyError(eid)
+        return records[eid]
+
+    def get(self, eid, default=None):
+        return self.get_many([eid]).get(eid, default)
+
+    def get_many(self, eids):
+        """Document records for eids, as a dict; EIDs not found are absent"""
+        return dict((eid, _record(item)) for eid, item in self.items(eids).items())
+
+    def doc_records(self, eids, tables=None):
+        """Unsaved model instances for eids, as `db_loader.aggregate_records` makes
+
+        Requires Django to be set up. Returns a list of tuples, which may be
+        passed to `db_loader.load_to_db`.
+        """
+        from Scopus import db_loader
+        tables = db_loader.TABLES if tables is None else tables
+        items = self.items(eids)
+        return [db_loader.aggregate_records(items[eid], tables=tables)
+                for eid in sorted(items)]
+
+    def items(self, eids):
+        """Extracted documents, as from `workers.extract_item`, by EID"""
+        eids = set(int(eid) for eid in eids)
+        found = {}
+        for eid in eids:
+            item = self._cache.get(eid)
+            if item is not None:
+                found[eid] = item
+        wanted = sorted(eids - set(found))
+        for eid, xml_pair in self._read(wanted):
+            item = extract_item((str(eid),) + xml_pair, fields=self.fields)
+            if item is None:
+                continue
+            self._cache.set(eid, item)
+            found[eid] = item
+        return found
+
+    def _cache_path(self, eid):
+        return os.path.join(self.cache_dir, '%03d' % (eid % 1000), '%d.xml.z' % eid)
+
+    def _read_cached(self, eid):
+        try:
+            with open(self._cache_path(eid), 'rb') as f:
+                data = zlib.decompress(f.read())
+        except (IOError, OSError):
+            return None
+        length, = _LENGTH.unpack_from(data)
+        return data[_LENGTH.size:_LENGTH.size + length], data[_LENGTH.size + length:]
+
+    def _write_cached(self, eid, xml_pair):
+        path = self._cache_path(eid)
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                # created by another process
+                pass
+        doc_xml, citedby_xml = xml_pair
+        with open(path + '.tmp', 'wb') as f:
+            f.write(zlib.compress(_LENGTH.pack(len(doc_xml)) + doc_xml + citedby_xml))
+        if os.path.exists(path):
+            # os.rename does not replace files on Windows
+            os.remove(path)
+        os.rename(path + '.tmp', path)
+
+    def _locate(self, eids):
+        """Index rows for eids, grouped by archive: {(path, kind): [row, ...]}"""
+        by_archive = collections.defaultdict(list)
+        seen = set()
+        for start in range(0, len(eids), BATCH_SIZE):
+            batch = eids[start:start + BATCH_SIZE]
+            rows = self._index.execute(
+                'SELECT m.eid, a.path, a.kind, m.document, m.document_offset, m.document_size, '
+                'm.citedby, m.citedby_offset, m.citedby_size '
+                'FROM member m JOIN archive a ON a.id = m.archive_id '
+                'WHERE m.eid IN (%s) ORDER BY m.rowid' % ', '.join('?' * len(batch)), batch)
+            for row in rows:
+                if row[0] in seen:
+                    # in more than one archive: the first indexed is read
+                    continue
+                seen.add(row[0])
+                by_archive[row[1], row[2]].append(row[:1] + row[3:])
+        return by_archive
+
+    def _read(self, eids):
+        """Yields (eid, (document XML, citedby XML)) for those of eids indexed"""
+        if self.cache_dir is not None:
+            missing = []
+            for eid in eids:
+                xml_pair = self._read_cached(eid)
+                if xml_pair is None:
+                    missing.append(eid)
+                else:
+                    yield eid, xml_pair
+            eids = missing
+        for (path, kind), rows in sorted(self._locate(eids).items()):
+            for eid, xml_pair in self._read_archive(path, kind, rows):
+                self.n_read += 1
+                if self.cache_dir is not None:
+                    self._write_cached(eid, xml_pair)
+                yield eid, xml_pair
+
+    def _read_archive(self, path, kind, rows):
+        """Yields (eid, (document XML, citedby XML)) from one archive, opened once"""
+        if kind == 'directory':
+            for eid, document, _, _, citedby, _, _ in rows:
+                with _with_retry(open)(document, 'rb') as f:
+                    doc_xml = f.read()
+                with _with_retry(open)(citedby, 'rb') as f:
+                    yield eid, (doc_xml, f.read())
+        elif kind == 'zip':
+            with _with_retry(zipfile.ZipFile)(path, 'r') as archive:
+                for eid, document, _, _, citedby, _, _ in rows:
+                    yield eid, (archive.read(document), archive.read(citedby))
+        elif kind == 'tar':
+            with _with_retry(io.open)(path, 'rb') as f:
+                # in archive order, to read forwards
+                for row in sorted(rows, key=lambda row: row[2]):
+                    eid, _, doc_offset, doc_size, _, citedby_offset, citedby_size = row
+                    f.seek(doc_offset)
+                    doc_xml = f.read(doc_size)
+                    f.seek(citedby_offset)
+                    yield eid, (doc_xml, f.read(citedby_size))
+        else:
+            path_filter = PathFilter(eids=[row[0] for row in rows])
+            for member, doc_xml, citedby_xml in generate_xml_pairs(
+                    path, passphrase_file=self.passphrase_file, path_filter=path_filter):
+                yield path_eid(member), (doc_xml, citedby_xml)
+
+
+def main():
+    import argparse
+    import json
+    import sys
+    parser = argparse.ArgumentParser(description='Read documents from archives without loading them')
+    subparsers = parser.add_subparsers(dest='command')
+    index_parser = subparsers.add_parser('index', help='Index the documents in archives')
+    index_parser.add_argument('index', help='SQLite file to write')
+    index_parser.add_argument('paths', nargs='+', help='Archives or directories')
+    index_parser.add_argument('--passphrase-file', default=None,
+                              help='Passphrase file for .gpg archives')
+    show_parser = subparsers.add_parser('show', help='Print documents as JSON, one per line')
+    show_parser.add_argument('index', help='SQLite file written by index')
+    show_parser.add_argument('eids', nargs='+', type=int)
+    show_parser.add_argument('--passphrase-file', default=None,
+                             help='Passphrase file for .gpg archives')
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)-15s %(message)s")
+
+    if args.command == 'index':
+        n_indexed = build_index(args.index, args.paths, passphrase_file=args.passphrase_file)
+        json_log(info='Indexed documents', index=args.index, n_documents=n_indexed)
+    elif args.command == 'show':
+        with LazySnapshot(args.index, passphrase_file=args.passphrase_file) as snapshot:
+            records = snapshot.get_many(args.eids)
+        for eid in args.eids:
+            if eid in records:
+                sys.stdout.write(json.dumps(as_dict(records[eid])) + '\n')
+            else:
+                json_log(error='Document not found', context={'eid': eid})
+    else:
+        parser.error('a command is required')
+
+
+if __name__ == '__main__':
+    main()
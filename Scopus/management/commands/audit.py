@@ -0,0 +1,70 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Scopus import audit
+from Scopus.db_loader import get_tables
+
+
+# Report lines, in order, with the report key each shows
+_LINES = [
+    ('archive_documents', 'Documents in archives'),
+    ('duplicated', 'Documents in archives more than once'),
+    ('unpaired', 'Documents in archives without both XML files'),
+    ('db_documents', 'Documents in database'),
+    ('missing', 'Documents missing from database'),
+    ('unexpected', 'Documents in database but not archives'),
+    ('partial', 'Documents partially written'),
+    ('itemid_rows', 'Item ID rows'),
+    ('documents_without_itemid', 'Documents without item IDs'),
+    ('orphaned_itemid_rows', 'Item ID rows without their document'),
+    ('authorship_rows', 'Authorship rows'),
+    ('documents_without_authorship', 'Documents without authorships'),
+    ('orphaned_authorship_rows', 'Authorship rows without their document'),
+    ('abstract_rows', 'Abstract rows'),
+    ('documents_without_abstract', 'Documents without an abstract'),
+    ('orphaned_abstract_rows', 'Abstract rows without their document'),
+    ('citation_rows', 'Citation rows'),
+    ('documents_without_citation', 'Documents without citations'),
+    ('orphaned_citation_rows', 'Citation rows without their document'),
+    ('citation_count_mismatches', 'Documents whose citation_count differs from their citation rows'),
+]
+
+
+class Command(BaseCommand):
+    help = ('Compare the EIDs in archives with the database, reporting '
+            'documents missing, duplicated or partially written')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*',
+                            help='Archives or directories, as given to the loader. '
+                                 'If none, only the database is checked')
+        parser.add_argument('--tables', default=None,
+                            help='Comma-separated tables that were loaded. '
+                                 'Default: SCOPUS_TABLES, or all')
+        parser.add_argument('--passphrase-file', default=None,
+                            help='Passphrase file for .gpg archives')
+        parser.add_argument('--write-eids', metavar='DIR', default=None,
+                            help='Write missing.txt, partial.txt, duplicated.txt '
+                                 'and unexpected.txt to DIR, one EID per line. '
+                                 'missing.txt may be passed to the loader\'s '
+                                 '--eids-file')
+
+    def handle(self, *args, **options):
+        try:
+            tables = get_tables(options['tables'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        report, eids = audit.audit(options['paths'], tables=tables,
+                                   passphrase_file=options['passphrase_file'])
+        for key, label in _LINES:
+            if key in report:
+                self.stdout.write('%s: %d' % (label, report[key]))
+
+        if options['write_eids'] is not None:
+            if not os.path.isdir(options['write_eids']):
+                os.makedirs(options['write_eids'])
+            for name, values in sorted(eids.items()):
+                path = os.path.join(options['write_eids'], name + '.txt')
+                audit.write_eids(path, values)
+                self.stdout.write('Wrote %d EIDs to %s' % (len(values), path))
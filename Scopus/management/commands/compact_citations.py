@@ -0,0 +1,76 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from Scopus.models import Citation, CompactCitation
+from Scopus import compact_citations
+from Scopus.dbstats import table_size_bytes
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _time_inserts(insert):
+    """Seconds taken by insert(), which is then rolled back"""
+    start = time.time()
+    try:
+        with transaction.atomic():
+            insert()
+            elapsed = time.time() - start
+            raise _Rollback
+    except _Rollback:
+        pass
+    return elapsed
+
+
+class Command(BaseCommand):
+    help = ('Copy citations into the compact citation table, and compare '
+            'the storage used and insert rate of the two tables')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-copy', dest='copy', action='store_false', default=True,
+                            help='Only report sizes (and benchmark)')
+        parser.add_argument('--start-id', type=int, default=0,
+                            help='Resume copying after this Citation id')
+        parser.add_argument('--batch-size', type=int, default=1000000,
+                            help='Number of Citation ids to copy per transaction')
+        parser.add_argument('--benchmark', type=int, default=0, metavar='N',
+                            help='Time inserting N random edges into each table, '
+                                 'then roll back')
+
+    def handle(self, *args, **options):
+        if options['copy']:
+            def report(last_id, max_id):
+                self.stdout.write('Copied up to citation id %d of %d' % (last_id, max_id))
+            compact_citations.copy_from_citation(batch_size=options['batch_size'],
+                                                 start_id=options['start_id'],
+                                                 callback=report)
+
+        for model in [Citation, CompactCitation]:
+            table = model._meta.db_table
+            n_rows = model.objects.count()
+            size = table_size_bytes(table)
+            if size is None:
+                self.stdout.write('%s: %d rows, size unavailable' % (table, n_rows))
+            else:
+                self.stdout.write('%s: %d rows, %d bytes (%.1f bytes/row)'
+                                  % (table, n_rows, size, size / float(max(n_rows, 1))))
+
+        n = options['benchmark']
+        if n:
+            edges = [(random.randint(1, 2 ** 40), random.randint(1, 2 ** 40))
+                     for _ in range(n)]
+            timings = [
+                (Citation._meta.db_table,
+                 _time_inserts(lambda: Citation.objects.bulk_create(
+                     [Citation(cite_to=to, cite_from=from_) for to, from_ in edges],
+                     batch_size=compact_citations.BATCH_SIZE))),
+                (CompactCitation._meta.db_table,
+                 _time_inserts(lambda: compact_citations.insert_edges(edges))),
+            ]
+            for table, elapsed in timings:
+                self.stdout.write('%s: inserted %d edges in %.2fs (%.0f edges/s)'
+                                  % (table, n, elapsed, n / max(elapsed, 1e-9)))
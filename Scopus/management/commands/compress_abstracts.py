@@ -0,0 +1,64 @@
+import itertools
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Scopus.models import Abstract, CompressedAbstract
+from Scopus import compression
+from Scopus.dbstats import table_size_bytes
+
+
+class Command(BaseCommand):
+    help = ('Move abstracts into the compressed abstract table (or back), '
+            'and compare the storage used by the two tables')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-move', dest='move', action='store_false', default=True,
+                            help='Only report sizes')
+        parser.add_argument('--decompress', action='store_true', default=False,
+                            help='Move abstracts back into the abstract table')
+        parser.add_argument('--batch-size', type=int, default=compression.BATCH_SIZE,
+                            help='Abstracts moved per transaction. Default: %(default)s')
+        parser.add_argument('--train-dictionary', metavar='PATH', default=None,
+                            help='Train a zstd dictionary on loaded abstracts, '
+                                 'write it to PATH, and exit')
+        parser.add_argument('--sample', type=int, default=100000,
+                            help='Number of abstracts to train the dictionary on. '
+                                 'Default: %(default)s')
+
+    def handle(self, *args, **options):
+        if options['train_dictionary']:
+            texts = itertools.chain(
+                Abstract.objects.values_list('abstract', flat=True)[:options['sample']],
+                CompressedAbstract.objects.values_list('abstract', flat=True)[:options['sample']])
+            texts = list(itertools.islice(texts, options['sample']))
+            if not texts:
+                raise CommandError('No abstracts are loaded to train on')
+            with open(options['train_dictionary'], 'wb') as f:
+                f.write(compression.train_dictionary(texts))
+            self.stdout.write('Wrote a dictionary trained on %d abstracts to %s; '
+                              'set SCOPUS_ZSTD_DICTIONARY to use it'
+                              % (len(texts), options['train_dictionary']))
+            return
+
+        if options['move']:
+            if not (options['decompress'] or compression.is_enabled()):
+                raise CommandError('Set SCOPUS_ABSTRACT_COMPRESSION in settings first, '
+                                   'or abstracts loaded later will not be compressed')
+
+            def report(n_moved):
+                if n_moved % 100000 < options['batch_size']:
+                    self.stdout.write('Moved %d abstracts' % n_moved)
+            n_moved = compression.move_abstracts(to_compressed=not options['decompress'],
+                                                 batch_size=options['batch_size'],
+                                                 callback=report)
+            self.stdout.write('Moved %d abstracts in total' % n_moved)
+
+        for model in [Abstract, CompressedAbstract]:
+            table = model._meta.db_table
+            n_rows = model.objects.count()
+            size = table_size_bytes(table)
+            if size is None:
+                self.stdout.write('%s: %d rows, size unavailable' % (table, n_rows))
+            else:
+                self.stdout.write('%s: %d rows, %d bytes (%.1f bytes/row)'
+                                  % (table, n_rows, size, size / float(max(n_rows, 1))))
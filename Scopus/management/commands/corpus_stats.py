@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Scopus import rollups
+
+
+class Command(BaseCommand):
+    help = ('Document counts and citation totals by year and type, '
+            'answered from the document_summary table')
+
+    def add_arguments(self, parser):
+        keys = [field for field, _ in rollups.SUMMARY_KEYS]
+        parser.add_argument('--by', default='pub_year',
+                            help='Comma-separated fields to group by, from: %s'
+                                 % ', '.join(keys))
+        parser.add_argument('--filter', action='append', default=[],
+                            metavar='LOOKUP=VALUE',
+                            help='e.g. pub_year__gte=2010 or citation_type=ar. '
+                                 'May be repeated')
+        parser.add_argument('--rebuild', action='store_true', default=False,
+                            help='Recompute the summary from the document table first')
+        parser.add_argument('--check', action='store_true', default=False,
+                            help='Compare the summary to the document table, '
+                                 'reporting any differences')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            n_rows = rollups.rebuild_summary()
+            self.stdout.write('Rebuilt document_summary: %d rows' % n_rows)
+
+        if options['check']:
+            differences = rollups.check_summary()
+            for key, summary, actual in differences:
+                self.stdout.write('%r: summary has %r, documents have %r'
+                                  % (key, summary, actual))
+            if differences:
+                raise CommandError('%d summary rows differ from the document table'
+                                   % len(differences))
+            self.stdout.write('document_summary is consistent')
+            return
+
+        by = [field for field in options['by'].split(',') if field]
+        filters = {}
+        for lookup in options['filter']:
+            name, sep, value = lookup.partition('=')
+            if not sep:
+                raise CommandError('Expected LOOKUP=VALUE, got %r' % lookup)
+            filters[name] = value
+        self.stdout.write('\t'.join(by + ['n_documents', 'n_citations']))
+        for row in rollups.summarize(by, **filters):
+            self.stdout.write('\t'.join(str(row[field])
+                                        for field in by + ['n_documents', 'n_citations']))
@@ -0,0 +1,69 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Scopus import export
+
+
+def _parse_years(value):
+    """Years from e.g. '1990,2000-2010'"""
+    years = set()
+    for part in value.split(','):
+        start, sep, stop = part.partition('-')
+        try:
+            if sep and start:
+                years.update(range(int(start), int(stop) + 1))
+            elif part:
+                years.add(int(part))
+        except ValueError:
+            raise CommandError('Invalid --years: %r' % value)
+    return sorted(years)
+
+
+class Command(BaseCommand):
+    help = ('Export tables to gzipped CSV or JSON Lines files, one per '
+            'publication year, resuming any earlier export to OUT_DIR')
+
+    def add_arguments(self, parser):
+        parser.add_argument('out_dir', metavar='OUT_DIR')
+        parser.add_argument('--tables', default=','.join(export.TABLES),
+                            help='Comma-separated tables to export, from: %s. '
+                                 'Default: all' % ', '.join(export.TABLES))
+        parser.add_argument('--format', default='csv', choices=export.FORMATS)
+        parser.add_argument('--years', default=None,
+                            help='Only export these years, e.g. 1990,2000-2010')
+        parser.add_argument('-j', '--jobs', type=int, default=1,
+                            help='Number of partitions to export at once')
+        parser.add_argument('--chunk-size', type=int, default=export.CHUNK_SIZE,
+                            help='Documents read per query. Default: %(default)s')
+
+    def handle(self, *args, **options):
+        tables = [table for table in options['tables'].split(',') if table]
+        for table in tables:
+            if table not in export.TABLES:
+                raise CommandError('Unknown table %r; expected one of %s'
+                                   % (table, ', '.join(export.TABLES)))
+        years = None
+        if options['years'] is not None:
+            years = _parse_years(options['years'])
+
+        def report(table, year, n_rows):
+            if n_rows is None:
+                self.stdout.write('%s %s: already exported' % (table, year))
+            else:
+                self.stdout.write('%s %s: exported %d rows' % (table, year, n_rows))
+
+        pool = None
+        if options['jobs'] > 1:
+            pool = multiprocessing.Pool(processes=options['jobs'],
+                                        initializer=export._init_worker)
+        try:
+            n_exported = export.export(options['out_dir'], tables=tables,
+                                       fmt=options['format'], years=years,
+                                       pool=pool, chunk_size=options['chunk_size'],
+                                       callback=report)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.stdout.write('Exported %d partitions to %s' % (n_exported, options['out_dir']))
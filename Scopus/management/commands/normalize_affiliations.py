@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Scopus.models import Affiliation, Authorship
+from Scopus import affiliations
+from Scopus.dbstats import table_size_bytes
+
+
+class Command(BaseCommand):
+    help = ('Move the affiliations of authorships loaded beforehand into the '
+            'affiliation table, and report the storage used')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-convert', dest='convert', action='store_false', default=True,
+                            help='Only report sizes')
+        parser.add_argument('--batch-size', type=int, default=affiliations.NORMALIZE_BATCH_SIZE,
+                            help='Authorships converted per transaction. Default: %(default)s')
+
+    def handle(self, *args, **options):
+        if options['convert']:
+            if not affiliations.is_enabled():
+                raise CommandError('Set SCOPUS_NORMALIZE_AFFILIATIONS = True in settings first, '
+                                   'or authorships loaded later will not be normalized')
+
+            def report(n_converted):
+                if n_converted % 100000 < options['batch_size']:
+                    self.stdout.write('Converted %d authorships' % n_converted)
+            n_converted = affiliations.normalize_existing(batch_size=options['batch_size'],
+                                                          callback=report)
+            self.stdout.write('Converted %d authorships in total' % n_converted)
+
+        for model in [Authorship, Affiliation]:
+            table = model._meta.db_table
+            n_rows = model.objects.count()
+            size = table_size_bytes(table)
+            if size is None:
+                self.stdout.write('%s: %d rows, size unavailable' % (table, n_rows))
+            else:
+                self.stdout.write('%s: %d rows, %d bytes (%.1f bytes/row)'
+                                  % (table, n_rows, size, size / float(max(n_rows, 1))))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Scopus import fulltext
+
+
+class Command(BaseCommand):
+    help = 'Fill the full-text search indexes from loaded documents and sources'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true', default=False,
+                            help='Empty the indexes first, rather than only adding '
+                                 'records not yet indexed')
+
+    def handle(self, *args, **options):
+        names = [name for name in sorted(fulltext.INDEXES) if fulltext.is_available(name)]
+        if not names:
+            raise CommandError('No full-text index tables; the database backend '
+                               'may not support them')
+
+        def report(n_indexed):
+            if n_indexed >= 100000 and n_indexed % 100000 < fulltext.BATCH_SIZE:
+                self.stdout.write('Indexed %d records' % n_indexed)
+
+        for name in names:
+            if options['clear']:
+                fulltext.clear(name)
+            n_indexed = fulltext.index_missing(name, callback=report)
+            self.stdout.write('%s: indexed %d records' % (name, n_indexed))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from Scopus import rollups
+
+
+class Command(BaseCommand):
+    help = ('Recompute the author and affiliation metrics tables, '
+            'including h-index, from loaded documents')
+
+    def handle(self, *args, **options):
+        for table, n_rows in sorted(rollups.rebuild().items()):
+            self.stdout.write('%s: %d rows' % (table, n_rows))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from Scopus import document_groups
+from Scopus import sharding
+
+
+class Command(BaseCommand):
+    help = ('Map loaded documents to the canonical documents of their groups, '
+            'and canonicalise citations if SCOPUS_CANONICAL_CITATIONS is set')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-backfill', dest='backfill', action='store_false', default=True,
+                            help='Only resolve groups spanning batches, without first '
+                                 'mapping documents loaded beforehand')
+
+    def handle(self, *args, **options):
+        for using in sharding.read_aliases():
+            counts = document_groups.resolve(using=using, backfill=options['backfill'])
+            self.stdout.write('%s: %d documents added, %d group rows changed, '
+                              '%d citation edges rewritten'
+                              % (using, counts['added'], counts['changed'], counts['rewritten']))
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Scopus', '0002_auto_20170927_0133'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveLease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(help_text='Archive (or directory of documents) path, as seen by loaders', max_length=255, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], db_index=True, default='pending', max_length=10)),
+                ('owner', models.CharField(blank=True, help_text='host:pid of the loader holding the lease', max_length=100, null=True)),
+                ('lease_expires', models.DateTimeField(blank=True, db_index=True, help_text='After this, another loader may take over the archive', null=True)),
+                ('n_pairs', models.IntegerField(default=0, help_text='Number of XML pairs processed by the latest attempt')),
+                ('attempts', models.IntegerField(default=0, help_text='Number of times the archive was claimed')),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'archive_lease',
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# citation_compact, by database vendor; see Scopus/compact_citations.py
+CREATE_SQL = {
+    'sqlite': [
+        'CREATE TABLE citation_compact (cite_to INTEGER NOT NULL, cite_from INTEGER NOT NULL, '
+        'PRIMARY KEY (cite_to, cite_from)) WITHOUT ROWID',
+        'CREATE INDEX citation_compact_cite_from ON citation_compact (cite_from)',
+    ],
+    'mysql': [
+        'CREATE TABLE citation_compact (cite_to BIGINT NOT NULL, cite_from BIGINT NOT NULL, '
+        'PRIMARY KEY (cite_to, cite_from), KEY citation_compact_cite_from (cite_from)) '
+        'ENGINE=InnoDB',
+    ],
+    'microsoft': [
+        'CREATE TABLE citation_compact (cite_to BIGINT NOT NULL, cite_from BIGINT NOT NULL, '
+        'PRIMARY KEY CLUSTERED (cite_to, cite_from))',
+        'CREATE INDEX citation_compact_cite_from ON citation_compact (cite_from)',
+    ],
+    None: [
+        'CREATE TABLE citation_compact (cite_to BIGINT NOT NULL, cite_from BIGINT NOT NULL, '
+        'PRIMARY KEY (cite_to, cite_from))',
+        'CREATE INDEX citation_compact_cite_from ON citation_compact (cite_from, cite_to)',
+    ],
+}
+
+
+def create_table(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for sql in CREATE_SQL.get(vendor, CREATE_SQL[None]):
+        schema_editor.execute(sql)
+
+
+def drop_table(apps, schema_editor):
+    schema_editor.execute('DROP TABLE citation_compact')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Scopus', '0003_archivelease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompactCitation',
+            fields=[
+                ('cite_to', models.BigIntegerField(help_text='EID of document being cited', primary_key=True, serialize=False)),
+                ('cite_from', models.BigIntegerField(help_text='EID (or group ID?) of citing document')),
+            ],
+            options={
+                'db_table': 'citation_compact',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_table, drop_table),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Scopus', '0004_compactcitation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AffiliationMetrics',
+            fields=[
+                ('n_documents', models.IntegerField(default=0)),
+                ('first_year', models.IntegerField(help_text='Earliest known pub_year', null=True)),
+                ('last_year', models.IntegerField(help_text='Latest known pub_year', null=True)),
+                ('n_citations', models.BigIntegerField(default=0, help_text='Total citation_count of documents')),
+                ('h_index', models.IntegerField(help_text='As of the last rebuild_metrics', null=True)),
+                ('affiliation_id', models.IntegerField(help_text="Scopus's afid", primary_key=True, serialize=False)),
+            ],
+            options={
+                'db_table': 'affiliation_metrics',
+                'verbose_name_plural': 'affiliation metrics',
+            },
+        ),
+        migrations.CreateModel(
+            name='AuthorMetrics',
+            fields=[
+                ('n_documents', models.IntegerField(default=0)),
+                ('first_year', models.IntegerField(help_text='Earliest known pub_year', null=True)),
+                ('last_year', models.IntegerField(help_text='Latest known pub_year', null=True)),
+                ('n_citations', models.BigIntegerField(default=0, help_text='Total citation_count of documents')),
+                ('h_index', models.IntegerField(help_text='As of the last rebuild_metrics', null=True)),
+                ('author_id', models.BigIntegerField(help_text="Scopus's auid", primary_key=True, serialize=False)),
+            ],
+            options={
+                'db_table': 'author_metrics',
+                'verbose_name_plural': 'author metrics',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Scopus', '0005_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_year', models.IntegerField()),
+                ('citation_type', models.CharField(max_length=5)),
+                ('title_language', models.CharField(max_length=5)),
+                ('source_type', models.CharField(help_text="Empty where the source's type is unknown", max_length=1)),
+                ('n_documents', models.BigIntegerField(default=0)),
+                ('n_citations', models.BigIntegerField(default=0, help_text='Total citation_count of documents')),
+            ],
+            options={
+                'db_table': 'document_summary',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='documentsummary',
+            unique_together=set([('pub_year', 'citation_type', 'title_language', 'source_type')]),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# Full-text index tables, by database vendor; see Scopus/fulltext.py
+CREATE_SQL = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE document_fts USING fts5(title, abstract, authors, content='')",
+        "CREATE VIRTUAL TABLE source_fts USING fts5(source_title, source_abbrev, content='')",
+    ],
+    'mysql': [
+        'CREATE TABLE document_fts (id BIGINT NOT NULL PRIMARY KEY, '
+        'title LONGTEXT, abstract LONGTEXT, authors LONGTEXT, '
+        'FULLTEXT KEY document_fts_0 (title, abstract, authors), '
+        'FULLTEXT KEY document_fts_1 (authors)) '
+        'ENGINE=InnoDB DEFAULT CHARSET=utf8mb4',
+        'CREATE TABLE source_fts (id BIGINT NOT NULL PRIMARY KEY, '
+        'source_title LONGTEXT, source_abbrev LONGTEXT, '
+        'FULLTEXT KEY source_fts_0 (source_title, source_abbrev)) '
+        'ENGINE=InnoDB DEFAULT CHARSET=utf8mb4',
+    ],
+    'postgresql': [
+        'CREATE TABLE document_fts (id BIGINT NOT NULL PRIMARY KEY, '
+        'title tsvector, abstract tsvector, authors tsvector)',
+        "CREATE INDEX document_fts_0 ON document_fts USING GIN (("
+        "COALESCE(title, to_tsvector('simple', '')) || "
+        "COALESCE(abstract, to_tsvector('simple', '')) || "
+        "COALESCE(authors, to_tsvector('simple', ''))))",
+        "CREATE INDEX document_fts_1 ON document_fts USING GIN (("
+        "COALESCE(authors, to_tsvector('simple', ''))))",
+        'CREATE TABLE source_fts (id BIGINT NOT NULL PRIMARY KEY, '
+        'source_title tsvector, source_abbrev tsvector)',
+        "CREATE INDEX source_fts_0 ON source_fts USING GIN (("
+        "COALESCE(source_title, to_tsvector('simple', '')) || "
+        "COALESCE(source_abbrev, to_tsvector('simple', ''))))",
+    ],
+}
+
+DROP_SQL = ['DROP TABLE IF EXISTS document_fts', 'DROP TABLE IF EXISTS source_fts']
+
+
+def _is_supported(connection):
+    if connection.vendor == 'sqlite':
+        cursor = connection.cursor()
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+    return connection.vendor in CREATE_SQL
+
+
+def create_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    if _is_supported(connection):
+        for sql in CREATE_SQL[connection.vendor]:
+            schema_editor.execute(sql)
+
+
+def drop_tables(apps, schema_editor):
+    if _is_supported(schema_editor.connection):
+        for sql in DROP_SQL:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Scopus', '0006_documentsummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_tables, drop_tables),
+    ]
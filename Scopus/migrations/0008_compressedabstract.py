@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import Scopus.compression
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Scopus', '0007_fulltext'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompressedAbstract',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('abstract', Scopus.compression.CompressedTextField(help_text='The article abstract, compressed')),
+                ('document', models.ForeignKey(to='Scopus.Document')),
+            ],
+            options={
+                'db_table': 'abstract_compressed',
+            },
+        ),
+    ]
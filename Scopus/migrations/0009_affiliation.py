@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def create_view(apps, schema_editor):
+    """authorship_denormalized, with authorship's original columns"""
+    quote_name = schema_editor.connection.ops.quote_name
+    columns = ['a.%s' % quote_name(c) for c in
+               ('id', 'document_id', 'author_id', 'initials', 'surname', 'order',
+                'affiliation_id')]
+    columns += ['COALESCE(f.{c}, a.{c}) AS {c}'.format(c=quote_name(c))
+                for c in ('affiliation', 'country', 'city')]
+    schema_editor.execute(
+        'CREATE VIEW {v} AS SELECT {cols} FROM authorship a '
+        'LEFT JOIN affiliation f ON f.id = a.affiliation_ref_id'
+        .format(v=quote_name('authorship_denormalized'), cols=', '.join(columns)))
+
+
+def drop_view(apps, schema_editor):
+    schema_editor.execute('DROP VIEW IF EXISTS %s'
+                          % schema_editor.connection.ops.quote_name('authorship_denormalized'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Scopus', '0008_compressedabstract'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Affiliation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('affiliation_id', models.IntegerField(default=-1, help_text="Scopus's afid, or -1")),
+                ('text_hash', models.CharField(help_text='SHA-1 of affiliation, country and city', max_length=40)),
+                ('affiliation', models.TextField(default='', help_text='Text from all organization nodes, separated by newline characters')),
+                ('country', models.CharField(max_length=10)),
+                ('city', models.CharField(max_length=100)),
+            ],
+            options={
+                'db_table': 'affiliation',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='affiliation',
+            unique_together=set([('text_hash', 'affiliation_id')]),
+        ),
+        migrations.AddField(
+            model_name='authorship',
+            name='affiliation_ref',
+            field=models.ForeignKey(
+                blank=True, null=True, to='Scopus.Affiliation',
+                help_text='Where affiliations are normalized, the affiliation, '
+                          'country and city, which are then empty here'),
+        ),
+        migrations.RunPython(create_view, drop_view),
+    ]
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# citation_canonical, keyed like citation_compact (see migration 0004), by
+# database vendor; see Scopus/document_groups.py
+CREATE_SQL = {
+    'sqlite': [
+        'CREATE TABLE citation_canonical (cite_to INTEGER NOT NULL, cite_from INTEGER NOT NULL, '
+        'PRIMARY KEY (cite_to, cite_from)) WITHOUT ROWID',
+        'CREATE INDEX citation_canonical_cite_from ON citation_canonical (cite_from)',
+    ],
+    'mysql': [
+        'CREATE TABLE citation_canonical (cite_to BIGINT NOT NULL, cite_from BIGINT NOT NULL, '
+        'PRIMARY KEY (cite_to, cite_from), KEY citation_canonical_cite_from (cite_from)) '
+        'ENGINE=InnoDB',
+    ],
+    'microsoft': [
+        'CREATE TABLE citation_canonical (cite_to BIGINT NOT NULL, cite_from BIGINT NOT NULL, '
+        'PRIMARY KEY CLUSTERED (cite_to, cite_from))',
+        'CREATE INDEX citation_canonical_cite_from ON citation_canonical (cite_from)',
+    ],
+    None: [
+        'CREATE TABLE citation_canonical (cite_to BIGINT NOT NULL, cite_from BIGINT NOT NULL, '
+        'PRIMARY KEY (cite_to, cite_from))',
+        'CREATE INDEX citation_canonical_cite_from ON citation_canonical (cite_from, cite_to)',
+    ],
+}
+
+
+def create_table(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for sql in CREATE_SQL.get(vendor, CREATE_SQL[None]):
+        schema_editor.execute(sql)
+
+
+def drop_table(apps, schema_editor):
+    schema_editor.execute('DROP TABLE citation_canonical')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Scopus', '0009_affiliation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentGroup',
+            fields=[
+                ('eid', models.BigIntegerField(help_text='EID of a loaded document', primary_key=True, serialize=False)),
+                ('canonical_eid', models.BigIntegerField(db_index=True, help_text="EID standing for the document's group: its group_id where that document is loaded, otherwise the least EID loaded")),
+                ('group_size', models.IntegerField(default=1, help_text='Number of loaded documents in the group')),
+            ],
+            options={
+                'db_table': 'document_group',
+            },
+        ),
+        migrations.CreateModel(
+            name='CanonicalCitation',
+            fields=[
+                ('cite_to', models.BigIntegerField(help_text='Canonical EID of document being cited', primary_key=True, serialize=False)),
+                ('cite_from', models.BigIntegerField(help_text='Canonical EID of citing document, or its EID where not loaded')),
+            ],
+            options={
+                'db_table': 'citation_canonical',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_table, drop_table),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models, transaction, IntegrityError
 from django.core.exceptions import MultipleObjectsReturned
 
+from Scopus.compression import CompressedTextField
+
 # class Keywords(models.Model):
 #     keyword = models.CharField(max_length=30)
 
@@ -113,6 +115,25 @@ class Document(models.Model):
         return '<doc[{}] {}>'.format(self._type_label(), self.eid)
 
 
+class Affiliation(models.Model):
+    """A distinct affiliation of authorships; see affiliations.py"""
+    class Meta:
+        db_table = 'affiliation'
+        unique_together = ('text_hash', 'affiliation_id')
+
+    affiliation_id = models.IntegerField(default=-1, help_text="Scopus's afid, or -1")
+    text_hash = models.CharField(max_length=40,
+                                 help_text='SHA-1 of affiliation, country and city')
+    affiliation = models.TextField(default='',
+                                   help_text='Text from all organization nodes, separated by newline characters')
+    country = models.CharField(max_length=10)
+    city = models.CharField(max_length=100)
+
+    def __str__(self):
+        return '<affiliation {}: {}>'.format(self.affiliation_id,
+                                             self.affiliation.replace('\n', ', '))
+
+
 class Authorship(models.Model):
     class Meta:
         db_table = 'authorship'
@@ -127,6 +148,10 @@ class Authorship(models.Model):
                                    help_text='Text from all organization nodes, separated by newline characters')
     country = models.CharField(max_length=10, null=False, blank=False)
     city = models.CharField(max_length=100)
+    affiliation_ref = models.ForeignKey(Affiliation, null=True, blank=True, db_index=True,
+                                        help_text='Where affiliations are normalized, the '
+                                                  'affiliation, country and city, which are '
+                                                  'then empty here')
 
     def __str__(self):
         return '<{} {} ({}) is #{} author of <doc {}>>'.format(self.initials,
@@ -181,3 +206,171 @@ class Abstract(models.Model):
         except Exception:
             doc = self.document_id
         return '<abstract for {}, {} chars>'.format(doc, len(self.abstract))
+
+
+class CompressedAbstract(models.Model):
+    """Abstracts stored compressed; see compression.py"""
+    class Meta:
+        db_table = 'abstract_compressed'
+
+    document = models.ForeignKey(Document, null=False, db_index=True)
+    abstract = CompressedTextField(help_text='The article abstract, compressed')
+
+    def __str__(self):
+        return '<compressed abstract for {}>'.format(self.document_id)
+
+
+class ArchiveLease(models.Model):
+    """An archive to be loaded, claimed by one loader process at a time
+
+    Used to coordinate loader processes across hosts. See work_queue.py.
+    """
+    class Meta:
+        db_table = 'archive_lease'
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    path = models.CharField(max_length=255, unique=True,
+                            help_text='Archive (or directory of documents) path, as seen by loaders')
+    status = models.CharField(max_length=10, default=PENDING, db_index=True,
+                              choices=[(PENDING, PENDING),
+                                       (RUNNING, RUNNING),
+                                       (DONE, DONE),
+                                       (FAILED, FAILED),
+                                       ])
+    owner = models.CharField(max_length=100, null=True, blank=True,
+                             help_text='host:pid of the loader holding the lease')
+    lease_expires = models.DateTimeField(null=True, blank=True, db_index=True,
+                                         help_text='After this, another loader may take over the archive')
+    n_pairs = models.IntegerField(default=0,
+                                  help_text='Number of XML pairs processed by the latest attempt')
+    attempts = models.IntegerField(default=0, help_text='Number of times the archive was claimed')
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '<archive[{}] {}>'.format(self.status, self.path)
+
+
+class CompactCitation(models.Model):
+    """Citation edges stored compactly; see compact_citations.py
+
+    The table's primary key is (cite_to, cite_from). Django does not support
+    composite keys, so cite_to is declared as the primary key, but is not
+    unique: do not look up single records by pk.
+    """
+    class Meta:
+        db_table = 'citation_compact'
+        managed = False
+
+    cite_to = models.BigIntegerField(primary_key=True,
+                                     help_text='EID of document being cited')
+    cite_from = models.BigIntegerField(help_text='EID (or group ID?) of citing document')
+
+    def __str__(self):
+        return '<{} cited {}>'.format(self.cite_from, self.cite_to)
+
+
+class DocumentGroup(models.Model):
+    """The canonical document of each document's group; see document_groups.py"""
+    class Meta:
+        db_table = 'document_group'
+
+    eid = models.BigIntegerField(primary_key=True, help_text='EID of a loaded document')
+    canonical_eid = models.BigIntegerField(db_index=True,
+                                           help_text="EID standing for the document's group: "
+                                                     'its group_id where that document is '
+                                                     'loaded, otherwise the least EID loaded')
+    group_size = models.IntegerField(default=1,
+                                     help_text='Number of loaded documents in the group')
+
+    def __str__(self):
+        return '<doc {} in group of {} as {}>'.format(self.eid, self.group_size,
+                                                      self.canonical_eid)
+
+
+class CanonicalCitation(models.Model):
+    """Citation edges between canonical EIDs; see document_groups.py
+
+    Keyed on (cite_to, cite_from) like CompactCitation, so do not look up
+    single records by pk.
+    """
+    class Meta:
+        db_table = 'citation_canonical'
+        managed = False
+
+    cite_to = models.BigIntegerField(primary_key=True,
+                                     help_text='Canonical EID of document being cited')
+    cite_from = models.BigIntegerField(help_text='Canonical EID of citing document, '
+                                                 'or its EID where not loaded')
+
+    def __str__(self):
+        return '<{} cited {}>'.format(self.cite_from, self.cite_to)
+
+
+class _Metrics(models.Model):
+    """Rollup of the documents with a given author or affiliation
+
+    Maintained by the loader; see rollups.py.
+    """
+    class Meta:
+        abstract = True
+
+    n_documents = models.IntegerField(default=0)
+    first_year = models.IntegerField(null=True, help_text='Earliest known pub_year')
+    last_year = models.IntegerField(null=True, help_text='Latest known pub_year')
+    n_citations = models.BigIntegerField(default=0,
+                                         help_text='Total citation_count of documents')
+    h_index = models.IntegerField(null=True,
+                                  help_text='As of the last rebuild_metrics')
+
+
+class AuthorMetrics(_Metrics):
+    class Meta:
+        db_table = 'author_metrics'
+        verbose_name_plural = 'author metrics'
+
+    author_id = models.BigIntegerField(primary_key=True, help_text="Scopus's auid")
+
+    def __str__(self):
+        return '<author {}: {} docs, {} citations>'.format(self.author_id,
+                                                            self.n_documents,
+                                                            self.n_citations)
+
+
+class AffiliationMetrics(_Metrics):
+    class Meta:
+        db_table = 'affiliation_metrics'
+        verbose_name_plural = 'affiliation metrics'
+
+    affiliation_id = models.IntegerField(primary_key=True, help_text="Scopus's afid")
+
+    def __str__(self):
+        return '<affiliation {}: {} docs, {} citations>'.format(self.affiliation_id,
+                                                                 self.n_documents,
+                                                                 self.n_citations)
+
+
+class DocumentSummary(models.Model):
+    """Document counts and citation totals by year and type
+
+    Maintained by the loader; see rollups.py.
+    """
+    class Meta:
+        db_table = 'document_summary'
+        unique_together = ('pub_year', 'citation_type', 'title_language', 'source_type')
+
+    pub_year = models.IntegerField()
+    citation_type = models.CharField(max_length=5)
+    title_language = models.CharField(max_length=5)
+    source_type = models.CharField(max_length=1, help_text="Empty where the source's type is unknown")
+    n_documents = models.BigIntegerField(default=0)
+    n_citations = models.BigIntegerField(default=0,
+                                         help_text='Total citation_count of documents')
+
+    def __str__(self):
+        return '<summary {}/{}/{}/{}: {} docs>'.format(self.pub_year, self.citation_type,
+                                                       self.title_language, self.source_type,
+                                                       self.n_documents)
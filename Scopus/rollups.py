@@ -0,0 +1,415 @@
+"""Author and affiliation metrics, maintained as documents are loaded
+
+`AuthorMetrics` and `AffiliationMetrics` hold, per author_id and
+affiliation_id, the number of documents, the first and last publication
+year and the total citation_count. `update` adds the contribution of a
+batch of newly loaded documents, once the batch is committed. Rows are
+created if absent, ignoring any another loader has just created, and
+then incremented in place, so concurrent loaders do not conflict.
+
+The h-index cannot be maintained this way, as it depends on the citation
+counts of all of an author's documents; `update` resets it to NULL where
+it is no longer current. It is computed, together with the other metrics,
+by `rebuild`, which recomputes the tables from scratch by reading
+authorships ordered by author a page at a time, so memory use stays
+bounded. With SCOPUS_SHARDS, the pages of every shard are merged by
+key; the metrics and summary tables are written to the default
+database. `rebuild` is run by `manage.py rebuild_metrics`, and by the
+loader after merging SQLite shards.
+
+`DocumentSummary` holds document counts and citation totals for each
+combination of SUMMARY_KEYS, so that corpus statistics need not scan the
+document table. It is likewise updated as batches are loaded, and may be
+rebuilt or checked against the document table (`manage.py corpus_stats`).
+
+Set `SCOPUS_ROLLUPS = True` in settings to update these tables while
+loading.
+"""
+
+import django.db
+from django.db import IntegrityError, transaction
+from django.db.models import F, Count, Q, Sum
+from django.conf import settings
+
+from Scopus.models import (
+    AuthorMetrics,
+    AffiliationMetrics,
+    Authorship,
+    Document,
+    DocumentSummary,
+)
+from Scopus import sharding
+
+
+# Each model with the Authorship field it is keyed on
+ROLLUPS = [
+    (AuthorMetrics, 'author_id'),
+    (AffiliationMetrics, 'affiliation_id'),
+]
+
+# DocumentSummary fields, with the Document field each is taken from
+SUMMARY_KEYS = [
+    ('pub_year', 'pub_year'),
+    ('citation_type', 'citation_type'),
+    ('title_language', 'title_language'),
+    ('source_type', 'source__source_type'),
+]
+
+# Rows missing from a metrics table are inserted empty, ignoring any
+# inserted meanwhile by another loader
+INSERT_SQL = {
+    'sqlite': 'INSERT OR IGNORE INTO {t} ({k}, n_documents, n_citations) '
+              'VALUES {values}',
+    'mysql': 'INSERT IGNORE INTO {t} ({k}, n_documents, n_citations) VALUES {values}',
+    'postgresql': 'INSERT INTO {t} ({k}, n_documents, n_citations) VALUES {values} '
+                  'ON CONFLICT DO NOTHING',
+    None: 'INSERT INTO {t} ({k}, n_documents, n_citations) '
+          'SELECT v.k, 0, 0 FROM (VALUES {values}) v (k, n_documents, n_citations) '
+          'WHERE NOT EXISTS (SELECT 1 FROM {t} x WHERE x.{k} = v.k)',
+}
+
+# Adds a batch's metrics to a row, ignoring NULL years
+UPDATE_SQL = ('UPDATE {t} SET n_documents = n_documents + %s, '
+              'first_year = COALESCE(CASE WHEN first_year < %s THEN first_year ELSE %s END, '
+              'first_year), '
+              'last_year = COALESCE(CASE WHEN last_year > %s THEN last_year ELSE %s END, '
+              'last_year), '
+              'n_citations = n_citations + %s, h_index = NULL '
+              'WHERE {k} = %s')
+
+# Rows per query or bulk insert
+BATCH_SIZE = 500
+
+# Rows queried at a time by `rebuild`
+FETCH_SIZE = 100000
+
+
+def is_enabled():
+    return getattr(settings, 'SCOPUS_ROLLUPS', False)
+
+
+def _chunks(seq, size=BATCH_SIZE):
+    for start in range(0, len(seq), size):
+        yield seq[start:start + size]
+
+
+def _year(pub_year):
+    return pub_year if pub_year >= 0 else None
+
+
+def _deltas(doc_records, key_field):
+    """Metrics of the documents in doc_records, by key
+
+    Returns a dict of key to [n_documents, first_year, last_year, n_citations].
+    """
+    deltas = {}
+    for doc_record in doc_records:
+        document, authorships = doc_record[0], doc_record[2]
+        # An author appears once per affiliation, but counts once per document
+        keys = set(getattr(authorship, key_field) for authorship in authorships)
+        keys.discard(None)
+        year = _year(document.pub_year)
+        for key in keys:
+            delta = deltas.setdefault(key, [0, None, None, 0])
+            delta[0] += 1
+            delta[1] = _min(delta[1], year)
+            delta[2] = _max(delta[2], year)
+            delta[3] += document.citation_count
+    return deltas
+
+
+def _min(a, b):
+    return b if a is None else a if b is None else min(a, b)
+
+
+def _max(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+def _apply(model, deltas):
+    """Add deltas to rows of model, creating rows as needed
+
+    Rows are updated in key order, so that concurrent loaders lock them in
+    the same order.
+    """
+    connection = django.db.connections['default']
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    key_column = quote_name(model._meta.pk.column)
+    keys = sorted(deltas)
+    insert_sql = INSERT_SQL.get(connection.vendor, INSERT_SQL[None])
+    cursor = connection.cursor()
+    for chunk in _chunks(keys):
+        cursor.execute(insert_sql.format(t=table, k=key_column,
+                                         values=', '.join(['(%s, 0, 0)'] * len(chunk))),
+                       chunk)
+    update_sql = UPDATE_SQL.format(t=table, k=key_column)
+    for chunk in _chunks(keys):
+        params = []
+        for key in chunk:
+            n_documents, first_year, last_year, n_citations = deltas[key]
+            params.append((n_documents, first_year, first_year, last_year, last_year,
+                           n_citations, key))
+        cursor.executemany(update_sql, params)
+
+
+def update(doc_records):
+    """Add the metrics of newly saved documents
+
+    Run once they are committed, in a transaction of its own.
+
+    Parameters
+    ----------
+    doc_records : list of tuples
+        As produced by `db_loader.aggregate_records`
+    """
+    if not is_enabled():
+        return
+    for model, key_field in ROLLUPS:
+        deltas = _deltas(doc_records, key_field)
+        if deltas:
+            _apply(model, deltas)
+    _update_summary(doc_records)
+
+
+def _summary_key(document):
+    return (document.pub_year, document.citation_type, document.title_language,
+            document.source.source_type or '')
+
+
+def _update_summary(doc_records):
+    deltas = {}
+    for doc_record in doc_records:
+        document = doc_record[0]
+        delta = deltas.setdefault(_summary_key(document), [0, 0])
+        delta[0] += 1
+        delta[1] += document.citation_count
+    # Few keys per batch, so update one by one
+    for key, (n_documents, n_citations) in sorted(deltas.items()):
+        key = dict(zip([field for field, _ in SUMMARY_KEYS], key))
+        increment = {'n_documents': F('n_documents') + n_documents,
+                     'n_citations': F('n_citations') + n_citations}
+        if DocumentSummary.objects.filter(**key).update(**increment):
+            continue
+        try:
+            with transaction.atomic():
+                DocumentSummary.objects.create(n_documents=n_documents,
+                                               n_citations=n_citations, **key)
+        except IntegrityError:
+            # created meanwhile by another loader
+            DocumentSummary.objects.filter(**key).update(**increment)
+
+
+def h_index(group_starts, citation_counts):
+    """h-index of each group of citation counts
+
+    Parameters
+    ----------
+    group_starts : array of int
+        Offset at which each group starts in citation_counts
+    citation_counts : array of int
+        Citation counts, in descending order within each group
+
+    Returns
+    -------
+    array of int
+    """
+    import numpy as np
+
+    n = len(citation_counts)
+    group_sizes = np.diff(np.append(group_starts, n))
+    rank = np.arange(1, n + 1) - np.repeat(group_starts, group_sizes)
+    # with counts descending, h is the number of documents with count >= rank
+    return np.add.reduceat((citation_counts >= rank).astype(np.int64),
+                           group_starts) if n else np.zeros(0, dtype=np.int64)
+
+
+def _aliases(using):
+    return sharding.read_aliases() if using is None else [using]
+
+
+def _pages(key_field, using):
+    """Arrays of (key, eid, pub_year, citation_count) rows of one database
+
+    Ordered by key and EID. Each page is queried from after the last row of
+    the one before, as drivers such as mysqlclient hold a query's whole
+    result in memory however it is fetched.
+    """
+    import numpy as np
+
+    rows = (Authorship.objects.using(using)
+            .filter(**{key_field + '__isnull': False})
+            .order_by(key_field, 'document_id')
+            .values_list(key_field, 'document_id', 'document__pub_year',
+                         'document__citation_count')
+            .distinct())
+    page = rows
+    while True:
+        fetched = list(page[:FETCH_SIZE])
+        if not fetched:
+            return
+        yield np.array(fetched, dtype=np.int64).reshape(-1, 4)
+        if len(fetched) < FETCH_SIZE:
+            return
+        key, eid = fetched[-1][:2]
+        page = rows.filter(Q(**{key_field + '__gt': key}) |
+                           Q(**{key_field: key, 'document_id__gt': eid}))
+
+
+def _key_rows(key_field, aliases):
+    """Rows of `_pages` from each database, merged
+
+    Yields arrays each holding all rows of the keys in it, ordered by key,
+    then by descending citation_count.
+    """
+    import numpy as np
+
+    pages = [_pages(key_field, alias) for alias in aliases]
+    buffers = [np.zeros((0, 4), dtype=np.int64) for _ in aliases]
+    live = set(range(len(aliases)))
+    pending = sorted(live)
+    while True:
+        for i in pending:
+            page = next(pages[i], None)
+            if page is None:
+                live.discard(i)
+            else:
+                buffers[i] = np.concatenate([buffers[i], page])
+        # keys below the least last key of any database yet to be read to
+        # the end are complete
+        bound = min(buffers[i][-1, 0] for i in live) if live else None
+        complete = []
+        for i, rows in enumerate(buffers):
+            n = len(rows) if bound is None else np.searchsorted(rows[:, 0], bound)
+            complete.append(rows[:n])
+            buffers[i] = rows[n:]
+        rows = np.concatenate(complete)
+        if len(rows):
+            yield rows[np.lexsort((rows[:, 1], -rows[:, 3], rows[:, 0]))]
+        if bound is None:
+            return
+        pending = [i for i in sorted(live) if buffers[i][-1, 0] == bound]
+
+
+def _rebuild_one(model, key_field, aliases, using='default'):
+    import numpy as np
+
+    model.objects.using(using).all().delete()
+    for rows in _key_rows(key_field, aliases):
+        keys, pub_year, citation_count = rows[:, 0], rows[:, 2], rows[:, 3]
+        starts = np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+        known = np.where(pub_year >= 0, pub_year, np.iinfo(np.int64).max)
+        first = np.minimum.reduceat(known, starts)
+        last = np.maximum.reduceat(pub_year, starts)
+        model.objects.using(using).bulk_create(
+            [model(pk=key,
+                   n_documents=n_documents,
+                   first_year=first_year if last_year >= 0 else None,
+                   last_year=last_year if last_year >= 0 else None,
+                   n_citations=n_citations,
+                   h_index=h)
+             for key, n_documents, first_year, last_year, n_citations, h in zip(
+                 keys[starts].tolist(),
+                 np.diff(np.append(starts, len(keys))).tolist(),
+                 first.tolist(), last.tolist(),
+                 np.add.reduceat(citation_count, starts).tolist(),
+                 h_index(starts, citation_count).tolist())],
+            batch_size=BATCH_SIZE)
+    return model.objects.using(using).count()
+
+
+def rebuild(using=None):
+    """Recompute all metrics, including h-index, from the loaded data
+
+    Documents are read from every database in SCOPUS_SHARDS, or from
+    `using` alone if given; the metrics are written to `using`, or the
+    default database.
+
+    Requires numpy. Returns a dict of table to number of rows.
+    """
+    aliases = _aliases(using)
+    using = using or 'default'
+    out = {}
+    for model, key_field in ROLLUPS:
+        with transaction.atomic(using=using):
+            out[model._meta.db_table] = _rebuild_one(model, key_field, aliases, using=using)
+    return out
+
+
+def _aggregate_documents(using=None):
+    """DocumentSummary values computed from the document table
+
+    Sums over every database in SCOPUS_SHARDS, or `using` alone if given.
+    Returns a dict of key tuple to (n_documents, n_citations).
+    """
+    out = {}
+    for alias in _aliases(using):
+        rows = (Document.objects.using(alias)
+                .values(*[field for _, field in SUMMARY_KEYS])
+                .annotate(n_documents=Count('eid'), n_citations=Sum('citation_count'))
+                .order_by())
+        for row in rows:
+            key = tuple(row[field] or '' if field == 'source__source_type' else row[field]
+                        for _, field in SUMMARY_KEYS)
+            n_documents, n_citations = out.get(key, (0, 0))
+            out[key] = (n_documents + row['n_documents'], n_citations + (row['n_citations'] or 0))
+    return out
+
+
+def _summary_rows(using='default'):
+    return {tuple(row[:-2]): tuple(row[-2:])
+            for row in DocumentSummary.objects.using(using).values_list(
+                *[field for field, _ in SUMMARY_KEYS] + ['n_documents', 'n_citations'])}
+
+
+def rebuild_summary(using=None):
+    """Recompute DocumentSummary from the document table
+
+    Documents are read, and the summary written, as by `rebuild`. Returns
+    the number of rows.
+    """
+    aggregates = _aggregate_documents(using=using)
+    using = using or 'default'
+    with transaction.atomic(using=using):
+        DocumentSummary.objects.using(using).all().delete()
+        DocumentSummary.objects.using(using).bulk_create(
+            [DocumentSummary(n_documents=n_documents, n_citations=n_citations,
+                             **dict(zip([field for field, _ in SUMMARY_KEYS], key)))
+             for key, (n_documents, n_citations) in aggregates.items()],
+            batch_size=BATCH_SIZE)
+    return len(aggregates)
+
+
+def check_summary(using=None):
+    """Compare DocumentSummary to the document table
+
+    Documents are read, and the summary found, as by `rebuild`. Returns a
+    list of (key, summary values, actual values) for each key where they
+    differ, with None for missing rows.
+    """
+    actual = _aggregate_documents(using=using)
+    summary = _summary_rows(using=using or 'default')
+    return [(key, summary.get(key), actual.get(key))
+            for key in sorted(set(actual) | set(summary))
+            if summary.get(key) != actual.get(key)]
+
+
+def summarize(by=('pub_year',), using='default', **filters):
+    """Document counts and citation totals from DocumentSummary
+
+    Parameters
+    ----------
+    by : sequence of strings
+        Names from SUMMARY_KEYS to group by
+    filters
+        Django lookups on DocumentSummary, e.g. pub_year__gte=2010
+
+    Returns
+    -------
+    list of dicts, with keys `by`, 'n_documents' and 'n_citations'
+    """
+    by = list(by)
+    return list(DocumentSummary.objects.using(using).filter(**filters)
+                .values(*by)
+                .annotate(n_documents=Sum('n_documents'), n_citations=Sum('n_citations'))
+                .order_by(*by))
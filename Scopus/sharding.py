@@ -0,0 +1,210 @@
+"""Sharding of document-level tables across several databases
+
+With `SCOPUS_SHARDS` in settings, documents and their records (authorship,
+itemid, citation, abstract, affiliation, and their compact or compressed
+variants; see SHARDED_TABLES) are stored in several databases, chosen by
+each document's pub_year, or by its EID with `SCOPUS_SHARD_KEY = 'eid'`.
+Each shard is listed with the inclusive range of keys it holds, None
+leaving a range open::
+
+    DATABASES = {'default': {...}, 'old': {...}, 'new': {...}}
+    DATABASE_ROUTERS = ['Scopus.sharding.ShardRouter']
+    SCOPUS_SHARDS = [
+        ('old', None, 1999),
+        ('new', 2000, None),
+    ]
+
+A citation is stored with the document it cites (cite_to), and an
+affiliation in each shard whose authorships refer to it.
+
+The default database holds everything else: sources, the work queue,
+metrics and summaries. Sources are allocated ids there, and replicated
+to each shard (with the same id) as documents referring to them are
+loaded, so that a document's source may be read from its own shard. Every
+database has the full schema: run `manage.py migrate --database <alias>`
+for each shard.
+
+The loader writes each batch of documents to its shards' connections, in
+one transaction per shard. Reads of a set of documents fan out to the
+shards which may hold them (`locate`) and are merged; where sharded by
+pub_year, that is every shard. The admin, the JSON API and the citation
+panels read this way. Other commands (export, audit, metrics rebuilds and
+so on) operate on one database, selected by their `using` argument where
+they have one.
+"""
+
+import collections
+import heapq
+import itertools
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from Scopus.xml_extract import json_log
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+
+KEYS = ('pub_year', 'eid')
+
+SHARDED_TABLES = frozenset([
+    'document',
+    'authorship',
+    'itemid',
+    'citation',
+    'citation_compact',
+    'abstract',
+    'abstract_compressed',
+    'affiliation',
+    'document_group',
+    'citation_canonical',
+])
+
+# Source ids known to be present in each shard
+_replicated = collections.defaultdict(set)
+
+
+def shards():
+    """Database aliases of the shards, in order"""
+    return [alias for alias, _, _ in getattr(settings, 'SCOPUS_SHARDS', None) or ()]
+
+
+def is_enabled():
+    return bool(shards())
+
+
+def shard_key():
+    key = getattr(settings, 'SCOPUS_SHARD_KEY', 'pub_year')
+    if key not in KEYS:
+        raise ValueError('SCOPUS_SHARD_KEY must be one of %s, not %r' % (', '.join(KEYS), key))
+    return key
+
+
+def is_sharded(model):
+    return is_enabled() and model._meta.db_table in SHARDED_TABLES
+
+
+def read_aliases():
+    """The databases holding documents"""
+    return shards() or ['default']
+
+
+def shard_for(value):
+    """The shard holding documents with this pub_year (or EID)"""
+    for alias, low, high in settings.SCOPUS_SHARDS:
+        if (low is None or value >= low) and (high is None or value <= high):
+            return alias
+    raise ValueError('No shard in SCOPUS_SHARDS for %s %r' % (shard_key(), value))
+
+
+def locate(eids):
+    """(alias, eids) for each database which may hold documents with eids
+
+    Where sharded by EID, each EID is looked up only in its shard; where
+    sharded by pub_year, in every shard.
+    """
+    if not is_enabled():
+        return [('default', list(eids))]
+    if shard_key() != 'eid':
+        return [(alias, list(eids)) for alias in shards()]
+    groups = collections.OrderedDict((alias, []) for alias in shards())
+    for eid in eids:
+        try:
+            groups[shard_for(eid)].append(eid)
+        except ValueError:
+            # cannot have been loaded
+            continue
+    return [(alias, group) for alias, group in groups.items() if group]
+
+
+def group_records(doc_records):
+    """(alias, doc_records) for the shard of each document"""
+    key = shard_key()
+    groups = collections.OrderedDict()
+    for doc_record in doc_records:
+        document = doc_record[0]
+        try:
+            alias = shard_for(getattr(document, key))
+        except ValueError:
+            json_log(error='No shard for document', context={'eid': document.eid},
+                     exception=True)
+            continue
+        groups.setdefault(alias, []).append(doc_record)
+    return list(groups.items())
+
+
+def replicate_sources(sources, using):
+    """Copy sources (saved in the default database) to a shard, if absent"""
+    from Scopus.models import Source
+    pks = set(source.pk for source in sources) - _replicated[using]
+    if not pks:
+        return
+    present = set(Source.objects.using(using).filter(pk__in=pks)
+                  .values_list('pk', flat=True))
+    for source in Source.objects.using('default').filter(pk__in=pks - present):
+        try:
+            with transaction.atomic(using=using):
+                source.save(using=using, force_insert=True)
+        except IntegrityError:
+            # replicated concurrently by another loader
+            pass
+    _replicated[using].update(pks)
+
+
+def document_exists(eid):
+    from Scopus.models import Document
+    return any(Document.objects.using(alias).filter(eid=eid).exists()
+               for alias, _ in locate([eid]))
+
+
+def sort_objects(objects, ordering):
+    """Sort model instances in place, as order_by(*ordering) would
+
+    Used to merge results fetched from several shards. Orderings which are
+    not field names are ignored.
+    """
+    for field in reversed(ordering):
+        if not isinstance(field, basestring):
+            continue
+        name = field.lstrip('-')
+
+        def key(obj, names=name.split('__')):
+            for attr in names:
+                obj = getattr(obj, attr, None)
+            # None sorts first, as it cannot be compared with values
+            return obj is not None, obj
+
+        objects.sort(key=key, reverse=field.startswith('-'))
+    return objects
+
+
+def merged(iterables, key):
+    """Merge iterables each sorted by key, into one sorted iterator"""
+    if len(iterables) == 1:
+        return iter(iterables[0])
+    counter = itertools.count()
+    decorated = [((key(item), next(counter), item) for item in iterable)
+                 for iterable in iterables]
+    return (item for _, _, item in heapq.merge(*decorated))
+
+
+class ShardRouter(object):
+    """Database router for SCOPUS_SHARDS
+
+    Records are read from, and written to, the database of a related
+    instance where there is one, so that, e.g., a document's authorships
+    and source are read from its shard; Django does this by default where
+    routers express no preference. Otherwise the default database is used:
+    code reading documents selects shards with `using`, through `locate`.
+
+    Sources may be related to records in any shard, as they are replicated.
+    """
+
+    def allow_relation(self, obj1, obj2, **hints):
+        from Scopus.models import Source
+        if isinstance(obj1, Source) or isinstance(obj2, Source):
+            return True
+        return None
@@ -0,0 +1,240 @@
+"""Parallel loading into SQLite through per-worker shard databases
+
+SQLite allows only one writer at a time, so loading from several processes
+into one database does not help. Instead, each worker writes to its own
+shard database, tuned for bulk loading, and the shards are then merged into
+the main database with `INSERT ... SELECT`.
+
+Shards are merged in the main database by:
+
+* inserting any `Source` not already present, and mapping each shard
+  `Source.id` to the main database's id, since ids are assigned
+  independently in each shard;
+* likewise for any `Affiliation` (see affiliations.py), mapping
+  `Authorship.affiliation_ref`;
+* inserting records for documents not already present in the main
+  database.
+"""
+
+import glob
+import logging
+import os
+import sqlite3
+
+import django.db
+from django.db import transaction
+from django.db.backends.signals import connection_created
+
+from Scopus.models import (
+    ItemID,
+    Source,
+    Document,
+    Citation,
+    Authorship,
+    Abstract,
+    CompactCitation,
+    CompressedAbstract,
+    Affiliation,
+)
+from Scopus.xml_extract import json_log
+from Scopus import compact_citations
+from Scopus import compression
+
+
+# Safe only because a shard that is lost can simply be reloaded
+LOAD_PRAGMAS = [
+    'PRAGMA journal_mode = OFF',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA cache_size = -262144',  # 256MB
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA locking_mode = EXCLUSIVE',
+]
+
+SHARD_PATTERN = 'shard-*.sqlite3'
+
+# Models whose records refer to a document, with the referring column
+DEPENDENT_MODELS = [
+    (ItemID, 'document_id'),
+    (Authorship, 'document_id'),
+    (Citation, 'cite_to'),
+    (Abstract, 'document_id'),
+]
+
+
+def _dependent_models():
+    models = DEPENDENT_MODELS
+    if compact_citations.is_compact():
+        models = [(CompactCitation, column) if model is Citation else (model, column)
+                  for model, column in models]
+    if compression.is_enabled():
+        models = [(CompressedAbstract, column) if model is Abstract else (model, column)
+                  for model, column in models]
+    return models
+
+
+def _columns(model, connection):
+    """Quoted columns to copy, excluding any auto-incremented id"""
+    quote_name = connection.ops.quote_name
+    return [quote_name(field.column) for field in model._meta.concrete_fields
+            if not (field.primary_key and field.get_internal_type() == 'AutoField')]
+
+
+def is_sqlite(using='default'):
+    return django.db.connections[using].vendor == 'sqlite'
+
+
+def create_shard(path, main_path):
+    """Create a shard database with the main database's tables
+
+    Secondary indexes are not copied, except those on Source (used to find
+    existing sources while loading) and unique constraints (which serve to
+    find existing affiliations).
+    """
+    tables = [model._meta.db_table
+              for model in [Source, Affiliation, Document] + [m for m, _ in _dependent_models()]]
+    main = sqlite3.connect(main_path)
+    try:
+        schema = main.execute(
+            'SELECT type, name, tbl_name, sql FROM sqlite_master '
+            'WHERE tbl_name IN (%s) AND sql IS NOT NULL '
+            "ORDER BY type = 'index'" % ', '.join('?' * len(tables)),
+            tables).fetchall()
+    finally:
+        main.close()
+
+    shard = sqlite3.connect(path)
+    try:
+        existing = set(name for name, in
+                       shard.execute('SELECT name FROM sqlite_master'))
+        for type_, name, table, sql in schema:
+            if name in existing:
+                continue
+            if (type_ == 'index' and table != Source._meta.db_table
+                    and not sql.upper().startswith('CREATE UNIQUE')):
+                continue
+            shard.execute(sql)
+        shard.commit()
+    finally:
+        shard.close()
+
+
+def _apply_pragmas(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        cursor = connection.cursor()
+        for pragma in LOAD_PRAGMAS:
+            cursor.execute(pragma)
+
+
+def open_shard(shard_dir, using='default'):
+    """Direct this process's writes to a new shard database
+
+    To be called in each worker process before it loads anything.
+    Returns the shard path.
+    """
+    connection = django.db.connections[using]
+    main_path = connection.settings_dict['NAME']
+    path = os.path.join(shard_dir, SHARD_PATTERN.replace('*', str(os.getpid())))
+    create_shard(path, main_path)
+    # Do not reuse any connection inherited from the parent
+    connection.close()
+    connection.settings_dict['NAME'] = path
+    connection_created.connect(_apply_pragmas, dispatch_uid='scopus-shard-pragmas')
+    return path
+
+
+def merge_shard(path, using='default'):
+    """Merge one shard database into the main database
+
+    Each shard is merged in a single transaction.
+    """
+    connection = django.db.connections[using]
+    cursor = connection.cursor()
+    quote_name = connection.ops.quote_name
+    source_table = quote_name(Source._meta.db_table)
+    document_table = quote_name(Document._meta.db_table)
+    source_columns = _columns(Source, connection)
+    affiliation_table = quote_name(Affiliation._meta.db_table)
+    affiliation_ref = quote_name(Authorship._meta.get_field('affiliation_ref').column)
+    source_key = ('{a}.scopus_source_id = {b}.scopus_source_id '
+                  'AND {a}.issn_print IS {b}.issn_print '
+                  'AND {a}.issn_electronic IS {b}.issn_electronic')
+
+    cursor.execute('ATTACH DATABASE %s AS shard', [path])
+    try:
+        with transaction.atomic(using=using):
+            cursor.execute(
+                'INSERT INTO main.{t} ({cols}) SELECT {s_cols} FROM shard.{t} s '
+                'WHERE NOT EXISTS (SELECT 1 FROM main.{t} m WHERE {key})'
+                .format(t=source_table,
+                        cols=', '.join(source_columns),
+                        s_cols=', '.join('s.' + c for c in source_columns),
+                        key=source_key.format(a='m', b='s')))
+            cursor.execute('DROP TABLE IF EXISTS temp.source_map')
+            cursor.execute(
+                'CREATE TEMP TABLE source_map AS '
+                'SELECT s.id AS shard_id, MIN(m.id) AS main_id '
+                'FROM shard.{t} s JOIN main.{t} m ON {key} GROUP BY s.id'
+                .format(t=source_table, key=source_key.format(a='m', b='s')))
+
+            affiliation_columns = _columns(Affiliation, connection)
+            cursor.execute(
+                'INSERT OR IGNORE INTO main.{t} ({cols}) SELECT {cols} FROM shard.{t}'
+                .format(t=affiliation_table, cols=', '.join(affiliation_columns)))
+            cursor.execute('DROP TABLE IF EXISTS temp.affiliation_map')
+            cursor.execute(
+                'CREATE TEMP TABLE affiliation_map (shard_id INTEGER PRIMARY KEY, main_id INTEGER)')
+            cursor.execute(
+                'INSERT INTO temp.affiliation_map SELECT s.id, m.id '
+                'FROM shard.{t} s JOIN main.{t} m '
+                'ON m.text_hash = s.text_hash AND m.affiliation_id = s.affiliation_id'
+                .format(t=affiliation_table))
+
+            # Dependent records first, while we can still tell which
+            # documents are new to the main database
+            for model, doc_column in _dependent_models():
+                columns = _columns(model, connection)
+                cursor.execute(
+                    # compact citations may already be present
+                    'INSERT OR IGNORE INTO main.{t} ({cols}) SELECT {s_cols} FROM shard.{t} '
+                    'WHERE {key} NOT IN (SELECT eid FROM main.{d})'
+                    .format(t=quote_name(model._meta.db_table), cols=', '.join(columns),
+                            s_cols=', '.join(
+                                '(SELECT main_id FROM temp.affiliation_map WHERE shard_id = %s)' % c
+                                if c == affiliation_ref else c
+                                for c in columns),
+                            key=doc_column, d=document_table))
+
+            columns = _columns(Document, connection)
+            source_column = quote_name(Document._meta.get_field('source').column)
+            cursor.execute(
+                'INSERT OR IGNORE INTO main.{t} ({cols}) SELECT {s_cols} '
+                'FROM shard.{t} d JOIN temp.source_map ON d.{source} = shard_id'
+                .format(t=document_table,
+                        source=source_column,
+                        cols=', '.join(columns),
+                        s_cols=', '.join('main_id' if c == source_column else 'd.' + c
+                                         for c in columns)))
+            n_documents = cursor.rowcount
+    finally:
+        cursor.execute('DROP TABLE IF EXISTS temp.source_map')
+        cursor.execute('DROP TABLE IF EXISTS temp.affiliation_map')
+        cursor.execute('DETACH DATABASE shard')
+    return n_documents
+
+
+def merge_shards(shard_dir, using='default', remove=True):
+    """Merge all shard databases in shard_dir into the main database"""
+    paths = sorted(glob.glob(os.path.join(shard_dir, SHARD_PATTERN)))
+    for path in paths:
+        logging.warning('Merging %s' % path)
+        try:
+            n_documents = merge_shard(path, using=using)
+        except Exception:
+            json_log(error='Failed to merge shard %r' % path,
+                     exception=True,
+                     method=logging.error)
+            raise
+        json_log(info='Merged shard', path=path, n_documents=n_documents)
+        if remove:
+            os.remove(path)
+    return len(paths)
@@ -0,0 +1,24 @@
+"""Settings for the test suite
+
+    python manage.py test Scopus --settings=Scopus.tests.settings
+
+Two SQLite databases are used, so that tests may shard documents across
+them. SCOPUS_SHARDS is only set by the tests which need it.
+"""
+
+import os
+
+from Scopus.settings import *  # noqa
+from Scopus.settings import BASE_DIR
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'test-default.sqlite3'),
+    },
+    'shard': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'test-shard.sqlite3'),
+    },
+}
+DATABASE_ROUTERS = ['Scopus.sharding.ShardRouter']
@@ -0,0 +1,94 @@
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.template.loader import get_template
+from django.test import TestCase
+
+from Scopus.db_loader import load_to_db
+from Scopus.models import Citation, Document, Source
+from Scopus.tests.utils import make_record, make_source
+
+
+class AdminTestCase(TestCase):
+
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        records = [make_record(eid, 2015, make_source()) for eid in (1, 2, 3)]
+        # document 1 cites documents 2 and 3
+        records[0][3].extend([Citation(cite_to=2, cite_from=1), Citation(cite_to=3, cite_from=1)])
+        load_to_db(records)
+        # citation panels are cached
+        cache.clear()
+
+
+class KeysetChangeListTests(AdminTestCase):
+    """The keyset change list template compiles and pages, on each Django supported"""
+
+    def test_template_compiles(self):
+        get_template('admin/keyset_change_list.html')
+
+    def test_document_change_list(self):
+        response = self.client.get(reverse('admin:Scopus_document_changelist'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([document.eid for document in response.context['cl'].result_list],
+                         [3, 2, 1])
+
+    def test_document_change_list_keyset_pages(self):
+        model_admin = admin.site._registry[Document]
+        model_admin.list_per_page = 2
+        try:
+            url = reverse('admin:Scopus_document_changelist')
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['cl'].keyset_next, 2)
+            self.assertIsNone(response.context['cl'].keyset_previous)
+            self.assertContains(response, '?after=2')
+
+            response = self.client.get(url, {'after': 2})
+            self.assertEqual([document.eid for document in response.context['cl'].result_list],
+                             [1])
+            self.assertIsNone(response.context['cl'].keyset_next)
+            self.assertContains(response, '?before=1')
+        finally:
+            del model_admin.list_per_page
+
+    def test_document_change_list_search(self):
+        response = self.client.get(reverse('admin:Scopus_document_changelist'),
+                                   {'q': 'Document'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_source_change_list(self):
+        self.assertEqual(Source.objects.count(), 1)
+        response = self.client.get(reverse('admin:Scopus_source_changelist'))
+        self.assertEqual(response.status_code, 200)
+
+
+class DocumentChangeFormTests(AdminTestCase):
+    """The document change form, with its citation panels, renders on each Django supported"""
+
+    def test_template_compiles(self):
+        get_template('admin/Scopus/document/change_form.html')
+
+    def test_cited_by_panel(self):
+        response = self.client.get(reverse('admin:Scopus_document_change', args=[2]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Document 2')
+        cited_by, references = response.context['citation_panels']
+        self.assertEqual(cited_by['direction'], 'cited_by')
+        self.assertEqual(sorted(eid for eid, _, _ in cited_by['documents']), [1, 1002])
+        self.assertEqual(references['documents'], [])
+        self.assertContains(response, reverse('admin:Scopus_document_change', args=[1]))
+        self.assertContains(response, '(not loaded)')
+
+    def test_references_panel(self):
+        response = self.client.get(reverse('admin:Scopus_document_change', args=[1]))
+        self.assertEqual(response.status_code, 200)
+        _, references = response.context['citation_panels']
+        self.assertEqual(sorted((eid, title) for eid, title, _ in references['documents']),
+                         [(2, 'Document 2'), (3, 'Document 3')])
+
+    def test_unknown_document(self):
+        response = self.client.get(reverse('admin:Scopus_document_change', args=[4]))
+        self.assertIn(response.status_code, (302, 404))
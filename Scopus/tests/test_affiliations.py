@@ -0,0 +1,61 @@
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from Scopus import affiliations
+from Scopus.db_loader import load_to_db
+from Scopus.models import Affiliation, Authorship
+from Scopus.tests.utils import make_record, make_source
+
+
+def _authorship(affiliation='School of Physics', afid=60000001):
+    return Authorship(document_id=1, surname='Author', order=1, affiliation_id=afid,
+                      affiliation=affiliation, country='aus', city='Sydney')
+
+
+class InternTests(TestCase):
+
+    def setUp(self):
+        affiliations._cache.clear()
+
+    def test_intern(self):
+        authorships = [_authorship(), _authorship(), _authorship('School of Chemistry')]
+        affiliations.intern(authorships)
+        self.assertEqual(Affiliation.objects.count(), 2)
+        self.assertEqual(authorships[0].affiliation_ref_id, authorships[1].affiliation_ref_id)
+        self.assertNotEqual(authorships[0].affiliation_ref_id,
+                            authorships[2].affiliation_ref_id)
+        self.assertEqual((authorships[0].affiliation, authorships[0].country), ('', ''))
+        self.assertEqual(affiliations.details(authorships[2]),
+                         ('School of Chemistry', 'aus', 'Sydney'))
+
+    def test_rolled_back_ids_not_cached(self):
+        try:
+            with transaction.atomic():
+                affiliations.intern([_authorship()])
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(Affiliation.objects.count(), 0)
+        authorship = _authorship()
+        affiliations.intern([authorship])
+        self.assertEqual(Affiliation.objects.get().pk, authorship.affiliation_ref_id)
+
+    @override_settings(SCOPUS_NORMALIZE_AFFILIATIONS=True)
+    def test_load_and_view(self):
+        load_to_db([make_record(1, 2015, make_source())])
+        authorship = Authorship.objects.get()
+        self.assertEqual(authorship.city, '')
+        cursor = connection.cursor()
+        cursor.execute('SELECT document_id, surname, city FROM authorship_denormalized')
+        self.assertEqual(cursor.fetchall(), [(1, 'Author', 'Sydney')])
+
+
+class InternCommittedTests(TransactionTestCase):
+
+    def setUp(self):
+        affiliations._cache.clear()
+
+    def test_committed_ids_cached(self):
+        affiliations.intern([_authorship()])
+        self.assertEqual(list(affiliations._cache['default'].values()),
+                         [Affiliation.objects.get().pk])
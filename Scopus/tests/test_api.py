@@ -0,0 +1,184 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.test import TestCase, override_settings
+
+from Scopus import api
+from Scopus import sharding
+from Scopus.db_loader import load_to_db
+from Scopus.models import Citation, Source
+from Scopus.tests.utils import make_record, make_source
+
+
+def _lines(response):
+    return [json.loads(line)
+            for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+
+
+class APITestCase(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        api.document_cache.clear()
+        sharding._replicated.clear()
+        User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.login(username='user', password='password')
+        records = [make_record(1, 2010, make_source(1)),
+                   make_record(2, 2015, make_source(1)),
+                   make_record(3, 2016, make_source(2))]
+        for document, _, authorships, _, _ in records:
+            authorships[0].author_id = 100 + document.eid % 2
+        # document 1 cites documents 2 and 3
+        records[0][3].extend([Citation(cite_to=2, cite_from=1), Citation(cite_to=3, cite_from=1)])
+        load_to_db(records)
+
+    def get(self, name, data=None, **kwargs):
+        return self.client.get(reverse('api-' + name), data or {}, **kwargs)
+
+    def get_lines(self, name, data=None):
+        response = self.get(name, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], api.CONTENT_TYPE)
+        return _lines(response)
+
+    def assertBadRequest(self, response, message):
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(message, json.loads(response.content.decode('utf-8'))['error'])
+
+
+class DocumentsTests(APITestCase):
+
+    def test_by_eid_in_order(self):
+        documents = self.get_lines('documents', {'eid': '3,1'})
+        self.assertEqual([document['eid'] for document in documents], [3, 1])
+        self.assertEqual(documents[1]['title'], 'Document 1')
+        self.assertEqual(documents[1]['source']['scopus_source_id'], 1)
+        self.assertNotIn('authors', documents[1])
+
+    def test_repeated_parameters_and_duplicates(self):
+        response = self.client.get(reverse('api-documents') + '?eid=2&eid=1,2')
+        self.assertEqual([document['eid'] for document in _lines(response)], [2, 1])
+
+    def test_unknown_eids_omitted(self):
+        self.assertEqual([document['eid']
+                          for document in self.get_lines('documents', {'eid': '99,2,98'})],
+                         [2])
+        self.assertEqual(self.get_lines('documents', {'eid': '99'}), [])
+
+    def test_include(self):
+        document, = self.get_lines('documents', {'eid': '1',
+                                                 'include': 'authors,itemids,abstract'})
+        self.assertEqual([author['surname'] for author in document['authors']], ['Author'])
+        self.assertEqual(document['authors'][0]['author_id'], 101)
+        self.assertEqual(document['authors'][0]['city'], 'Sydney')
+        self.assertEqual(document['itemids'], {'SGR': '1'})
+        self.assertEqual(document['abstract'], 'Abstract 1')
+
+    def test_cache_keyed_by_include(self):
+        self.get_lines('documents', {'eid': '1'})
+        document, = self.get_lines('documents', {'eid': '1', 'include': 'itemids'})
+        self.assertEqual(document['itemids'], {'SGR': '1'})
+
+    def test_by_author_and_source(self):
+        self.assertEqual([document['eid']
+                          for document in self.get_lines('documents', {'author_id': '101'})],
+                         [1, 3])
+        source_id = Source.objects.get(scopus_source_id=1).pk
+        self.assertEqual([document['eid']
+                          for document in self.get_lines('documents', {'source_id': source_id})],
+                         [1, 2])
+
+    def test_post(self):
+        for body, content_type in [('[3, 1]', 'application/json'),
+                                   ('{"eid": [3, 1]}', 'application/json'),
+                                   ('3\n1\n', 'text/plain')]:
+            response = self.client.post(reverse('api-documents'), body,
+                                        content_type=content_type)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([document['eid'] for document in _lines(response)], [3, 1])
+
+    def test_bad_input(self):
+        self.assertBadRequest(self.get('documents', {'eid': '1,x'}), 'eid must be integers')
+        self.assertBadRequest(self.get('documents'), 'One of eid, author_id, source_id')
+        self.assertBadRequest(self.get('documents', {'eid': '1', 'include': 'everything'}),
+                              'include must be from')
+        self.assertBadRequest(self.get('documents',
+                                       {'eid': ','.join(str(eid)
+                                                        for eid in range(api.MAX_IDS + 1))}),
+                              'At most')
+        self.assertBadRequest(self.client.post(reverse('api-documents'), '{"eid": "x"}',
+                                               content_type='application/json'),
+                              'eid must be integers')
+        self.assertEqual(self.client.put(reverse('api-documents')).status_code, 405)
+
+    def test_login_required(self):
+        self.client.logout()
+        self.assertEqual(self.get('documents', {'eid': '1'}).status_code, 403)
+        with self.settings(SCOPUS_API_PUBLIC=True):
+            self.assertEqual(len(self.get_lines('documents', {'eid': '1'})), 1)
+
+    @override_settings(SCOPUS_API_PUBLIC=True)
+    def test_queries_per_chunk(self):
+        eids = ','.join(str(eid) for eid in range(1, 2 * api.CHUNK_SIZE + 2))
+        # one query per chunk of IDs, and one for each include where
+        # documents are found in the chunk
+        with self.assertNumQueries(3):
+            documents = self.get_lines('documents', {'eid': eids})
+        self.assertEqual([document['eid'] for document in documents], [1, 2, 3])
+        with self.assertNumQueries(4):
+            self.get_lines('documents', {'eid': eids, 'include': 'authors'})
+        # cached documents are not fetched again
+        with self.assertNumQueries(0):
+            self.get_lines('documents', {'eid': '1,2,3'})
+
+
+class OtherEndpointTests(APITestCase):
+
+    def test_authorships(self):
+        self.assertEqual([(authorship['eid'], authorship['author_id'])
+                          for authorship in self.get_lines('authorships', {'eid': '3,1,99'})],
+                         [(1, 101), (3, 101)])
+        self.assertEqual([authorship['eid']
+                          for authorship in self.get_lines('authorships', {'author_id': '100'})],
+                         [2])
+        self.assertBadRequest(self.get('authorships', {'eid': 'x'}), 'eid must be integers')
+
+    def test_sources(self):
+        source_ids = sorted(Source.objects.values_list('pk', flat=True))
+        self.assertEqual([source['id'] for source in self.get_lines(
+            'sources', {'source_id': ','.join(map(str, source_ids + [999]))})],
+            source_ids)
+        source, = self.get_lines('sources', {'scopus_source_id': '2'})
+        self.assertEqual((source['source_title'], source['issn_print']),
+                         ('Journal 2', '00000002'))
+
+    def test_citations(self):
+        self.assertEqual(sorted(self.get_lines('citations', {'eid': '2,3'}),
+                                key=lambda citation: (citation['cite_to'], citation['cite_from'])),
+                         [{'cite_to': 2, 'cite_from': 1}, {'cite_to': 2, 'cite_from': 1002},
+                          {'cite_to': 3, 'cite_from': 1}, {'cite_to': 3, 'cite_from': 1003}])
+        self.assertEqual(sorted((citation['cite_to'], citation['cite_from'])
+                                for citation in self.get_lines(
+                                    'citations', {'eid': '1', 'direction': 'references'})),
+                         [(2, 1), (3, 1)])
+        self.assertBadRequest(self.get('citations', {'eid': '1', 'direction': 'sideways'}),
+                              'direction must be')
+
+
+@override_settings(SCOPUS_SHARDS=[('default', None, 2014), ('shard', 2015, None)])
+class ShardedAPITests(APITestCase):
+
+    def test_documents_merged_from_shards(self):
+        documents = self.get_lines('documents', {'eid': '3,1,2', 'include': 'authors'})
+        self.assertEqual([document['eid'] for document in documents], [3, 1, 2])
+        self.assertEqual([len(document['authors']) for document in documents], [1, 1, 1])
+
+    def test_authorships_and_citations_merged(self):
+        self.assertEqual([authorship['eid']
+                          for authorship in self.get_lines('authorships', {'author_id': '101'})],
+                         [1, 3])
+        self.assertEqual(sorted((citation['cite_to'], citation['cite_from'])
+                                for citation in self.get_lines(
+                                    'citations', {'eid': '1', 'direction': 'references'})),
+                         [(2, 1), (3, 1)])
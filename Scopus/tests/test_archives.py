@@ -0,0 +1,265 @@
+import io
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from distutils.spawn import find_executable
+
+from django.test import SimpleTestCase
+
+from Scopus import archives
+from Scopus.archives import PathFilter, _iter_sources, generate_xml_pairs, list_members, read_ahead
+
+
+def _touch(path):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    open(path, 'w').close()
+
+
+class PathFilterTests(SimpleTestCase):
+    """Selection of documents by year, from paths below the input root"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        # a snapshot directory itself named by year
+        self.root = os.path.join(self.tmp_dir, '2020-snapshot')
+        for year, eid in [(2015, 1), (2016, 2)]:
+            directory = os.path.join(self.root, str(year), '2-s2.0-%d' % eid)
+            _touch(os.path.join(directory, '2-s2.0-%d.xml' % eid))
+            _touch(os.path.join(directory, 'citedby.xml'))
+        with zipfile.ZipFile(os.path.join(self.root, '2015.zip'), 'w') as zf:
+            zf.writestr('2015/2-s2.0-3/2-s2.0-3.xml', '')
+        with zipfile.ZipFile(os.path.join(self.root, '2017.zip'), 'w') as zf:
+            zf.writestr('2017/2-s2.0-4/2-s2.0-4.xml', '')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _listed(self, path_filter):
+        return sorted(os.path.basename(member)
+                      for member in list_members(self.root, path_filter=path_filter))
+
+    def test_years_ok(self):
+        path_filter = PathFilter(years=[2015])
+        self.assertTrue(path_filter._years_ok(''))
+        self.assertTrue(path_filter._years_ok('2015/2-s2.0-1'))
+        self.assertTrue(path_filter._years_ok('data/2-s2.0-1'))
+        self.assertFalse(path_filter._years_ok('2016/2-s2.0-2'))
+        self.assertTrue(PathFilter()._years_ok('2016/2-s2.0-2'))
+
+    def test_root_not_checked_by_year(self):
+        path_filter = PathFilter(years=[2015])
+        self.assertTrue(path_filter.allow_source(self.root, root=True))
+        self.assertFalse(path_filter.allow_source(self.root))
+        self.assertTrue(path_filter.allow_source(os.path.join(self.root, '2015')))
+        self.assertFalse(path_filter.allow_source(os.path.join(self.root, '2016')))
+
+    def test_allow_document_below_root(self):
+        path_filter = PathFilter(years=[2015])
+        path = os.path.join(self.root, '2015', '2-s2.0-1', '2-s2.0-1.xml')
+        self.assertTrue(path_filter.allow_document(path, root=self.root))
+        self.assertTrue(path_filter.allow_document('2015/2-s2.0-3/2-s2.0-3.xml'))
+        self.assertFalse(path_filter.allow_document('2016/2-s2.0-3/2-s2.0-3.xml'))
+
+    def test_list_members_by_year(self):
+        self.assertEqual(self._listed(PathFilter(years=[2015])),
+                         ['2-s2.0-1.xml', '2-s2.0-3.xml', 'citedby.xml'])
+        self.assertEqual(self._listed(PathFilter(years=[2016, 2017])),
+                         ['2-s2.0-2.xml', '2-s2.0-4.xml', 'citedby.xml'])
+        self.assertEqual(len(self._listed(None)), 6)
+
+    def test_list_members_by_eid(self):
+        self.assertEqual(self._listed(PathFilter(eids=[2, 3])),
+                         ['2-s2.0-2.xml', '2-s2.0-3.xml', 'citedby.xml'])
+
+    def test_iter_sources_by_year(self):
+        sources = sorted(os.path.relpath(path, self.root)
+                         for path, _ in _iter_sources(self.root, path_filter=PathFilter(years=[2015])))
+        self.assertEqual(sources, ['2015.zip', os.path.join('2015', '2-s2.0-1')])
+
+
+class SlowFile(object):
+    """A local file whose reads are delayed, as on a network mount"""
+    delay = 0.05
+
+    def __init__(self, path, mode='r'):
+        self._f = open(path, mode)
+
+    def read(self, *args):
+        time.sleep(self.delay)
+        return self._f.read(*args)
+
+    def close(self):
+        self._f.close()
+
+
+class ReadAheadTests(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for year in range(2012, 2016):
+            for eid in range(year * 10, year * 10 + 2):
+                directory = os.path.join(self.root, str(year), '2-s2.0-%d' % eid)
+                _touch(os.path.join(directory, '2-s2.0-%d.xml' % eid))
+                _touch(os.path.join(directory, 'citedby.xml'))
+        # files in directories are opened with the module's open
+        archives.open = SlowFile
+        self._put_timeout = archives.PUT_TIMEOUT
+        archives.PUT_TIMEOUT = 0.01
+
+    def tearDown(self):
+        del archives.open
+        archives.PUT_TIMEOUT = self._put_timeout
+        shutil.rmtree(self.root)
+
+    def _eids(self, pairs):
+        return sorted(archives.path_eid(path) for path, _, _ in pairs)
+
+    def test_same_pairs(self):
+        self.assertEqual(self._eids(read_ahead([self.root], n_threads=3)),
+                         self._eids(generate_xml_pairs(self.root)))
+
+    def test_reads_overlap(self):
+        start = time.time()
+        serial = self._eids(generate_xml_pairs(self.root))
+        serial_seconds = time.time() - start
+        start = time.time()
+        threaded = self._eids(read_ahead([self.root], n_threads=4))
+        threaded_seconds = time.time() - start
+        self.assertEqual(threaded, serial)
+        # 16 reads of 0.05s, a quarter of them in each thread
+        self.assertLess(threaded_seconds, serial_seconds * 0.6)
+
+    def test_threads_stop_with_consumer(self):
+        pairs = read_ahead([self.root], n_threads=2, buffer_size=1)
+        next(pairs)
+        pairs.close()
+        for thread in threading.enumerate():
+            if thread.name.startswith('read-ahead-'):
+                thread.join(5)
+                self.assertFalse(thread.is_alive())
+
+
+# Archive members, as in a snapshot
+MEMBERS = [('2015/2-s2.0-1/2-s2.0-1.xml', b'<document eid="1"/>'),
+           ('2015/2-s2.0-1/citedby.xml', b'<cited-by eid="1"/>'),
+           ('2015/2-s2.0-2/2-s2.0-2.xml', b'<document eid="2"/>'),
+           ('2015/2-s2.0-2/citedby.xml', b'<cited-by eid="2"/>')]
+
+EXPECTED_PAIRS = [('2015/2-s2.0-1/2-s2.0-1.xml', b'<document eid="1"/>', b'<cited-by eid="1"/>'),
+                  ('2015/2-s2.0-2/2-s2.0-2.xml', b'<document eid="2"/>', b'<cited-by eid="2"/>')]
+
+
+def _write_zip(path):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in MEMBERS:
+            zf.writestr(name, data)
+
+
+def _write_tar(path):
+    with tarfile.open(path, 'w:gz') as tf:
+        for name, data in MEMBERS:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+
+
+class ArchiveTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _path(self, name):
+        return os.path.join(self.tmp_dir, name)
+
+    def _pairs(self, path, **kwargs):
+        return sorted((name, xml, citedby)
+                      for name, xml, citedby in generate_xml_pairs(path, **kwargs))
+
+
+@unittest.skipUnless(hasattr(os, 'mkfifo'), 'named pipes are unsupported')
+class PipeTests(ArchiveTestCase):
+    """Archives streamed from a named pipe"""
+
+    def _assert_pipe_pairs(self, write):
+        write(self._path('archive'))
+        os.mkfifo(self._path('pipe'))
+
+        def feed():
+            with open(self._path('archive'), 'rb') as src:
+                with open(self._path('pipe'), 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+
+        thread = threading.Thread(target=feed)
+        thread.daemon = True
+        thread.start()
+        self.assertEqual(self._pairs(self._path('pipe')), EXPECTED_PAIRS)
+        thread.join(5)
+
+    def test_zip_from_pipe(self):
+        self._assert_pipe_pairs(_write_zip)
+
+    def test_tar_from_pipe(self):
+        self._assert_pipe_pairs(_write_tar)
+
+
+@unittest.skipUnless(find_executable('gpg'), 'gpg is not installed')
+class GPGTests(ArchiveTestCase):
+    """Encrypted archives, decrypted by gpg into a pipe"""
+
+    def setUp(self):
+        super(GPGTests, self).setUp()
+        self._gnupghome = os.environ.get('GNUPGHOME')
+        self.passphrase_file = self._path('passphrase')
+        with open(self.passphrase_file, 'w') as f:
+            f.write('secret\n')
+
+    def tearDown(self):
+        if self._gnupghome is None:
+            os.environ.pop('GNUPGHOME', None)
+        else:
+            os.environ['GNUPGHOME'] = self._gnupghome
+        if find_executable('gpgconf'):
+            for home in ('encrypt-home', 'decrypt-home'):
+                subprocess.call(['gpgconf', '--homedir', self._path(home),
+                                 '--kill', 'gpg-agent'])
+        super(GPGTests, self).tearDown()
+
+    def _encrypt(self, write, name):
+        write(self._path(name))
+        # encrypted and decrypted with separate homes, so that no cached
+        # passphrase is used; without key stretching, to be quick
+        for home in ('encrypt-home', 'decrypt-home'):
+            os.mkdir(self._path(home), 0o700)
+        subprocess.check_call(['gpg', '--batch', '--quiet',
+                               '--homedir', self._path('encrypt-home'),
+                               '--pinentry-mode', 'loopback',
+                               '--passphrase-file', self.passphrase_file,
+                               '--s2k-mode', '1', '--symmetric',
+                               '-o', self._path(name + '.gpg'), self._path(name)])
+        os.environ['GNUPGHOME'] = self._path('decrypt-home')
+        return self._path(name + '.gpg')
+
+    def test_zip(self):
+        path = self._encrypt(_write_zip, '2015.zip')
+        self.assertEqual(self._pairs(path, passphrase_file=self.passphrase_file),
+                         EXPECTED_PAIRS)
+
+    def test_tar(self):
+        path = self._encrypt(_write_tar, '2015.tar.gz')
+        self.assertEqual(self._pairs(path, passphrase_file=self.passphrase_file),
+                         EXPECTED_PAIRS)
+
+    def test_list_members(self):
+        path = self._encrypt(_write_zip, '2015.zip')
+        self.assertEqual(sorted(list_members(path, passphrase_file=self.passphrase_file)),
+                         [name for name, _ in MEMBERS])
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import zipfile
+
+from django.test import TestCase, override_settings
+
+from Scopus import audit
+from Scopus import sharding
+from Scopus.db_loader import load_to_db
+from Scopus.models import Citation, Document, ItemID
+from Scopus.tests.utils import make_record, make_source
+
+
+SHARDS = [('default', None, 2014), ('shard', 2015, None)]
+
+
+@override_settings(SCOPUS_SHARDS=SHARDS)
+class ShardedAuditTests(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        sharding._replicated.clear()
+        source = make_source()
+        load_to_db([make_record(1, 2010, source), make_record(2, 2016, source),
+                    make_record(3, 2012, source)])
+
+    def test_document_eids_from_every_shard(self):
+        eids, citation_count = audit.document_eids()
+        self.assertEqual(eids.tolist(), [1, 2, 3])
+        self.assertEqual(citation_count.tolist(), [1, 1, 1])
+        self.assertEqual(audit.document_eids(using='shard')[0].tolist(), [2])
+
+    def test_audit_every_shard(self):
+        report, eids = audit.audit()
+        self.assertEqual(report['db_documents'], 3)
+        self.assertEqual(report['itemid_rows'], 3)
+        self.assertEqual(report['documents_without_authorship'], 0)
+        self.assertEqual(report['citation_count_mismatches'], 0)
+        self.assertEqual(eids['partial'].tolist(), [])
+
+
+class AuditTests(TestCase):
+
+    def setUp(self):
+        # the archives hold documents 1 to 6, 5 twice, and 6 without its
+        # citedby.xml
+        self.tmp_dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp_dir, 'snapshot')
+        for eid in range(1, 6):
+            directory = os.path.join(self.root, '2015', '2-s2.0-%d' % eid)
+            os.makedirs(directory)
+            for name in ('2-s2.0-%d.xml' % eid, 'citedby.xml'):
+                open(os.path.join(directory, name), 'w').close()
+        with zipfile.ZipFile(os.path.join(self.root, '2016.zip'), 'w') as zf:
+            zf.writestr('2016/2-s2.0-5/2-s2.0-5.xml', '')
+            zf.writestr('2016/2-s2.0-5/citedby.xml', '')
+            zf.writestr('2016/2-s2.0-6/2-s2.0-6.xml', '')
+
+        # the database holds documents 1 to 4, and 7
+        source = make_source()
+        load_to_db([make_record(eid, 2015, source) for eid in (1, 2, 3, 4, 7)])
+        # 2 has no item IDs, and 3 none of its citations
+        ItemID.objects.filter(document_id=2).delete()
+        Citation.objects.filter(cite_to=3).delete()
+        # 4 cites nothing, as it should
+        Document.objects.filter(eid=4).update(citation_count=0)
+        Citation.objects.filter(cite_to=4).delete()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_missing_and_partial(self):
+        report, eids = audit.audit([self.root])
+        self.assertEqual(eids['missing'].tolist(), [5, 6])
+        self.assertEqual(eids['partial'].tolist(), [2, 3])
+        self.assertEqual(eids['duplicated'].tolist(), [5])
+        self.assertEqual(eids['unexpected'].tolist(), [7])
+        self.assertEqual((report['archive_documents'], report['db_documents'],
+                          report['missing'], report['partial'], report['unpaired']),
+                         (6, 5, 2, 2, 1))
+        self.assertEqual(report['documents_without_itemid'], 1)
+        self.assertEqual(report['documents_without_citation'], 2)
+        self.assertEqual(report['citation_count_mismatches'], 1)
+        self.assertEqual(report['orphaned_itemid_rows'], 0)
+
+    def test_tables_not_loaded_are_not_checked(self):
+        report, eids = audit.audit(tables=['itemid'])
+        self.assertEqual(eids['partial'].tolist(), [2])
+        self.assertNotIn('citation_rows', report)
+        self.assertNotIn('missing', eids)
+
+    def test_orphaned_rows(self):
+        Document.objects.filter(eid=7).delete()
+        ItemID.objects.create(document_id=8, item_id='8', item_type='SGR')
+        report, _ = audit.audit()
+        self.assertEqual(report['orphaned_itemid_rows'], 1)
+        self.assertEqual(report['orphaned_authorship_rows'], 0)
+
+    def test_write_eids(self):
+        path = os.path.join(self.tmp_dir, 'eids.txt')
+        audit.write_eids(path, audit.audit([self.root])[1]['missing'])
+        with open(path) as f:
+            self.assertEqual(f.read(), '5\n6\n')
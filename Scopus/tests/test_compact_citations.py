@@ -0,0 +1,45 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from Scopus import compact_citations
+from Scopus.db_loader import load_to_db
+from Scopus.models import Citation, CompactCitation
+from Scopus.tests.utils import make_record, make_source
+
+
+def _edges():
+    return sorted(CompactCitation.objects.values_list('cite_to', 'cite_from'))
+
+
+class CompactCitationTests(TestCase):
+
+    def test_table_is_without_rowid(self):
+        cursor = connection.cursor()
+        cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'citation_compact'")
+        self.assertIn('WITHOUT ROWID', cursor.fetchone()[0])
+
+    def test_duplicate_edges_ignored(self):
+        compact_citations.insert_edges([(1, 2), (1, 3), (1, 2)])
+        compact_citations.insert_edges([(1, 3), (2, 3)])
+        self.assertEqual(_edges(), [(1, 2), (1, 3), (2, 3)])
+
+    @override_settings(SCOPUS_COMPACT_CITATIONS=True)
+    def test_load_ignores_repeated_citations(self):
+        record = make_record(1, 2015, make_source())
+        # repeated in citedby.xml
+        record[3].extend([Citation(cite_to=1, cite_from=1001), Citation(cite_to=1, cite_from=5)])
+        load_to_db([record])
+        self.assertEqual(_edges(), [(1, 5), (1, 1001)])
+        self.assertFalse(Citation.objects.exists())
+
+    def test_copy_from_citation(self):
+        Citation.objects.bulk_create([Citation(cite_to=1, cite_from=2),
+                                      Citation(cite_to=1, cite_from=2),
+                                      Citation(cite_to=2, cite_from=3)])
+        compact_citations.insert_edges([(2, 3)])
+        last_id = compact_citations.copy_from_citation(batch_size=2)
+        self.assertEqual(last_id, Citation.objects.order_by('-id')[0].id)
+        self.assertEqual(_edges(), [(1, 2), (2, 3)])
+        # resumed copies add nothing again
+        compact_citations.copy_from_citation(start_id=0)
+        self.assertEqual(_edges(), [(1, 2), (2, 3)])
@@ -0,0 +1,101 @@
+import unittest
+
+import django.db
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from Scopus import compression
+from Scopus import export
+from Scopus.db_loader import load_to_db
+from Scopus.models import Abstract, CompressedAbstract
+from Scopus.tests.utils import make_record, make_source
+
+
+TEXT = u'An abstract, with some non-ASCII text: \u00e9t\u00e9. ' * 10
+
+
+class CodecTests(SimpleTestCase):
+
+    def setUp(self):
+        compression._zstd.clear()
+
+    def tearDown(self):
+        compression._zstd.clear()
+
+    def test_zlib(self):
+        data = compression.compress(TEXT, 'zlib')
+        self.assertIsInstance(data, compression.Compressed)
+        self.assertEqual(data[:1], b'z')
+        self.assertLess(len(data), len(TEXT.encode('utf-8')))
+        self.assertEqual(compression.decompress(data), TEXT)
+        self.assertEqual(compression.to_text(data), TEXT)
+        self.assertEqual(compression.to_text(TEXT), TEXT)
+
+    @unittest.skipIf(compression.zstandard is None, 'zstandard is not installed')
+    def test_zstd(self):
+        data = compression.compress(TEXT, 'zstd')
+        self.assertEqual(data[:1], b's')
+        self.assertEqual(compression.decompress(data), TEXT)
+        # read whatever the setting
+        with self.settings(SCOPUS_ABSTRACT_COMPRESSION='zlib'):
+            self.assertEqual(compression.decompress(data), TEXT)
+
+    def test_codec_setting(self):
+        self.assertFalse(compression.is_enabled())
+        self.assertIs(compression.abstract_model(), Abstract)
+        with self.settings(SCOPUS_ABSTRACT_COMPRESSION='zlib'):
+            self.assertIs(compression.abstract_model(), CompressedAbstract)
+            self.assertEqual(compression.compress(TEXT)[:1], b'z')
+        with self.settings(SCOPUS_ABSTRACT_COMPRESSION='gzip'):
+            with self.assertRaises(ValueError):
+                compression.codec()
+
+    def test_unknown_prefix(self):
+        with self.assertRaises(ValueError):
+            compression.decompress(b'x' + TEXT.encode('utf-8'))
+
+
+@override_settings(SCOPUS_ABSTRACT_COMPRESSION='zlib')
+class CompressedAbstractTests(TestCase):
+
+    def setUp(self):
+        source = make_source()
+        records = [make_record(eid, 2015, source) for eid in (1, 2, 3)]
+        records[0][4][0].abstract = compression.compress(TEXT)
+        load_to_db(records)
+
+    def _stored(self):
+        cursor = django.db.connection.cursor()
+        cursor.execute('SELECT document_id, abstract FROM abstract_compressed '
+                       'ORDER BY document_id')
+        return [(document_id, bytes(data)) for document_id, data in cursor.fetchall()]
+
+    def test_loaded_compressed(self):
+        self.assertFalse(Abstract.objects.exists())
+        stored = self._stored()
+        self.assertEqual([document_id for document_id, _ in stored], [1, 2, 3])
+        # compressed once, not again when saved
+        self.assertEqual(compression.decompress(stored[0][1]), TEXT)
+        self.assertEqual(stored[1][1][:1], b'z')
+        self.assertEqual(CompressedAbstract.objects.get(document_id=1).abstract, TEXT)
+        self.assertEqual(CompressedAbstract.objects.get(document_id=2).abstract, 'Abstract 2')
+
+    def test_move_abstracts(self):
+        moved = []
+        self.assertEqual(compression.move_abstracts(to_compressed=False, batch_size=2,
+                                                    callback=moved.append),
+                         3)
+        self.assertEqual(moved, [2, 3])
+        self.assertFalse(CompressedAbstract.objects.exists())
+        self.assertEqual(sorted(Abstract.objects.values_list('document_id', 'abstract')),
+                         [(1, TEXT), (2, 'Abstract 2'), (3, 'Abstract 3')])
+
+        self.assertEqual(compression.move_abstracts(batch_size=2), 3)
+        self.assertFalse(Abstract.objects.exists())
+        self.assertEqual(compression.decompress(self._stored()[0][1]), TEXT)
+        # ids were kept, and new ones follow them
+        self.assertEqual(CompressedAbstract.objects.create(document_id=3, abstract='x').pk, 4)
+
+    def test_exported_decompressed(self):
+        rows = list(next(export._chunks('abstract', 2015, None, 10))[0])
+        self.assertEqual([(document_id, abstract) for _, document_id, abstract in rows],
+                         [(1, TEXT), (2, 'Abstract 2'), (3, 'Abstract 3')])
@@ -0,0 +1,35 @@
+import sys
+
+from django.test import SimpleTestCase, override_settings
+from django.utils.six import StringIO
+
+from Scopus import db_loader
+
+
+class GetTablesTests(SimpleTestCase):
+
+    def test_get_tables(self):
+        self.assertEqual(db_loader.get_tables('authorship, citation'),
+                         frozenset(['document', 'authorship', 'citation']))
+        self.assertEqual(db_loader.get_tables(), frozenset(db_loader.TABLES))
+        with override_settings(SCOPUS_TABLES=['itemid']):
+            self.assertEqual(db_loader.get_tables(), frozenset(['document', 'itemid']))
+        with self.assertRaises(ValueError):
+            db_loader.get_tables('authorships')
+
+
+class MainTests(SimpleTestCase):
+
+    def setUp(self):
+        self._argv, self._stderr = sys.argv, sys.stderr
+        sys.stderr = StringIO()
+
+    def tearDown(self):
+        sys.argv, sys.stderr = self._argv, self._stderr
+
+    def test_unknown_tables_reported_as_usage_error(self):
+        sys.argv = ['db_loader', '--tables', 'authorships', '/data/2015.zip']
+        with self.assertRaises(SystemExit) as cm:
+            db_loader.main()
+        self.assertEqual(cm.exception.code, 2)
+        self.assertIn("Unknown tables ['authorships']", sys.stderr.getvalue())
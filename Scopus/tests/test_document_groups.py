@@ -0,0 +1,65 @@
+from django.test import TestCase, override_settings
+
+from Scopus import document_groups
+from Scopus.db_loader import load_to_db
+from Scopus.models import CanonicalCitation, Citation, DocumentGroup
+from Scopus.tests.utils import make_record, make_source
+
+
+@override_settings(SCOPUS_DOCUMENT_GROUPS=True, SCOPUS_CANONICAL_CITATIONS=True)
+class ResolveTests(TestCase):
+
+    def setUp(self):
+        self.source = make_source()
+
+    def _record(self, eid, group_id=None, cited_by=()):
+        record = make_record(eid, 2015, self.source)
+        record[0].group_id = group_id
+        record[3].extend(Citation(cite_to=eid, cite_from=cite_from) for cite_from in cited_by)
+        return record
+
+    def _groups(self):
+        return sorted(DocumentGroup.objects.values_list('eid', 'canonical_eid', 'group_size'))
+
+    def _edges(self):
+        return sorted(CanonicalCitation.objects.values_list('cite_to', 'cite_from'))
+
+    def test_groups_resolved_across_batches(self):
+        # group 2 is loaded in two batches, the first without document 2
+        load_to_db([self._record(1, group_id=2, cited_by=[3]), self._record(3)])
+        load_to_db([self._record(2, group_id=2, cited_by=[3]), self._record(4, group_id=2)])
+        # each batch is mapped alone
+        self.assertEqual(self._groups(), [(1, 1, 1), (2, 2, 2), (3, 3, 1), (4, 2, 2)])
+        self.assertEqual(self._edges(), [(1, 3), (1, 1001), (2, 3), (2, 1002), (2, 1004),
+                                         (3, 1003)])
+
+        self.assertEqual(document_groups.resolve(),
+                         {'added': 0, 'changed': 3, 'rewritten': 2})
+        self.assertEqual(self._groups(), [(1, 2, 3), (2, 2, 3), (3, 3, 1), (4, 2, 3)])
+        # document 3's citation of 1 and of 2 is one edge
+        self.assertEqual(self._edges(), [(2, 3), (2, 1001), (2, 1002), (2, 1004), (3, 1003)])
+        self.assertEqual(document_groups.canonical_eids([1, 3, 5]), {1: 2, 3: 3})
+
+        # nothing more to resolve
+        self.assertEqual(document_groups.resolve(),
+                         {'added': 0, 'changed': 0, 'rewritten': 0})
+
+    def test_canonical_by_least_eid_until_group_id_loaded(self):
+        load_to_db([self._record(5, group_id=2)])
+        load_to_db([self._record(4, group_id=2)])
+        document_groups.resolve()
+        self.assertEqual(self._groups(), [(4, 4, 2), (5, 4, 2)])
+        load_to_db([self._record(2, group_id=2)])
+        document_groups.resolve()
+        self.assertEqual(self._groups(), [(2, 2, 3), (4, 2, 3), (5, 2, 3)])
+
+    def test_backfill(self):
+        with self.settings(SCOPUS_DOCUMENT_GROUPS=False, SCOPUS_CANONICAL_CITATIONS=False):
+            load_to_db([self._record(1, group_id=2), self._record(2, group_id=2),
+                        self._record(3, cited_by=[1])])
+        self.assertEqual(self._groups(), [])
+        self.assertEqual(document_groups.resolve(backfill=True),
+                         {'added': 3, 'changed': 2, 'rewritten': 2})
+        self.assertEqual(self._groups(), [(1, 2, 2), (2, 2, 2), (3, 3, 1)])
+        # both ends of citations are canonicalised
+        self.assertEqual(self._edges(), [(2, 1001), (2, 1002), (3, 2), (3, 1003)])
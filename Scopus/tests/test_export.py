@@ -0,0 +1,95 @@
+import csv
+import gzip
+import io
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from Scopus import export
+from Scopus.db_loader import load_to_db
+from Scopus.tests.utils import make_record, make_source
+
+
+class Interrupted(Exception):
+    pass
+
+
+def _read_csv(path):
+    # the file is a series of gzip members, one per chunk
+    with gzip.open(path, 'rb') as f:
+        return list(csv.reader(io.StringIO(f.read().decode('utf-8'))))
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.out_dir, 'document'))
+        source = make_source()
+        load_to_db([make_record(eid, 2015, source) for eid in range(1, 6)])
+        self._chunks = export._chunks
+
+    def tearDown(self):
+        export._chunks = self._chunks
+        shutil.rmtree(self.out_dir)
+
+    def _interrupt_after(self, n_chunks):
+        chunks = self._chunks
+
+        def interrupted(*args, **kwargs):
+            for i, chunk in enumerate(chunks(*args, **kwargs)):
+                if i == n_chunks:
+                    raise Interrupted()
+                yield chunk
+        export._chunks = interrupted
+
+    def _eids(self, path):
+        rows = _read_csv(path)
+        self.assertEqual(rows[0][0], 'eid')
+        return [int(row[0]) for row in rows[1:]]
+
+    def test_resume_partial(self):
+        path = export.partition_path(self.out_dir, 'document', 2015, 'csv')
+        self._interrupt_after(2)
+        with self.assertRaises(Interrupted):
+            export.export_partition(self.out_dir, 'document', 2015, chunk_size=2)
+        self.assertFalse(os.path.exists(path))
+        size = os.path.getsize(path + '.partial')
+        self.assertEqual(export._read_state(path), {'after': 4, 'size': size, 'n_rows': 4})
+        # a chunk written but not recorded is discarded
+        with open(path + '.partial', 'ab') as f:
+            f.write(b'\x1f\x8b incomplete')
+
+        export._chunks = self._chunks
+        self.assertEqual(export.export_partition(self.out_dir, 'document', 2015, chunk_size=2),
+                         5)
+        self.assertEqual(self._eids(path), [1, 2, 3, 4, 5])
+        self.assertFalse(os.path.exists(path + '.partial'))
+        self.assertFalse(os.path.exists(path + '.state'))
+        # complete partitions are skipped
+        self.assertIsNone(export.export_partition(self.out_dir, 'document', 2015))
+
+    def test_restart_without_state(self):
+        path = export.partition_path(self.out_dir, 'document', 2015, 'csv')
+        with open(path + '.partial', 'wb') as f:
+            f.write(b'\x1f\x8b incomplete')
+        self.assertEqual(export.export_partition(self.out_dir, 'document', 2015, chunk_size=2),
+                         5)
+        self.assertEqual(self._eids(path), [1, 2, 3, 4, 5])
+
+    def test_export_resumes_each_partition(self):
+        self._interrupt_after(1)
+        with self.assertRaises(Interrupted):
+            export.export(self.out_dir, tables=['document', 'authorship'], chunk_size=2)
+        export._chunks = self._chunks
+        completed = []
+        self.assertEqual(export.export(self.out_dir, tables=['document', 'authorship'],
+                                       chunk_size=2,
+                                       callback=lambda *args: completed.append(args)),
+                         2)
+        self.assertEqual(completed, [('document', 2015, 5), ('authorship', 2015, 5)])
+        rows = _read_csv(export.partition_path(self.out_dir, 'authorship', 2015, 'csv'))
+        self.assertEqual([row[rows[0].index('document_id')] for row in rows[1:]],
+                         ['1', '2', '3', '4', '5'])
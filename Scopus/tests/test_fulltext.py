@@ -0,0 +1,67 @@
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from Scopus import fulltext
+from Scopus.db_loader import load_to_db
+from Scopus.models import Source
+from Scopus.tests.utils import make_record, make_source
+
+
+@override_settings(SCOPUS_FULLTEXT=True)
+class FullTextTests(TestCase):
+    """The FTS5 index on SQLite, filled as documents are loaded"""
+
+    def setUp(self):
+        if not fulltext.is_supported(connection):
+            self.skipTest('SQLite is built without FTS5')
+        fulltext._available.clear()
+        source = make_source()
+        records = [make_record(eid, 2015, source) for eid in (1, 2, 3)]
+        for (document, _, authorships, _, _), title, surname in zip(
+                records,
+                ['Citation networks in physics', 'Networks of galaxies', 'Protein folding'],
+                ['Jones', 'Jones', 'Smith']):
+            document.title = title
+            authorships[0].surname = surname
+        load_to_db(records)
+
+    def test_tables_created_by_migration(self):
+        self.assertTrue(fulltext.is_available('document'))
+        self.assertTrue(fulltext.is_available('source'))
+
+    def test_search(self):
+        self.assertEqual(sorted(fulltext.search('networks')), [1, 2])
+        self.assertEqual(sorted(fulltext.search('network*')), [1, 2])
+        self.assertEqual(fulltext.search('galaxies networks'), [2])
+        self.assertEqual(fulltext.search('abstract 3'), [3])
+        self.assertEqual(fulltext.search('folding networks'), [])
+        self.assertEqual(fulltext.search(' '), [])
+
+    def test_search_columns(self):
+        self.assertEqual(fulltext.search('smith', columns=('authors',)), [3])
+        self.assertEqual(fulltext.search('physics', columns=('authors',)), [])
+
+    def test_query_syntax_is_quoted(self):
+        self.assertEqual(fulltext.search('networks OR NOT "folding'), [])
+        self.assertEqual(fulltext.search('title:networks'), [])
+
+    def test_search_sources(self):
+        self.assertEqual(fulltext.search('journal', name='source'),
+                         list(Source.objects.values_list('pk', flat=True)))
+
+    def test_index_missing(self):
+        self.assertEqual(fulltext.index_missing('document'), 0)
+        fulltext.clear('document')
+        self.assertEqual(fulltext.search('networks'), [])
+        self.assertEqual(fulltext.index_missing('document'), 3)
+        self.assertEqual(sorted(fulltext.search('networks')), [1, 2])
+
+    def test_admin_search(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        response = self.client.get(reverse('admin:Scopus_document_changelist'),
+                                   {'q': 'galaxies'})
+        self.assertEqual([document.eid for document in response.context['cl'].result_list],
+                         [2])
@@ -0,0 +1,72 @@
+import shutil
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+
+from Scopus import graph
+from Scopus.db_loader import load_to_db
+from Scopus.models import Citation
+from Scopus.tests.utils import make_record, make_source
+
+
+def _dense_pagerank(cite_to, cite_from, n_nodes, damping=0.85, n_iter=200):
+    """PageRank by the textbook dense formulation, for comparison"""
+    links = np.zeros((n_nodes, n_nodes))
+    links[cite_to, cite_from] = 1
+    out_degree = links.sum(axis=0)
+    transition = links / np.where(out_degree, out_degree, 1)
+    rank = np.full(n_nodes, 1. / n_nodes)
+    for _ in range(n_iter):
+        dangling = rank[out_degree == 0].sum()
+        rank = damping * (transition.dot(rank) + dangling / n_nodes) + (1 - damping) / n_nodes
+    return rank
+
+
+class PageRankTests(SimpleTestCase):
+
+    def test_small_graph(self):
+        # EIDs 10..14: 11 and 12 cite 10, 12 cites 11, 13 cites 12 and 10,
+        # and 14 is a document citing and cited by nothing
+        cite_to = [10, 10, 11, 12, 10, 10]
+        cite_from = [11, 12, 12, 13, 13, 11]
+        citation_graph = graph.CitationGraph.from_edges(cite_to, cite_from, doc_eids=[14])
+        self.assertEqual(citation_graph.eids.tolist(), [10, 11, 12, 13, 14])
+        # the repeated edge is counted once
+        self.assertEqual(citation_graph.n_edges, 5)
+        rank = citation_graph.pagerank()
+        expected = _dense_pagerank(np.array(cite_to) - 10, np.array(cite_from) - 10, 5)
+        np.testing.assert_allclose(rank, expected, rtol=1e-6)
+        self.assertAlmostEqual(rank.sum(), 1)
+        self.assertEqual(np.argsort(-rank)[0], 0)
+
+    def test_symmetric_cycle(self):
+        rank = graph.CitationGraph.from_edges([1, 2, 3], [2, 3, 1]).pagerank()
+        np.testing.assert_allclose(rank, [1. / 3] * 3)
+
+    def test_empty(self):
+        self.assertEqual(len(graph.CitationGraph.from_edges([], []).pagerank()), 0)
+
+
+class FromDatabaseTests(TestCase):
+
+    def test_from_database(self):
+        source = make_source()
+        records = [make_record(eid, 2015, source) for eid in (1, 2)]
+        # document 2 cites document 1
+        records[0][3].append(Citation(cite_to=1, cite_from=2))
+        records[1][0].group_id = 1
+        load_to_db(records)
+        citation_graph = graph.from_database()
+        self.assertEqual(citation_graph.eids.tolist(), [1, 2, 1001, 1002])
+        self.assertEqual(citation_graph.pub_year.tolist(), [2015, 2015, -1, -1])
+        self.assertEqual(citation_graph.group_id.tolist(), [-1, 1, -1, -1])
+        self.assertEqual(citation_graph.cited_by(1).tolist(), [2, 1001])
+
+        directory = tempfile.mkdtemp()
+        try:
+            citation_graph.save(directory)
+            loaded = graph.CitationGraph.load(directory)
+            np.testing.assert_array_equal(loaded.pagerank(), citation_graph.pagerank())
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,118 @@
+import io
+import os
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import zipfile
+
+from django.test import SimpleTestCase
+
+from Scopus import lazy
+
+
+def _member_data(eid):
+    """Document and citedby XML, as read by `_extract`"""
+    return [('2-s2.0-%d.xml' % eid, ('Document %d' % eid).encode('utf-8')),
+            ('citedby.xml', str(eid + 1000).encode('utf-8'))]
+
+
+def _extract(tup, fields=None):
+    """Stands in for `workers.extract_item`, on the XML of `_member_data`"""
+    eid, doc_xml, citedby_xml = tup
+    return {'document': {'eid': int(eid), 'doi': None, 'pub-year': 2015, 'group-id': None,
+                         'title': doc_xml.decode('utf-8'),
+                         'source': ('1', 'Journal 1', 'J 1', 'j', '00000001', None),
+                         'title_language': 'eng', 'citation_type': 'ar', 'abstract': '',
+                         'authors': {}, 'itemid': {'SGR': eid}},
+            'citation': {'count': 1, 'eid': [int(citedby_xml)]}}
+
+
+def _add_to_tar(tf, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tf.addfile(info, io.BytesIO(data))
+
+
+class LazySnapshotTests(SimpleTestCase):
+
+    def setUp(self):
+        # documents 1 and 2 in a directory, 3 and 4 in a zip, 5 and 6 in an
+        # uncompressed tar, and 7 and 8 in a compressed tar
+        self.tmp_dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp_dir, 'snapshot')
+        for eid in (1, 2):
+            directory = os.path.join(self.root, '2015', '2-s2.0-%d' % eid)
+            os.makedirs(directory)
+            for name, data in _member_data(eid):
+                with open(os.path.join(directory, name), 'wb') as f:
+                    f.write(data)
+        with zipfile.ZipFile(os.path.join(self.root, '2016.zip'), 'w') as zf:
+            for eid in (3, 4):
+                for name, data in _member_data(eid):
+                    zf.writestr('2016/2-s2.0-%d/%s' % (eid, name), data)
+        for name, mode, eids in [('2017.tar', 'w', (5, 6)), ('2018.tar.gz', 'w:gz', (7, 8))]:
+            with tarfile.open(os.path.join(self.root, name), mode) as tf:
+                for eid in eids:
+                    for member, data in _member_data(eid):
+                        _add_to_tar(tf, '%s/2-s2.0-%d/%s' % (name[:4], eid, member), data)
+        self.index_path = os.path.join(self.tmp_dir, 'index.sqlite3')
+        self.assertEqual(lazy.build_index(self.index_path, [self.root]), 8)
+        lazy.extract_item = _extract
+
+    def tearDown(self):
+        del lazy.extract_item
+        shutil.rmtree(self.tmp_dir)
+
+    def _kinds(self):
+        connection = sqlite3.connect(self.index_path)
+        try:
+            return sorted((os.path.basename(path), kind) for path, kind in
+                          connection.execute('SELECT path, kind FROM archive'))
+        finally:
+            connection.close()
+
+    def test_index(self):
+        # each document directory is indexed as found by `_iter_sources`
+        self.assertEqual(self._kinds(), [('2-s2.0-1', 'directory'), ('2-s2.0-2', 'directory'),
+                                         ('2016.zip', 'zip'), ('2017.tar', 'tar'),
+                                         ('2018.tar.gz', 'stream')])
+        # unchanged archives are not indexed again
+        self.assertEqual(lazy.build_index(self.index_path, [self.root]), 0)
+        with lazy.LazySnapshot(self.index_path) as snapshot:
+            self.assertEqual(len(snapshot), 8)
+            self.assertEqual(snapshot.eids(), list(range(1, 9)))
+            self.assertIn(3, snapshot)
+            self.assertNotIn(9, snapshot)
+
+    def test_read_from_each_kind(self):
+        with lazy.LazySnapshot(self.index_path) as snapshot:
+            documents = snapshot.get_many(range(1, 10))
+            self.assertEqual(sorted(documents), list(range(1, 9)))
+            for eid, document in documents.items():
+                self.assertEqual(document.title, 'Document %d' % eid)
+                self.assertEqual(document.citations, [lazy.Citation(eid, eid + 1000)])
+                self.assertEqual(document.source.scopus_source_id, 1)
+            self.assertEqual(snapshot.n_read, 8)
+            # extracted documents are cached
+            self.assertEqual(snapshot[5].eid, 5)
+            self.assertEqual(snapshot.n_read, 8)
+            self.assertIsNone(snapshot.get(9))
+            with self.assertRaises(KeyError):
+                snapshot[9]
+
+    def test_cache_dir(self):
+        cache_dir = os.path.join(self.tmp_dir, 'cache')
+        with lazy.LazySnapshot(self.index_path, cache_dir=cache_dir) as snapshot:
+            snapshot.get_many([2, 4, 6, 8])
+            self.assertEqual(snapshot.n_read, 4)
+        # another snapshot reads the XML kept on disk, not the archives
+        with lazy.LazySnapshot(self.index_path, cache_dir=cache_dir) as snapshot:
+            documents = snapshot.get_many([2, 4, 6, 8])
+            self.assertEqual(snapshot.n_read, 0)
+            self.assertEqual(documents[8].title, 'Document 8')
+            self.assertEqual(documents[8].citations, [lazy.Citation(8, 1008)])
+
+    def test_no_index(self):
+        with self.assertRaises(ValueError):
+            lazy.LazySnapshot(os.path.join(self.tmp_dir, 'missing.sqlite3'))
@@ -0,0 +1,113 @@
+from django.test import TestCase, override_settings
+
+from Scopus import rollups
+from Scopus import sharding
+from Scopus.db_loader import load_to_db
+from Scopus.models import AuthorMetrics, Authorship, DocumentSummary
+from Scopus.tests.utils import make_record, make_source
+
+
+SHARDS = [('default', None, 2014), ('shard', 2015, None)]
+
+
+def _records(citation_counts):
+    """Documents 1, 2, ... with these citation counts, all by author 100
+
+    Odd EIDs are published in 2010, even in 2016.
+    """
+    source = make_source()
+    records = []
+    for eid, citation_count in enumerate(citation_counts, 1):
+        record = make_record(eid, 2010 if eid % 2 else 2016, source)
+        record[0].citation_count = citation_count
+        record[2][0].author_id = 100
+        records.append(record)
+    return records
+
+
+@override_settings(SCOPUS_SHARDS=SHARDS)
+class ShardedRebuildTests(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        sharding._replicated.clear()
+        self._fetch_size = rollups.FETCH_SIZE
+        # several fetches from each shard
+        rollups.FETCH_SIZE = 2
+        load_to_db(_records([5, 3, 1, 4, 2, 6, 0]))
+
+    def tearDown(self):
+        rollups.FETCH_SIZE = self._fetch_size
+
+    def test_rebuild_reads_every_shard(self):
+        self.assertEqual(rollups.rebuild()['author_metrics'], 1)
+        metrics = AuthorMetrics.objects.get(pk=100)
+        self.assertEqual((metrics.n_documents, metrics.first_year, metrics.last_year,
+                          metrics.n_citations, metrics.h_index),
+                         (7, 2010, 2016, 21, 3))
+        self.assertFalse(AuthorMetrics.objects.using('shard').exists())
+
+    def test_rebuild_one_database(self):
+        rollups.rebuild(using='shard')
+        metrics = AuthorMetrics.objects.using('shard').get(pk=100)
+        self.assertEqual((metrics.n_documents, metrics.n_citations, metrics.h_index),
+                         (3, 13, 3))
+
+    def test_pages(self):
+        self.assertEqual([page[:, 1].tolist() for page in rollups._pages('author_id', 'shard')],
+                         [[2, 4], [6]])
+
+    def test_authors_counted_once_per_document(self):
+        Authorship.objects.using('shard').create(document_id=2, author_id=100, order=2,
+                                                 surname='Author')
+        rollups.rebuild()
+        self.assertEqual(AuthorMetrics.objects.get(pk=100).n_documents, 7)
+
+    def test_key_rows_merged(self):
+        groups = list(rollups._key_rows('author_id', sharding.read_aliases()))
+        self.assertEqual(len(groups), 1)
+        self.assertEqual(groups[0][:, 3].tolist(), [6, 5, 4, 3, 2, 1, 0])
+
+    def test_summary_reads_every_shard(self):
+        self.assertEqual(rollups.rebuild_summary(), 2)
+        self.assertEqual(sorted(DocumentSummary.objects.values_list(
+            'pub_year', 'n_documents', 'n_citations')),
+            [(2010, 4, 8), (2016, 3, 13)])
+        self.assertEqual(rollups.check_summary(), [])
+        DocumentSummary.objects.filter(pub_year=2016).delete()
+        self.assertEqual(rollups.check_summary(),
+                         [((2016, 'ar', '', 'j'), None, (3, 13))])
+
+
+@override_settings(SCOPUS_ROLLUPS=True)
+class SummaryTests(TestCase):
+
+    def setUp(self):
+        # loaded in two batches, each adding to the summary
+        records = _records([5, 3, 1, 2])
+        records[3][0].citation_type = 're'
+        load_to_db(records[:2])
+        load_to_db(records[2:])
+
+    def test_updated_by_loading(self):
+        self.assertEqual(rollups.summarize(),
+                         [{'pub_year': 2010, 'n_documents': 2, 'n_citations': 6},
+                          {'pub_year': 2016, 'n_documents': 2, 'n_citations': 5}])
+        self.assertEqual(rollups.check_summary(), [])
+
+    def test_summarize_filtered(self):
+        self.assertEqual(rollups.summarize(by=['citation_type'], pub_year__gte=2015),
+                         [{'citation_type': 'ar', 'n_documents': 1, 'n_citations': 3},
+                          {'citation_type': 're', 'n_documents': 1, 'n_citations': 2}])
+
+    def test_rebuild_summary(self):
+        expected = rollups._summary_rows()
+        with self.settings(SCOPUS_ROLLUPS=False):
+            load_to_db(_records([0, 0, 0, 0, 7])[4:])
+        self.assertEqual(rollups.check_summary(),
+                         [((2010, 'ar', '', 'j'), (2, 6), (3, 13))])
+        DocumentSummary.objects.filter(pub_year=2016).delete()
+        self.assertEqual(rollups.rebuild_summary(), 3)
+        expected[(2010, 'ar', '', 'j')] = (3, 13)
+        self.assertEqual(rollups._summary_rows(), expected)
+        self.assertEqual(rollups.check_summary(), [])
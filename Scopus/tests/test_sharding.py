@@ -0,0 +1,124 @@
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from Scopus import compression
+from Scopus import sharding
+from Scopus.db_loader import _save_records, load_to_db
+from Scopus.models import Authorship, Citation, Document, ItemID, Source
+from Scopus.tests.utils import make_record, make_source
+
+
+SHARDS = [('default', None, 2014), ('shard', 2015, None)]
+
+
+@override_settings(SCOPUS_SHARDS=SHARDS)
+class ShardSelectionTests(SimpleTestCase):
+
+    def test_shard_for(self):
+        self.assertEqual(sharding.shard_for(1990), 'default')
+        self.assertEqual(sharding.shard_for(2014), 'default')
+        self.assertEqual(sharding.shard_for(2015), 'shard')
+
+    @override_settings(SCOPUS_SHARDS=[('default', 2000, 2009)])
+    def test_shard_for_out_of_range(self):
+        with self.assertRaises(ValueError):
+            sharding.shard_for(2010)
+
+    def test_locate_by_pub_year(self):
+        self.assertEqual(sharding.locate([1, 2]),
+                         [('default', [1, 2]), ('shard', [1, 2])])
+
+    @override_settings(SCOPUS_SHARD_KEY='eid',
+                       SCOPUS_SHARDS=[('default', None, 99), ('shard', 100, 199)])
+    def test_locate_by_eid(self):
+        self.assertEqual(sharding.locate([5, 150, 300, 7]),
+                         [('default', [5, 7]), ('shard', [150])])
+        self.assertEqual(sharding.locate([300]), [])
+
+    @override_settings(SCOPUS_SHARDS=None)
+    def test_locate_unsharded(self):
+        self.assertEqual(sharding.locate([1, 2]), [('default', [1, 2])])
+        self.assertEqual(sharding.read_aliases(), ['default'])
+
+    @override_settings(SCOPUS_SHARD_KEY='title')
+    def test_bad_shard_key(self):
+        with self.assertRaises(ValueError):
+            sharding.shard_key()
+
+    def test_group_records(self):
+        source = make_source()
+        records = [make_record(1, 2016, source), make_record(2, 2010, source),
+                   make_record(3, 2015, source)]
+        self.assertEqual([(alias, [record[0].eid for record in group])
+                          for alias, group in sharding.group_records(records)],
+                         [('shard', [1, 3]), ('default', [2])])
+
+    @override_settings(SCOPUS_SHARDS=[('default', 2000, 2009)])
+    def test_group_records_skips_documents_without_shard(self):
+        source = make_source()
+        records = [make_record(1, 2005, source), make_record(2, 2010, source)]
+        groups = sharding.group_records(records)
+        self.assertEqual([(alias, [record[0].eid for record in group])
+                          for alias, group in groups],
+                         [('default', [1])])
+
+    def test_is_sharded(self):
+        self.assertTrue(sharding.is_sharded(Document))
+        self.assertTrue(sharding.is_sharded(Authorship))
+        self.assertFalse(sharding.is_sharded(Source))
+
+    def test_router_allows_relations_to_sources(self):
+        router = sharding.ShardRouter()
+        document = Document(eid=1)
+        self.assertTrue(router.allow_relation(make_source(), document))
+        self.assertTrue(router.allow_relation(document, make_source()))
+        self.assertIsNone(router.allow_relation(document, Authorship()))
+
+
+class SaveRecordsTests(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        sharding._replicated.clear()
+
+    def assertEids(self, model, using, eids, field='document_id'):
+        self.assertEqual(sorted(model.objects.using(using).values_list(field, flat=True)),
+                         eids)
+
+    def test_save_records_to_alias(self):
+        source = make_source()
+        source.save()
+        sharding.replicate_sources([source], 'shard')
+        _save_records([make_record(1, 2016, source), make_record(2, 2017, source)],
+                      using='shard')
+        self.assertEids(Document, 'shard', [1, 2], field='eid')
+        self.assertEids(Authorship, 'shard', [1, 2])
+        self.assertEids(ItemID, 'shard', [1, 2])
+        self.assertEids(Citation, 'shard', [1, 2], field='cite_to')
+        self.assertEids(compression.abstract_model(), 'shard', [1, 2])
+        self.assertEids(Document, 'default', [], field='eid')
+
+    @override_settings(SCOPUS_SHARDS=SHARDS)
+    def test_load_to_db_shards_records(self):
+        records = [make_record(1, 2016, make_source(1)),
+                   make_record(2, 2010, make_source(2)),
+                   make_record(3, 2015, make_source(1))]
+        load_to_db(records)
+        self.assertEids(Document, 'default', [2], field='eid')
+        self.assertEids(Document, 'shard', [1, 3], field='eid')
+        self.assertEids(Authorship, 'default', [2])
+        self.assertEids(Authorship, 'shard', [1, 3])
+        self.assertEids(Citation, 'shard', [1, 3], field='cite_to')
+
+        # sources are allocated in the default database, and replicated
+        default_sources = dict(Source.objects.values_list('scopus_source_id', 'pk'))
+        self.assertEqual(sorted(default_sources), [1, 2])
+        self.assertEqual(list(Source.objects.using('shard').values_list('scopus_source_id', 'pk')),
+                         [(1, default_sources[1])])
+        document = Document.objects.using('shard').get(eid=3)
+        self.assertEqual(document.source.scopus_source_id, 1)
+
+    @override_settings(SCOPUS_SHARDS=SHARDS)
+    def test_document_exists(self):
+        load_to_db([make_record(1, 2016, make_source())])
+        self.assertTrue(sharding.document_exists(1))
+        self.assertFalse(sharding.document_exists(2))
@@ -0,0 +1,93 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from django.db import connection
+from django.test import TransactionTestCase
+
+from Scopus import sqlite_shards
+from Scopus.db_loader import load_to_db
+from Scopus.models import Authorship, Citation, Document, ItemID, Source
+from Scopus.tests.utils import make_record, make_source
+
+
+def _insert(db, objs):
+    """Write model instances to a sqlite3 connection, as a worker would"""
+    for obj in objs:
+        fields = [field for field in obj._meta.concrete_fields
+                  if getattr(obj, field.attname) is not None]
+        db.execute('INSERT INTO %s (%s) VALUES (%s)'
+                   % (obj._meta.db_table, ', '.join('"%s"' % field.column for field in fields),
+                      ', '.join('?' * len(fields))),
+                   [field.get_db_prep_save(getattr(obj, field.attname), connection)
+                    for field in fields])
+
+
+class MergeShardsTests(TransactionTestCase):
+    """Shards merged into the main database, as after `--sqlite-shards`"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        # the main database's schema, in a file for create_shard
+        self.main_path = os.path.join(self.tmp_dir, 'main.sqlite3')
+        main = sqlite3.connect(self.main_path)
+        cursor = connection.cursor()
+        cursor.execute("SELECT sql FROM sqlite_master WHERE sql IS NOT NULL "
+                       "AND name NOT LIKE 'sqlite_%' AND tbl_name NOT LIKE '%_fts%' "
+                       "ORDER BY type != 'table'")
+        for sql, in cursor.fetchall():
+            main.execute(sql)
+        main.commit()
+        main.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _shard(self, name, source_ids, records):
+        """A shard of records, with its own ids for their sources"""
+        path = os.path.join(self.tmp_dir, 'shard-%s.sqlite3' % name)
+        sqlite_shards.create_shard(path, self.main_path)
+        db = sqlite3.connect(path)
+        sources = {}
+        for record in records:
+            source = record[0].source
+            source.pk = source_ids[source.scopus_source_id]
+            sources[source.pk] = source
+            record[0].source_id = source.pk
+        _insert(db, sources.values())
+        for record in records:
+            _insert(db, [record[0]])
+            for objs in record[1:]:
+                _insert(db, objs)
+        db.commit()
+        db.close()
+
+    def test_merge_counts(self):
+        # already in the main database
+        load_to_db([make_record(1, 2015, make_source(1))])
+        self._shard(1, {1: 1}, [make_record(1, 2015, make_source(1)),
+                                make_record(2, 2015, make_source(1))])
+        # ids assigned independently in each shard
+        self._shard(2, {1: 2, 2: 1}, [make_record(2, 2016, make_source(2)),
+                                      make_record(3, 2016, make_source(1)),
+                                      make_record(4, 2016, make_source(2))])
+
+        self.assertEqual(sqlite_shards.merge_shards(self.tmp_dir), 2)
+        self.assertEqual(sorted(Document.objects.values_list('eid', 'pub_year')),
+                         [(1, 2015), (2, 2015), (3, 2016), (4, 2016)])
+        # records of documents already merged are not copied again
+        for model in (ItemID, Authorship, Citation):
+            self.assertEqual(model.objects.count(), 4, model)
+        self.assertEqual(Source.objects.count(), 2)
+        self.assertEqual(sorted(Document.objects.values_list('eid', 'source__scopus_source_id')),
+                         [(1, 1), (2, 1), (3, 1), (4, 2)])
+        # shards are removed once merged
+        self.assertEqual(os.listdir(self.tmp_dir), ['main.sqlite3'])
+
+    def test_merge_shard_returns_documents_added(self):
+        self._shard(1, {1: 1}, [make_record(1, 2015, make_source(1)),
+                                make_record(2, 2015, make_source(1))])
+        path = os.path.join(self.tmp_dir, 'shard-1.sqlite3')
+        self.assertEqual(sqlite_shards.merge_shard(path), 2)
+        self.assertEqual(sqlite_shards.merge_shard(path), 0)
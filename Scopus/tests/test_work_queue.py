@@ -0,0 +1,138 @@
+import datetime
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from Scopus import work_queue
+from Scopus.models import ArchiveLease
+
+
+class LeasePathTests(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for year, eid in [(2015, 1), (2015, 2), (2016, 3)]:
+            directory = os.path.join(self.root, 'extracted', str(year), '2-s2.0-%d' % eid)
+            os.makedirs(directory)
+            open(os.path.join(directory, '2-s2.0-%d.xml' % eid), 'w').close()
+        os.makedirs(os.path.join(self.root, 'flat'))
+        open(os.path.join(self.root, 'flat', '2-s2.0-4.xml'), 'w').close()
+        open(os.path.join(self.root, '2017.zip'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_year_directories_are_leased_whole(self):
+        self.assertEqual([os.path.relpath(path, self.root)
+                          for path in work_queue._iter_lease_paths(self.root)],
+                         ['2017.zip',
+                          os.path.join('extracted', '2015'),
+                          os.path.join('extracted', '2016'),
+                          'flat'])
+
+
+class WorkQueueTests(TestCase):
+
+    def test_register_once(self):
+        self.assertEqual(work_queue.register(['/data/2014.zip', '/data/2015.zip']), 2)
+        self.assertEqual(work_queue.register(['/data/2015.zip', '/data/2016.zip']), 1)
+        self.assertEqual(ArchiveLease.objects.count(), 3)
+
+    def test_insert_ignores_paths_registered_meanwhile(self):
+        ArchiveLease.objects.create(path='/data/2015.zip')
+        self.assertEqual(work_queue._insert(['/data/2014.zip', '/data/2015.zip',
+                                             '/data/2016.zip']), 2)
+        self.assertEqual(sorted(ArchiveLease.objects.values_list('path', flat=True)),
+                         ['/data/2014.zip', '/data/2015.zip', '/data/2016.zip'])
+
+    def test_run(self):
+        work_queue.register(['/data/2014.zip', '/data/2015.zip'])
+        loaded = []
+
+        def load(path, on_batch):
+            loaded.append(path)
+            on_batch(10)
+            if path.endswith('2015.zip'):
+                raise RuntimeError('corrupt archive')
+
+        work_queue.run(load, owner='test')
+        self.assertEqual(loaded, ['/data/2014.zip', '/data/2015.zip'])
+        progress = work_queue.progress()
+        self.assertEqual(progress['done'], {'archives': 1, 'pairs': 10})
+        self.assertEqual(progress['failed'], {'archives': 1, 'pairs': 10})
+
+        self.assertEqual(work_queue.reset_failed(), 1)
+        self.assertEqual(work_queue.claim('test').path, '/data/2015.zip')
+
+    def test_claim_takes_over_expired_lease(self):
+        work_queue.register(['/data/2014.zip'])
+        lease = work_queue.claim('first')
+        self.assertIsNone(work_queue.claim('second'))
+        ArchiveLease.objects.filter(pk=lease.pk).update(
+            lease_expires=timezone.now() - datetime.timedelta(seconds=1), n_pairs=5)
+        lease = work_queue.claim('second')
+        self.assertEqual((lease.owner, lease.attempts, lease.n_pairs), ('second', 2, 0))
+        # the first owner can no longer renew or finish it
+        first = ArchiveLease(pk=lease.pk, owner='first')
+        self.assertFalse(work_queue.renew(first))
+        self.assertFalse(work_queue.finish(first))
+
+
+class HeartbeatTests(SimpleTestCase):
+
+    def setUp(self):
+        self._renew = work_queue.renew
+        self._retry_seconds = work_queue.RETRY_SECONDS
+        work_queue.RETRY_SECONDS = 0.01
+
+    def tearDown(self):
+        work_queue.renew = self._renew
+        work_queue.RETRY_SECONDS = self._retry_seconds
+
+    def test_lost_when_renewal_fails_until_expiry(self):
+        attempts = []
+
+        def renew(*args):
+            attempts.append(args)
+            raise RuntimeError('database unavailable')
+
+        work_queue.renew = renew
+        lease = ArchiveLease(pk=1, path='/data/2014.zip', owner='test')
+        with work_queue.Heartbeat(lease, lease_seconds=0.3) as heartbeat:
+            heartbeat._thread.join(5)
+            self.assertTrue(heartbeat.lost)
+            with self.assertRaises(work_queue.LeaseLost):
+                heartbeat.update(1)
+        # retried before giving up
+        self.assertGreater(len(attempts), 1)
+
+    def test_retry_recovers(self):
+        attempts = []
+
+        def renew(*args):
+            attempts.append(args)
+            if len(attempts) == 1:
+                raise RuntimeError('database unavailable')
+            return True
+
+        work_queue.renew = renew
+        lease = ArchiveLease(pk=1, path='/data/2014.zip', owner='test')
+        with work_queue.Heartbeat(lease, lease_seconds=0.3) as heartbeat:
+            for _ in range(100):
+                if len(attempts) >= 4:
+                    break
+                heartbeat._thread.join(0.05)
+            self.assertGreaterEqual(len(attempts), 4)
+            heartbeat.update(1)
+            self.assertFalse(heartbeat.lost)
+
+    def test_lost_when_taken_over(self):
+        work_queue.renew = lambda *args: False
+        lease = ArchiveLease(pk=1, path='/data/2014.zip', owner='test')
+        with work_queue.Heartbeat(lease, lease_seconds=0.03) as heartbeat:
+            heartbeat._thread.join(5)
+            with self.assertRaises(work_queue.LeaseLost):
+                heartbeat.update(1)
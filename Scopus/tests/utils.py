@@ -0,0 +1,23 @@
+"""Records for tests, built as the loader would"""
+
+from Scopus import compression
+from Scopus.models import Authorship, Citation, Document, ItemID, Source
+
+
+def make_source(scopus_source_id=1):
+    return Source(scopus_source_id=scopus_source_id, source_type='j',
+                  source_title='Journal %d' % scopus_source_id,
+                  source_abbrev='J %d' % scopus_source_id,
+                  issn_print='%08d' % scopus_source_id)
+
+
+def make_record(eid, pub_year, source):
+    """A doc_record as produced by db_loader.aggregate_records"""
+    document = Document(eid=eid, pub_year=pub_year, title='Document %d' % eid,
+                        source=source, citation_count=1, citation_type='ar')
+    return (document,
+            [ItemID(document_id=eid, item_id=str(eid), item_type='SGR')],
+            [Authorship(document_id=eid, surname='Author', order=1,
+                        country='aus', city='Sydney')],
+            [Citation(cite_to=eid, cite_from=eid + 1000)],
+            [compression.abstract_model()(document_id=eid, abstract='Abstract %d' % eid)])
@@ -13,9 +13,12 @@ Including another URLconf
     1. Import the include() function: from django.conf.urls import url, include
     2. Add a URL to urlpatterns:  url(r'^blog/', include('blog.urls'))
 """
-from django.conf.urls import url
+from django.conf.urls import url, include
 from django.contrib import admin
 
+from Scopus import api
+
 urlpatterns = [
+    url(r'^api/', include(api.urlpatterns)),
     url(r'^/?', admin.site.urls),
 ]
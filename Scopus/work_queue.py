@@ -0,0 +1,287 @@
+"""Lease-based queue of archives, for loading from several hosts at once
+
+Each archive to be loaded has an `ArchiveLease` row. A loader process
+claims a pending archive by atomically setting itself as owner, with a lease
+expiry time, and renews the lease from a heartbeat thread while it loads.
+If a loader dies, its lease expires and another loader takes the archive
+over. Archives are leased whole, as are directories of extracted documents
+(typically a year each). An archive that is taken over is read again from
+the start, but documents already saved are skipped before their XML is
+parsed.
+"""
+
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+
+import django.db
+from django.db import IntegrityError, transaction
+from django.db.models import Q, F, Count, Sum
+from django.utils import timezone
+
+from Scopus.models import ArchiveLease
+from Scopus.archives import _EID_RE
+from Scopus.xml_extract import json_log
+
+
+LEASE_SECONDS = 600
+
+# First wait before retrying a failed renewal, doubled on each failure
+RETRY_SECONDS = 1
+
+
+class LeaseLost(Exception):
+    """Another loader has taken over the archive"""
+
+
+def default_owner():
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def _iter_lease_paths(path, path_filter=None, root=True):
+    """Split path into archives and directories of documents
+
+    A directory directly holding XML files or document directories
+    (2-s2.0-<eid>) is a single unit, rather than one per document. Other
+    directories are split into their children.
+    """
+    if path_filter is not None and not path_filter.allow_source(path, root=root):
+        return
+    if not os.path.isdir(path):
+        yield path
+        return
+    children = sorted(os.listdir(path))
+    if any(child.endswith('.xml') or _EID_RE.search(child) for child in children):
+        yield path
+        return
+    for child in children:
+        for lease_path in _iter_lease_paths(os.path.join(path, child),
+                                            path_filter=path_filter, root=False):
+            yield lease_path
+
+
+def register(paths, path_filter=None):
+    """Add a lease row for each archive in paths, if not already present
+
+    Directories are split into archives and directories of documents,
+    omitting any that path_filter (an `archives.PathFilter`) excludes.
+    Returns the number of archives newly registered.
+    """
+    sources = [path for path_arg in paths
+               for path in _iter_lease_paths(path_arg, path_filter=path_filter)]
+    existing = set()
+    for start in range(0, len(sources), 500):
+        existing.update(ArchiveLease.objects
+                        .filter(path__in=sources[start:start + 500])
+                        .values_list('path', flat=True))
+    return _insert([path for path in sources if path not in existing])
+
+
+def _insert(paths):
+    """Add a lease row for each path, ignoring those present
+
+    Loaders starting together may register the same paths at once. Returns
+    the number of rows added.
+    """
+    n_added = 0
+    for start in range(0, len(paths), 500):
+        batch = [ArchiveLease(path=path) for path in paths[start:start + 500]]
+        try:
+            with transaction.atomic():
+                ArchiveLease.objects.bulk_create(batch)
+            n_added += len(batch)
+            continue
+        except IntegrityError:
+            pass
+        # another loader registered some meanwhile
+        for lease in batch:
+            try:
+                with transaction.atomic():
+                    lease.save(force_insert=True)
+                n_added += 1
+            except IntegrityError:
+                pass
+    return n_added
+
+
+def claim(owner, lease_seconds=LEASE_SECONDS):
+    """Claim a pending archive, or one whose lease has expired
+
+    Returns an ArchiveLease, or None if no archive is available.
+    """
+    while True:
+        now = timezone.now()
+        available = (Q(status=ArchiveLease.PENDING) |
+                     Q(status=ArchiveLease.RUNNING, lease_expires__lt=now))
+        candidate = ArchiveLease.objects.filter(available).order_by('id').first()
+        if candidate is None:
+            return None
+        # Compare and swap: only succeeds if nobody claimed it meanwhile
+        n_updated = ArchiveLease.objects.filter(
+            available,
+            pk=candidate.pk,
+            owner=candidate.owner,
+            attempts=candidate.attempts,
+        ).update(status=ArchiveLease.RUNNING,
+                 owner=owner,
+                 lease_expires=now + datetime.timedelta(seconds=lease_seconds),
+                 attempts=F('attempts') + 1,
+                 n_pairs=0,
+                 updated=now)
+        if n_updated == 1:
+            candidate.refresh_from_db()
+            if candidate.attempts > 1:
+                json_log(info='Taking over archive from expired lease',
+                         path=candidate.path,
+                         attempts=candidate.attempts)
+            return candidate
+
+
+def renew(lease, lease_seconds=LEASE_SECONDS, n_pairs=None):
+    """Extend lease, returning False if it is no longer held"""
+    now = timezone.now()
+    changes = {'lease_expires': now + datetime.timedelta(seconds=lease_seconds),
+               'updated': now}
+    if n_pairs is not None:
+        changes['n_pairs'] = n_pairs
+    return bool(ArchiveLease.objects.filter(pk=lease.pk, owner=lease.owner,
+                                            status=ArchiveLease.RUNNING)
+                .update(**changes))
+
+
+def finish(lease, status=ArchiveLease.DONE, n_pairs=None):
+    changes = {'status': status, 'lease_expires': None,
+               'updated': timezone.now()}
+    if n_pairs is not None:
+        changes['n_pairs'] = n_pairs
+    return bool(ArchiveLease.objects.filter(pk=lease.pk, owner=lease.owner)
+                .update(**changes))
+
+
+def reset_failed():
+    """Make failed archives available to be claimed again"""
+    return (ArchiveLease.objects.filter(status=ArchiveLease.FAILED)
+            .update(status=ArchiveLease.PENDING, owner=None))
+
+
+def progress():
+    """Summarise the state of all archives
+
+    Returns a dict of status to {'archives': ..., 'pairs': ...}, with
+    'expired' counting running archives whose lease has expired.
+    """
+    out = {status: {'archives': 0, 'pairs': 0}
+           for status, _ in ArchiveLease._meta.get_field('status').choices}
+    for row in (ArchiveLease.objects.values('status')
+                .annotate(archives=Count('id'), pairs=Sum('n_pairs'))):
+        out[row['status']] = {'archives': row['archives'],
+                              'pairs': row['pairs'] or 0}
+    out['expired'] = ArchiveLease.objects.filter(
+        status=ArchiveLease.RUNNING, lease_expires__lt=timezone.now()).count()
+    return out
+
+
+class Heartbeat(object):
+    """Renews a lease in a background thread while an archive is loaded
+
+    `update(n_pairs)` records progress, and raises LeaseLost if the
+    heartbeat found that the lease is no longer held. A renewal failing
+    with a database error is retried, until the lease would have expired;
+    the lease is then treated as lost, as another loader may take over.
+    """
+
+    def __init__(self, lease, lease_seconds=LEASE_SECONDS):
+        self.lease = lease
+        self.lease_seconds = lease_seconds
+        self.n_pairs = 0
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name='lease-heartbeat')
+        self._thread.daemon = True
+
+    def _run(self):
+        expires = time.time() + self.lease_seconds
+        wait = self.lease_seconds / 3.
+        retry_wait = RETRY_SECONDS
+        try:
+            while not self._stop.wait(wait):
+                started = time.time()
+                try:
+                    held = renew(self.lease, self.lease_seconds, self.n_pairs)
+                except Exception:
+                    json_log(error='Failed to renew lease',
+                             context={'path': self.lease.path},
+                             exception=True)
+                    # reconnect on the next attempt
+                    django.db.connections.close_all()
+                    if time.time() >= expires:
+                        self.lost = True
+                        return
+                    wait = min(retry_wait, expires - time.time())
+                    retry_wait *= 2
+                    continue
+                if not held:
+                    self.lost = True
+                    return
+                expires = started + self.lease_seconds
+                wait = self.lease_seconds / 3.
+                retry_wait = RETRY_SECONDS
+        finally:
+            django.db.connections.close_all()
+
+    def update(self, n_pairs):
+        self.n_pairs = n_pairs
+        if self.lost:
+            raise LeaseLost(self.lease.path)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def run(load, owner=None, lease_seconds=LEASE_SECONDS):
+    """Claim and load archives until none remain
+
+    Parameters
+    ----------
+    load : callable
+        Called as load(path, on_batch) to load the archive at path, where
+        on_batch(n_pairs) should be called after each batch is saved.
+    owner : string, optional
+        Identifies this loader. Default is host:pid.
+    lease_seconds : int
+    """
+    if owner is None:
+        owner = default_owner()
+    while True:
+        lease = claim(owner, lease_seconds)
+        if lease is None:
+            break
+        logging.warning('%s claimed %s' % (owner, lease.path))
+        try:
+            with Heartbeat(lease, lease_seconds) as heartbeat:
+                load(lease.path, heartbeat.update)
+        except LeaseLost:
+            json_log(error='Lost lease; abandoning archive',
+                     context={'path': lease.path, 'owner': owner},
+                     method=logging.error)
+            continue
+        except Exception:
+            json_log(error='Failed to load archive',
+                     context={'path': lease.path, 'owner': owner},
+                     exception=True,
+                     method=logging.error)
+            finish(lease, status=ArchiveLease.FAILED,
+                   n_pairs=heartbeat.n_pairs)
+            continue
+        finish(lease, n_pairs=heartbeat.n_pairs)
+        json_log(info='Finished archive', path=lease.path,
+                 n_pairs=heartbeat.n_pairs, progress=progress())
@@ -0,0 +1,91 @@
+"""Tasks run in extraction worker processes
+
+Nothing here imports Django, so that workers which only extract from XML
+(see `--lean-workers` in db_loader) start in milliseconds and stay small,
+even where processes are started by spawn (Windows, macOS) rather than
+fork.
+"""
+
+import importlib
+import logging
+import os
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+from Scopus import profiling
+from Scopus.xml_extract import (
+    extract_document_information,
+    extract_document_citations,
+    json_log,
+)
+
+
+def extract_item(tup, fields=None, with_eids=True):
+    """Extract from a pair of XML documents
+
+    Parameters
+    ----------
+    tup : tuple
+        (path, document XML, citedby XML) as from `generate_xml_pairs`
+    fields : iterable of strings, optional
+        Passed to `extract_document_information`
+    with_eids : boolean, default True
+        Passed to `extract_document_citations`
+
+    Returns
+    -------
+    item : None in case of failure; otherwise dict
+        Key 'document' points to the output of `extract_document_information`.
+        Key 'citation' points to the output of `extract_document_citations`.
+    """
+    path, doc_file, citedby_file = tup
+    try:
+        item = {'document': extract_document_information(doc_file,
+                                                         fields=fields),
+                'citation': extract_document_citations(citedby_file,
+                                                       with_eids=with_eids)}
+    except Exception:
+        json_log(error='Uncaught error in extraction from XML',
+                 context={'path': path},
+                 exception=True)
+        return
+
+    if item['document'] is not None:
+        return item
+
+
+def init_worker(created_time, modules=(), profile=None):
+    """Pool initializer reporting how long the worker took to be ready
+
+    Parameters
+    ----------
+    created_time : float
+        time.time() when the pool was created
+    modules : iterable of strings
+        Modules to import before the worker is considered ready. These are
+        already imported if the worker was forked from a process (or a
+        forkserver) that preloaded them.
+    profile : dict, optional
+        If given, profile the worker with `profiling.start(**profile)`
+    """
+    if profile is not None:
+        profiling.start(**profile)
+    if not logging.getLogger().handlers:
+        # spawned workers do not inherit logging configuration
+        logging.basicConfig(format="%(asctime)-15s %(message)s")
+    for name in modules:
+        importlib.import_module(name)
+    if resource is None:
+        max_rss_kb = None
+    else:
+        max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    json_log(info='Worker ready',
+             pid=os.getpid(),
+             startup_seconds=round(time.time() - created_time, 4),
+             max_rss_kb=max_rss_kb,
+             method=logging.warning)
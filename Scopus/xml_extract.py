@@ -5,7 +5,22 @@ import json
 import traceback
 import re
 
-from django.utils.encoding import smart_text
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+
+def smart_text(s, encoding='utf-8', errors='strict'):
+    """Like django.utils.encoding.smart_text, which we avoid importing
+
+    This keeps extraction free of Django, and hence quick to import.
+    """
+    if isinstance(s, text_type):
+        return s
+    if isinstance(s, bytes):
+        return s.decode(encoding, errors)
+    return text_type(s)
 
 
 def id_to_int(x):
@@ -75,7 +90,14 @@ def int_or_none(x):
     return int(x)
 
 
-def _get_data_from_doc(document, eid):
+# Parts of a document which are costly to extract and may be left out
+OPTIONAL_FIELDS = ('abstract', 'itemid', 'authors')
+
+
+def _get_data_from_doc(document, eid, fields=None):
+    if fields is None:
+        fields = OPTIONAL_FIELDS
+
     def doc_get_one(path, **kwargs):
         return xpath_get_one(document, path, context={'eid': eid}, **kwargs)
 
@@ -92,7 +114,10 @@ def _get_data_from_doc(document, eid):
         text = "".join(x for x in node.itertext())
         return _handle_unicode(text=re.sub('\s+', ' ', text).strip(), default=default)
 
-    abstract_node = doc_get_one('/xocs:doc/xocs:item/item/bibrecord/head/abstracts/abstract[@original="y"]', warn_zero=False)
+    if 'abstract' in fields:
+        abstract_node = doc_get_one('/xocs:doc/xocs:item/item/bibrecord/head/abstracts/abstract[@original="y"]', warn_zero=False)
+    else:
+        abstract_node = None
     if abstract_node is None:
         abstract_text = ''
     else:
@@ -115,11 +140,13 @@ def _get_data_from_doc(document, eid):
         'doi': _handle_unicode(doi_node),
     }
 
-    itemids = document.xpath('/xocs:doc/xocs:item/item/bibrecord/item-info/itemidlist/itemid', namespaces=NAMESPACES)
-    try:
-        data['itemid'] = {item.attrib['idtype']: item.text for item in itemids}
-    except KeyError:
-        json_log(eid=eid, error='Could not get idtype for itemid {!r}'.format(item.text), exception=True)
+    data['itemid'] = {}
+    if 'itemid' in fields:
+        itemids = document.xpath('/xocs:doc/xocs:item/item/bibrecord/item-info/itemidlist/itemid', namespaces=NAMESPACES)
+        try:
+            data['itemid'] = {item.attrib['idtype']: item.text for item in itemids}
+        except KeyError:
+            json_log(eid=eid, error='Could not get idtype for itemid {!r}'.format(item.text), exception=True)
 
     source = doc_get_one('/xocs:doc/xocs:item/item/bibrecord/head/source')
     if source is None:
@@ -135,7 +162,10 @@ def _get_data_from_doc(document, eid):
                           xpath_get_one(source, './issn[@type=\'electronic\']/text()', context={'eid': eid, 'srcid': srcid}, warn_zero=False),
                           )
 
-    authors_groups = document.xpath('/xocs:doc/xocs:item/item/bibrecord/head/author-group', namespaces=NAMESPACES)
+    if 'authors' in fields:
+        authors_groups = document.xpath('/xocs:doc/xocs:item/item/bibrecord/head/author-group', namespaces=NAMESPACES)
+    else:
+        authors_groups = []
 
     authors_list = defaultdict(dict)
     for authors_group in authors_groups:
@@ -199,7 +229,7 @@ def _parse(f):
     return etree.parse(f)
 
 
-def extract_document_information(document):
+def extract_document_information(document, fields=None):
     """Extract information from XML file of the document.
 
     Information includes but not limited to:
@@ -214,6 +244,9 @@ def extract_document_information(document):
     Parameters
     ----------
     document : XML string, path string or file object
+    fields : iterable of strings, optional
+        Which of OPTIONAL_FIELDS to extract. Those not listed are left empty,
+        skipping their XPath evaluation and text cleaning. Default: all.
 
     Returns
     -------
@@ -224,7 +257,7 @@ def extract_document_information(document):
 
     eid = id_to_int(xpath_get_one(document, '/xocs:doc/xocs:meta/xocs:eid/text()'))
     try:
-        data = _get_data_from_doc(document, eid)
+        data = _get_data_from_doc(document, eid, fields=fields)
     except Exception:
         json_log(method=logging.error, context={'eid': eid}, exception=True)
         return
@@ -232,20 +265,24 @@ def extract_document_information(document):
     return data
 
 
-def extract_document_citations(citation):
+def extract_document_citations(citation, with_eids=True):
     """Extract information from citedby XML file.
 
     Parameters
     ----------
     document : XML string, path string or file object
+    with_eids : boolean, default True
+        If False, only the count is extracted, and 'eid' is an empty list.
 
     Returns
     -------
     dict
     """
     citation = _parse(citation)
-    citations = citation.findall('citing-doc')
     count = int(citation.find('count').text)
+    if not with_eids:
+        return {'count': count, 'eid': []}
+    citations = citation.findall('citing-doc')
     return {'count': count,
             'eid': [id_to_int(ct.find('eid').text)
                     for ct in citations if citations]}
@@ -1,3 +1,3 @@
 set PYTHONPATH=%CD%
 set DJANGO_SETTINGS_MODULE=Scopus.settings
-python Scopus/db_loader.py %*
+python -m Scopus %*
@@ -1,2 +1,2 @@
 #!/bin/bash -x
-PYTHONPATH=`pwd` DJANGO_SETTINGS_MODULE=Scopus.settings python Scopus/db_loader.py $@
+PYTHONPATH=`pwd` DJANGO_SETTINGS_MODULE=Scopus.settings python -m Scopus $@
@@ -108,6 +108,10 @@ def setup_package():
                   'lxml>=3',
                   'python-dateutil',
               ],
+              extras_require={
+                  'graph': ['numpy'],
+                  'zstd': ['zstandard'],
+              },
               )
     finally:
         del sys.path[0]